@@ -0,0 +1,404 @@
+#! /usr/bin/python3
+"""Measure fanout throughput, CPU and memory costs against the number of clients.
+
+A server is run in this process, with one mount per stream format (raw,
+MPEG-TS, FLV and MP3). Feeder processes stream synthetic data to them
+at a set bitrate, as sources, and reader processes connect clients to
+them over the loopback, spread over the mounts. Every MARKER_INTERVAL
+seconds, the data sent by feeders holds a timestamped marker, which
+readers look for to measure the publish to client latency.
+
+Over the measurement window, after a warm up, this reports as JSON:
+
+- the throughput delivered to clients,
+- the server CPU time per delivered Gbit,
+- the server send() calls, and send(), recv() and poll() calls, per
+  delivered MB (recvmmsg() calls of MPEG-TS sources are not counted),
+- the 50th and 99th percentiles of the publish to client latency,
+- the server memory (RSS) growth per connected client.
+
+Run it from a built source tree:
+
+    PYTHONPATH=. python3 benchmarks/fanout.py --clients 1000 --bitrate 2000
+
+Extra server options, e.g. to compare socket tuning, can be given in a
+JSON configuration file with --config.
+"""
+
+import json
+import logging
+import multiprocessing
+import optparse
+import os
+import resource
+import selectors
+import socket
+import statistics
+import struct
+import tempfile
+import time
+
+from savate.server import TCPServer
+
+MARKER = b"SVTBENCH"
+MARKER_SIZE = len(MARKER) + 8
+MARKER_INTERVAL = 0.1
+# Interval, in seconds, between feeders writes
+FEED_INTERVAL = 0.01
+
+
+def marker():
+    return MARKER + struct.pack("=d", time.monotonic())
+
+
+class RawStream:
+
+    PATH = "/raw"
+    CONTENT_TYPE = "application/octet-stream"
+    UNIT_SIZE = 1316
+
+    def __init__(self, bitrate):
+        self.bitrate = bitrate
+
+    def header(self):
+        return b""
+
+    def unit(self, with_marker):
+        payload = marker() if with_marker else b""
+        return payload + b"\0" * (self.UNIT_SIZE - len(payload))
+
+
+class TSStream(RawStream):
+    """Packets of a single PID, with the payload unit start flag set on
+    the first packet of each unit."""
+
+    PATH = "/ts"
+    CONTENT_TYPE = "video/MP2T"
+    PACKETS = 7
+    PID = 0x100
+
+    def __init__(self, bitrate):
+        super().__init__(bitrate)
+        self.continuity_counter = 0
+
+    def packet(self, payload, unit_start):
+        header = struct.pack(
+            ">BHB",
+            0x47,
+            (0x4000 if unit_start else 0) | self.PID,
+            0x10 | self.continuity_counter,
+        )
+        self.continuity_counter = (self.continuity_counter + 1) % 16
+        return header + payload + b"\xff" * (184 - len(payload))
+
+    def unit(self, with_marker):
+        return b"".join(
+            self.packet(marker() if with_marker and index == 0 else b"", index == 0) for index in range(self.PACKETS)
+        )
+
+
+class FLVStream(RawStream):
+    """AVC video tags at FPS frames per second, a keyframe every second."""
+
+    PATH = "/flv"
+    CONTENT_TYPE = "video/x-flv"
+    FPS = 25
+
+    def __init__(self, bitrate):
+        super().__init__(bitrate)
+        self.frame = 0
+        self.frame_size = max(MARKER_SIZE + 5, bitrate // 8 // self.FPS - 15)
+
+    def tag(self, body):
+        timestamp = self.frame * 1000 // self.FPS
+        tag_header = struct.pack(">B", 9) + len(body).to_bytes(3, "big")
+        tag_header += (timestamp & 0xFFFFFF).to_bytes(3, "big") + bytes([timestamp >> 24]) + b"\0\0\0"
+        return tag_header + body + struct.pack(">I", 11 + len(body))
+
+    def header(self):
+        # Video only, followed by the AVC sequence header
+        return b"FLV\x01\x01\x00\x00\x00\x09\x00\x00\x00\x00" + self.tag(b"\x17\x00\x00\x00\x00")
+
+    def unit(self, with_marker):
+        frame_type = 0x17 if self.frame % self.FPS == 0 else 0x27
+        payload = marker() if with_marker else b""
+        body = bytes([frame_type, 1, 0, 0, 0]) + payload
+        body += b"\0" * (self.frame_size - len(body))
+        tag = self.tag(body)
+        self.frame += 1
+        return tag
+
+
+class MP3Stream(RawStream):
+    """MPEG-1 Layer III frames, 128 kbit/s at 44.1 kHz, whatever the
+    bitrate they are sent at."""
+
+    PATH = "/mp3"
+    CONTENT_TYPE = "audio/mpeg"
+    FRAME_HEADER = b"\xff\xfb\x90\x00"
+    FRAME_SIZE = 417
+
+    def unit(self, with_marker):
+        payload = self.FRAME_HEADER + (marker() if with_marker else b"")
+        return payload + b"\0" * (self.FRAME_SIZE - len(payload))
+
+
+FORMATS = {"raw": RawStream, "ts": TSStream, "flv": FLVStream, "mp3": MP3Stream}
+
+
+def feed(port, stream, end_time):
+    """Stream to the server, as a source, until end_time."""
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(
+        b"SOURCE %s HTTP/1.0\r\nContent-Type: %s\r\n\r\n" % (stream.PATH.encode(), stream.CONTENT_TYPE.encode())
+    )
+    sock.sendall(stream.header())
+    bytes_per_second = stream.bitrate / 8
+    start = next_marker = time.monotonic()
+    sent_bytes = 0
+    while True:
+        now = time.monotonic()
+        if now > end_time:
+            break
+        units = []
+        while sent_bytes < (now - start) * bytes_per_second:
+            with_marker = now >= next_marker
+            if with_marker:
+                next_marker += MARKER_INTERVAL
+            units.append(stream.unit(with_marker))
+            sent_bytes += len(units[-1])
+        if units:
+            try:
+                sock.sendall(b"".join(units))
+            except OSError:
+                break
+        time.sleep(FEED_INTERVAL)
+    sock.close()
+
+
+def read(port, paths, window, results):
+    """Connect a client to each of paths, and count what they receive
+    during window."""
+    window_start, window_end = window
+    selector = selectors.DefaultSelector()
+    failures = 0
+    for path in paths:
+        try:
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.sendall(b"GET %s HTTP/1.0\r\n\r\n" % path.encode())
+        except OSError:
+            failures += 1
+            continue
+        sock.setblocking(False)
+        # Data left over from the previous recv(), which may hold the
+        # start of a marker
+        selector.register(sock, selectors.EVENT_READ, [b""])
+
+    received_bytes = 0
+    latencies = []
+    disconnections = 0
+    while time.monotonic() < window_end and selector.get_map():
+        for key, events in selector.select(0.1):
+            try:
+                data = key.fileobj.recv(2**16)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                disconnections += 1
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            now = time.monotonic()
+            if now < window_start:
+                continue
+            received_bytes += len(data)
+            data = key.data[0] + data
+            position = data.find(MARKER)
+            searched = 0
+            while position != -1 and position + MARKER_SIZE <= len(data):
+                latencies.append(now - struct.unpack("=d", data[position + len(MARKER) : position + MARKER_SIZE])[0])
+                searched = position + MARKER_SIZE
+                position = data.find(MARKER, searched)
+            key.data[0] = data[max(searched, len(data) - MARKER_SIZE + 1) :]
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    results.send(
+        {
+            "received_bytes": received_bytes,
+            "latencies": latencies,
+            "failures": failures,
+            "disconnections": disconnections,
+        }
+    )
+    results.close()
+
+
+def rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+class CallCounter:
+    """Counts calls of a socket method, server wide."""
+
+    def __init__(self, method_name):
+        self.calls = 0
+        self.method_name = method_name
+        self.method = getattr(socket.socket, method_name)
+        counter = self
+
+        def counting_method(sock, *args):
+            counter.calls += 1
+            return counter.method(sock, *args)
+
+        setattr(socket.socket, method_name, counting_method)
+
+    def restore(self):
+        delattr(socket.socket, self.method_name)
+
+
+def run_loop(server, until):
+    while time.monotonic() < until:
+        server.loop.once(min(server.LOOP_TIMEOUT, max(0, until - time.monotonic())))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--clients", type="int", default=1000, help="Number of clients, default: %default")
+    parser.add_option("--bitrate", type="int", default=2000, help="Streams bitrate, in kbit/s, default: %default")
+    parser.add_option("--formats", default=",".join(FORMATS), help="Comma separated stream formats, default: %default")
+    parser.add_option("--readers", type="int", default=4, help="Reader processes, default: %default")
+    parser.add_option("--warmup", type="float", default=3, help="Seconds before measuring, default: %default")
+    parser.add_option("--duration", type="float", default=10, help="Measurement seconds, default: %default")
+    parser.add_option("--config", help="JSON file of extra server options")
+    parser.add_option("--output", help="Write the results to this file rather than stdout")
+    options, args = parser.parse_args()
+
+    logger = logging.getLogger("savate.benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    # Each client is one file descriptor in the server, and in a reader
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    streams = [FORMATS[name](options.bitrate * 1000) for name in options.formats.split(",")]
+    config_dict = {"bind": "127.0.0.1", "port": 0, "mounts": [{"path": stream.PATH} for stream in streams]}
+    if options.config:
+        with open(options.config) as conf_file:
+            config_dict.update(json.load(conf_file))
+
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = os.path.join(tmp_dir, "savate.json")
+        with open(config_file, "w") as conf_file:
+            json.dump(config_dict, conf_file)
+        server = TCPServer(("127.0.0.1", 0), config_file, logger)
+        server.create_socket()
+        server.create_loop()
+        server.config.configure()
+        server.metrics.update_rates()
+        port = server.sock.getsockname()[1]
+
+        start = time.monotonic()
+        readers_start = start + 1
+        window_start = readers_start + options.warmup
+        window_end = window_start + options.duration
+
+        feeders = [context.Process(target=feed, args=(port, stream, window_end + 1)) for stream in streams]
+        for feeder in feeders:
+            feeder.start()
+        # Let sources connect and fill their burst buffers
+        run_loop(server, readers_start)
+        base_rss = rss()
+
+        paths = [streams[index % len(streams)].PATH for index in range(options.clients)]
+        readers = []
+        for index in range(options.readers):
+            receiver, sender = context.Pipe(duplex=False)
+            reader = context.Process(
+                target=read, args=(port, paths[index :: options.readers], (window_start, window_end), sender)
+            )
+            reader.start()
+            sender.close()
+            readers.append((reader, receiver))
+
+        counters = [CallCounter("send"), CallCounter("recv")]
+        polls = [0]
+        poll = server.loop.poll
+
+        def counting_poll(*args):
+            polls[0] += 1
+            return poll(*args)
+
+        server.loop.poll = counting_poll
+
+        run_loop(server, window_start)
+        clients_rss = rss()
+        clients_connected = server.clients_connected
+        usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        calls_start = [counter.calls for counter in counters] + [polls[0]]
+        run_loop(server, window_end)
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+        calls_end = [counter.calls for counter in counters] + [polls[0]]
+        for counter in counters:
+            counter.restore()
+
+        # Keep serving while readers report
+        reports = []
+        for reader, receiver in readers:
+            while not receiver.poll(0):
+                server.loop.once(0.01)
+            reports.append(receiver.recv())
+            reader.join()
+        for feeder in feeders:
+            feeder.join()
+        server.executor.close()
+        server.close()
+
+    received_bytes = sum(report["received_bytes"] for report in reports)
+    latencies = sorted(latency for report in reports for latency in report["latencies"])
+    cpu_seconds = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    delivered_gbits = received_bytes * 8 / 1e9
+    delivered_mbytes = received_bytes / 2**20
+    sends, recvs, poll_calls = [end - start for start, end in zip(calls_start, calls_end)]
+    results = {
+        "parameters": {
+            "clients": options.clients,
+            "bitrate_kbps": options.bitrate,
+            "formats": options.formats.split(","),
+            "readers": options.readers,
+            "warmup": options.warmup,
+            "duration": options.duration,
+            "server_options": config_dict,
+        },
+        "clients_connected": clients_connected,
+        "client_failures": sum(report["failures"] for report in reports),
+        "client_disconnections": sum(report["disconnections"] for report in reports),
+        "delivered_bytes": received_bytes,
+        "throughput_gbps": delivered_gbits / options.duration,
+        "expected_throughput_gbps": options.clients * options.bitrate / 1e6,
+        "cpu_seconds": cpu_seconds,
+        "cpu_seconds_per_gbit": cpu_seconds / delivered_gbits if delivered_gbits else None,
+        "send_calls_per_mb": sends / delivered_mbytes if delivered_mbytes else None,
+        "syscalls_per_mb": (sends + recvs + poll_calls) / delivered_mbytes if delivered_mbytes else None,
+        "latency_ms": {
+            "samples": len(latencies),
+            "p50": statistics.median(latencies) * 1000 if latencies else None,
+            "p99": latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else None,
+            "max": latencies[-1] * 1000 if latencies else None,
+        },
+        "rss_per_client_bytes": (clients_rss - base_rss) / clients_connected if clients_connected else None,
+    }
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
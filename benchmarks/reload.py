@@ -0,0 +1,151 @@
+#! /usr/bin/python3
+"""Measure configuration reload times against the number of mounts.
+
+For each mount count, a server is configured with that many mounts, a
+fraction of them relaying a local origin, half of those resolving all
+its addresses. It is then reloaded with: the same configuration, one
+mount changed, one relayed mount changed, one mount added, a global
+option mounts inherit changed, and a global only option changed. The
+time spent reading, validating and diffing the configuration (done
+outside of the loop) and the time spent applying it (which blocks the
+loop) are reported in milliseconds.
+
+Run it from a built source tree:
+
+    PYTHONPATH=. python3 benchmarks/reload.py --mounts 100,500,1000,2000
+"""
+
+import copy
+import json
+import logging
+import optparse
+import os
+import resource
+import socket
+import statistics
+import tempfile
+import time
+
+from savate import configuration
+from savate.server import TCPServer
+
+
+def build_mount(index, relayed, origin_port):
+    mount_conf = {"path": "/mount%d" % index, "burst_size": "32k", "user": "user", "password": "password%d" % index}
+    if relayed:
+        mount_conf["source_urls"] = ["http://localhost:%d/mount%d" % (origin_port, index)]
+        # Half of the relays resolve every address of the origin
+        mount_conf["net_resolve_all"] = bool(index % 2)
+    return mount_conf
+
+
+def build_config(mounts_number, relays_ratio, origin_port):
+    relays_number = int(mounts_number * relays_ratio)
+    return {
+        "bind": "127.0.0.1",
+        "port": 0,
+        "burst_size": "64k",
+        "mounts": [build_mount(index, index < relays_number, origin_port) for index in range(mounts_number)],
+        "auth": [{"handler": "savate.auth.BasicAuthorization"}],
+        "status": {"/status": {"handler": "savate.status.JSONStatusClient"}},
+        "statistics": [{"handler": "savate.stats.ApacheLogger"}],
+    }
+
+
+def unchanged(config_dict):
+    pass
+
+
+def toggle_burst_size(mount_conf):
+    mount_conf["burst_size"] = "16k" if mount_conf["burst_size"] != "16k" else "32k"
+
+
+def change_mount(config_dict):
+    toggle_burst_size(config_dict["mounts"][-1])
+
+
+def change_relayed_mount(config_dict):
+    toggle_burst_size(config_dict["mounts"][0])
+
+
+def add_mount(config_dict):
+    config_dict["mounts"].append({"path": "/added%d" % len(config_dict["mounts"])})
+
+
+def change_global(config_dict):
+    config_dict["burst_size"] = "128k" if config_dict["burst_size"] != "128k" else "64k"
+
+
+def change_global_only(config_dict):
+    config_dict["dns_ttl"] = 600 if config_dict.get("dns_ttl") != 600 else 300
+
+
+SCENARIOS = [unchanged, change_mount, change_relayed_mount, add_mount, change_global, change_global_only]
+
+
+def measure(server, config_file, config_dict, scenario):
+    scenario(config_dict)
+    with open(config_file, "w") as conf_file:
+        json.dump(config_dict, conf_file)
+
+    start = time.perf_counter()
+    new_config, diff = configuration.load_config(config_file, server.config.config_dict)
+    loaded = time.perf_counter()
+    server.config.reconfigure(new_config, diff)
+    applied = time.perf_counter()
+    return (loaded - start) * 1000, (applied - loaded) * 1000
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--mounts", default="100,500,1000,2000", help="Comma separated mount counts, default: %default")
+    parser.add_option("--repeat", type="int", default=5, help="Reloads per scenario, default: %default")
+    parser.add_option("--relays", type="float", default=0.25, help="Fraction of relayed mounts, default: %default")
+    options, args = parser.parse_args()
+
+    # Every relay holds a socket
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    # Relays connect to it, and are left waiting for a response
+    origin = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    origin.bind(("127.0.0.1", 0))
+    origin.listen(socket.SOMAXCONN)
+    origin_port = origin.getsockname()[1]
+
+    logger = logging.getLogger("savate.benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    print("%8s %-20s %12s %12s" % ("mounts", "scenario", "off-loop ms", "on-loop ms"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = os.path.join(tmp_dir, "savate.json")
+        for mounts_number in [int(number) for number in options.mounts.split(",")]:
+            config_dict = build_config(mounts_number, options.relays, origin_port)
+            with open(config_file, "w") as conf_file:
+                json.dump(config_dict, conf_file)
+            server = TCPServer(("127.0.0.1", 0), config_file, logger)
+            server.create_socket()
+            server.create_loop()
+            server.config.configure()
+
+            for scenario in SCENARIOS:
+                timings = [
+                    measure(server, config_file, copy.deepcopy(server.config.config_dict), scenario)
+                    for repeat in range(options.repeat)
+                ]
+                print(
+                    "%8d %-20s %12.2f %12.2f"
+                    % (
+                        mounts_number,
+                        scenario.__name__,
+                        statistics.median(timing[0] for timing in timings),
+                        statistics.median(timing[1] for timing in timings),
+                    )
+                )
+            server.executor.close()
+            server.close()
+    origin.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#! /usr/bin/python3
+"""A stand-in authorization service for savate.auth.RemoteAuthorization.
+
+It authorizes requests whose query string holds one of the given tokens
+(`token=<token>`), denies the others, and answers 404 for paths outside
+of the given prefixes. Answers can be delayed to try out savate's
+behaviour with a slow service.
+
+    python3 contrib/auth_server.py --port 8081 --token secret --delay 0.5
+
+and in savate.json:
+
+    "auth": [{"handler": "savate.auth.RemoteAuthorization", "url": "http://127.0.0.1:8081/"}]
+"""
+
+import http.server
+import json
+import optparse
+import time
+import urllib.parse
+
+
+class AuthRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        options = self.server.options
+        if options.delay:
+            time.sleep(options.delay)
+        if not query["path"].startswith(tuple(options.prefixes or [""])):
+            status = 404
+        elif set(urllib.parse.parse_qs(query["query_string"]).get("token", [])) & set(options.tokens):
+            status = 200
+        else:
+            status = 403
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--bind", default="127.0.0.1", help="Address to listen on, default: %default")
+    parser.add_option("--port", type="int", default=8081, help="Port to listen on, default: %default")
+    parser.add_option("--token", dest="tokens", action="append", default=[], help="Valid token, can be repeated")
+    parser.add_option(
+        "--prefix", dest="prefixes", action="append", default=[], help="Checked path prefix, can be repeated"
+    )
+    parser.add_option("--delay", type="float", default=0, help="Seconds to wait before answering, default: %default")
+    parser.add_option("--verbose", action="store_true", default=False, help="Log every request")
+    options, args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer((options.bind, options.port), AuthRequestHandler)
+    server.options = options
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
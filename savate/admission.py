@@ -0,0 +1,188 @@
+import ipaddress
+import logging
+import socket
+import struct
+from typing import TYPE_CHECKING, Any, Optional, Union
+
+from savate.helpers import HTTPResponse
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+class AdmittedSocket(socket.socket):
+    """A client socket counted by AdmissionControl until it is closed."""
+
+    __slots__ = ("admission", "client_ip")
+
+    admission: Optional["AdmissionControl"]
+    client_ip: str
+
+    def close(self) -> None:
+        admission = self.admission
+        if admission is not None:
+            self.admission = None
+            admission.release(self.client_ip)
+        super().close()
+
+
+class AdmissionControl:
+    """Per-IP connection policy, applied right after accept().
+
+    Each IP can be limited to `max_connections_per_ip` concurrent
+    connections, and to `connection_rate_per_ip` new connections per
+    second, with bursts of `connection_burst_per_ip`. The same rate
+    limit can apply to whole subnets, of `subnet_prefix_v4` or
+    `subnet_prefix_v6` bits. Rejected connections are closed right away,
+    or sent a prebuilt 429 response. Addresses of `admission_exempt`
+    networks are always admitted.
+    """
+
+    SUBNET_PREFIX_V4 = 24
+    SUBNET_PREFIX_V6 = 64
+    # Interval, in seconds, between removals of unused token buckets
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.enabled = False
+        self.max_connections_per_ip: Optional[int] = None
+        # (rate, burst) per IP and per subnet
+        self.ip_rate: Optional[tuple[float, float]] = None
+        self.subnet_rate: Optional[tuple[float, float]] = None
+        self.subnet_prefixes = {4: self.SUBNET_PREFIX_V4, 6: self.SUBNET_PREFIX_V6}
+        self.exempt: list[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = []
+        self.rejection: Optional[bytes] = None
+        # IP -> number of admitted connections
+        self.connections: dict[str, int] = {}
+        # IP or subnet -> [tokens, last update]
+        self.buckets: dict[str, list[float]] = {}
+        # Reason -> number of rejected connections
+        self.rejected: dict[str, int] = {}
+
+    def configure(self, config_dict: dict[str, Any]) -> None:
+        max_connections_per_ip = config_dict.get("max_connections_per_ip")
+        self.max_connections_per_ip = int(max_connections_per_ip) if max_connections_per_ip is not None else None
+        self.ip_rate = self.rate_option(config_dict, "connection_rate_per_ip", "connection_burst_per_ip")
+        self.subnet_rate = self.rate_option(config_dict, "connection_rate_per_subnet", "connection_burst_per_subnet")
+        self.subnet_prefixes = {
+            4: config_dict.get("subnet_prefix_v4", self.SUBNET_PREFIX_V4),
+            6: config_dict.get("subnet_prefix_v6", self.SUBNET_PREFIX_V6),
+        }
+        self.exempt = [ipaddress.ip_network(network) for network in config_dict.get("admission_exempt", [])]
+        if config_dict.get("admission_reject", "close") == "429":
+            self.rejection = HTTPResponse(
+                429,
+                b"Too Many Requests",
+                {b"Content-Type": b"text/plain", b"Retry-After": b"1", b"Connection": b"close"},
+                b"Too many connections\n",
+            ).as_bytes()
+        else:
+            self.rejection = None
+        self.buckets.clear()
+
+        was_enabled = self.enabled
+        self.enabled = bool(self.max_connections_per_ip or self.ip_rate or self.subnet_rate)
+        if self.enabled and not was_enabled:
+            self.schedule_cleanup()
+        elif was_enabled and not self.enabled:
+            self.server.timeouts.remove_timeout(self)
+
+    @staticmethod
+    def rate_option(config_dict: dict[str, Any], rate_option: str, burst_option: str) -> Optional[tuple[float, float]]:
+        rate = config_dict.get(rate_option)
+        if not rate:
+            return None
+        return float(rate), float(config_dict.get(burst_option, max(1, rate)))
+
+    def take_token(self, key: str, rate: tuple[float, float], now: float) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [rate[1] - 1, now]
+            return True
+        bucket[0] = min(rate[1], bucket[0] + (now - bucket[1]) * rate[0])
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def admission_error(self, client_ip: str) -> Optional[str]:
+        """Return why a connection from client_ip should be rejected,
+        or None."""
+        if self.max_connections_per_ip and self.connections.get(client_ip, 0) >= self.max_connections_per_ip:
+            return "connections"
+        if not (self.ip_rate or self.subnet_rate):
+            return None
+        now = self.server.loop.now()
+        if self.ip_rate and not self.take_token(client_ip, self.ip_rate, now):
+            return "ip_rate"
+        if self.subnet_rate:
+            address = ipaddress.ip_address(client_ip)
+            subnet = str(ipaddress.ip_network((address, self.subnet_prefixes[address.version]), strict=False))
+            if not self.take_token(subnet, self.subnet_rate, now):
+                return "subnet_rate"
+        return None
+
+    def admit(self, client_socket: socket.socket, client_address: tuple[str, int]) -> Optional[socket.socket]:
+        """Return the socket to serve the client with, or None if the
+        connection was rejected, and closed."""
+        client_ip = client_address[0]
+        if self.exempt and any(ipaddress.ip_address(client_ip) in network for network in self.exempt):
+            return client_socket
+        reason = self.admission_error(client_ip)
+        if reason is not None:
+            self.reject(client_socket, client_ip, reason)
+            return None
+        if not self.max_connections_per_ip:
+            return client_socket
+        admitted_socket = AdmittedSocket(
+            client_socket.family, client_socket.type, client_socket.proto, client_socket.detach()
+        )
+        admitted_socket.admission = self
+        admitted_socket.client_ip = client_ip
+        self.connections[client_ip] = self.connections.get(client_ip, 0) + 1
+        return admitted_socket
+
+    def release(self, client_ip: str) -> None:
+        connections = self.connections.get(client_ip, 0) - 1
+        if connections > 0:
+            self.connections[client_ip] = connections
+        else:
+            self.connections.pop(client_ip, None)
+
+    def reject(self, client_socket: socket.socket, client_ip: str, reason: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        self.server.log_aggregator.event(
+            "Connection rejected (%s)" % reason,
+            "-",
+            logging.WARNING,
+            "Rejecting connection from %s: %s",
+            client_ip,
+            reason,
+        )
+        try:
+            if self.rejection is not None:
+                client_socket.send(self.rejection, socket.MSG_DONTWAIT)
+            else:
+                # Reset the connection, sparing us the TIME_WAIT state
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except IOError:
+            pass
+        client_socket.close()
+
+    def schedule_cleanup(self) -> None:
+        self.server.timeouts.reset_timeout(self, self.server.loop.now() + self.CLEANUP_INTERVAL, self.cleanup)
+
+    def cleanup(self) -> None:
+        """Remove token buckets that are full again."""
+        now = self.server.loop.now()
+        rates = [rate for rate in (self.ip_rate, self.subnet_rate) if rate is not None]
+        if rates:
+            # Time after which any bucket is full again
+            refill_time = max(burst / rate for rate, burst in rates)
+            for key, bucket in list(self.buckets.items()):
+                if now - bucket[1] > refill_time:
+                    del self.buckets[key]
+        if self.enabled:
+            self.schedule_cleanup()
@@ -1,10 +1,15 @@
 import base64
 import collections
+import concurrent.futures
+import functools
 import hashlib
+import json
 import socket
 import time
+import urllib.error
+import urllib.request
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Any, Callable, Optional, TypedDict
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypedDict, Union
 
 from cyhttp11 import HTTPParser
 
@@ -23,17 +28,53 @@ AUTH_FAILURE = HTTPResponse(403, b"Forbidden")
 ClientAddress = tuple[socket.socket, tuple[str, int]]
 
 
+class AuthPending:
+    """Returned by authorize() when the decision will only be known
+    later. The request is then parked until complete() is called, from
+    the loop, with what authorize() would have returned, or until it
+    times out."""
+
+    def __init__(self) -> None:
+        self.done = False
+        self.result: Optional[HTTPResponse] = None
+        self.callbacks: list[Callable[[Optional[HTTPResponse]], None]] = []
+
+    def add_callback(self, callback: Callable[[Optional[HTTPResponse]], None]) -> None:
+        if self.done:
+            callback(self.result)
+        else:
+            self.callbacks.append(callback)
+
+    def complete(self, result: Optional[HTTPResponse]) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.result = result
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(result)
+
+
+AuthResult = Union[HTTPResponse, AuthPending, None]
+
+
 class AbstractAuthorization(ABC):
     def __init__(self, server: "TCPServer", server_config: dict[str, Any], **config_dict: Any):
         self.server = server
         self.server_config = server_config
         self.config = config_dict
 
+    def update_server_config(self, server_config: dict[str, Any]) -> None:
+        """Called on reload when this handler's own configuration did not
+        change but the server's did."""
+        self.server_config = server_config
+
     @abstractmethod
-    def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> Optional[HTTPResponse]:
-        # True: OK, go on serving
-        # False: NOK, 403
+    def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> AuthResult:
+        # AUTH_SUCCESS: OK, go on serving
+        # Other HTTPResponse: NOK, send it
         # None: I don't know, move on to next auth handler
+        # AuthPending: I'll tell later
         # return None
         ...
 
@@ -53,19 +94,27 @@ class AbstractBasicAuthorization(AbstractAuthorization, ABC):
         super().__init__(server, server_config, **config_dict)
         self.global_user = config_dict.get(self.USER_ITEM)
         self.global_password = config_dict.get(self.PASSWORD_ITEM)
-        self.protected_paths: dict[str, _BasicAuthConfig] = collections.defaultdict(
-            lambda: {"user": self.global_user, "password": self.global_password}
-        )
+        self.configure_paths()
+
+    def configure_paths(self) -> None:
+        # Not a defaultdict, which would grow with every path requested
+        self.default_path_config: _BasicAuthConfig = {"user": self.global_user, "password": self.global_password}
+        self.protected_paths: dict[str, _BasicAuthConfig] = {}
         for mount_config in self.server_config.get("mounts", []):
             self.protected_paths[mount_config["path"]] = {
                 "user": mount_config.get(self.USER_ITEM, self.global_user),
                 "password": mount_config.get(self.PASSWORD_ITEM, self.global_password),
             }
 
+    def update_server_config(self, server_config: dict[str, Any]) -> None:
+        super().update_server_config(server_config)
+        self.configure_paths()
+
     def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> Optional[HTTPResponse]:
-        path = client_request.request_path
-        protected_user = self.protected_paths[path]["user"]
-        protected_password = self.protected_paths[path]["password"]
+        path = client_request.request_path.decode("ascii", "replace")
+        path_config = self.protected_paths.get(path, self.default_path_config)
+        protected_user = path_config["user"]
+        protected_password = path_config["password"]
         if (protected_user, protected_password) is not (None, None):
             # This path is protected, did the client provide a correct
             # Authorization header ?
@@ -116,6 +165,11 @@ class BasicAuthorization(AbstractAuthorization):
         self.source_auth = SourceBasicAuthorization(server, server_config, **config_dict)
         self.client_auth = ClientBasicAuthorization(server, server_config, **config_dict)
 
+    def update_server_config(self, server_config: dict[str, Any]) -> None:
+        super().update_server_config(server_config)
+        self.source_auth.update_server_config(server_config)
+        self.client_auth.update_server_config(server_config)
+
     def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> Optional[HTTPResponse]:
         if client_request.request_method in [b"PUT", b"SOURCE", b"POST"]:
             return self.source_auth.authorize(client_address, client_request)
@@ -129,58 +183,206 @@ _TokenConfig = TypedDict("_TokenConfig", {"secret": Optional[str], "timeout": Op
 
 
 class TokenAuthorization(AbstractAuthorization):
+    """Token protected paths, of the form
+    `<prefix>/<token>/<hex timestamp>/<path>`, where the token is the MD5
+    hex digest of `<secret>/<path><hex timestamp>` and
+    `<prefix>/<path>` is the mount point.
+
+    Mount points can have their own `secret`, `token_timeout` and
+    `token_prefix`. Valid tokens are cached, up to `token_cache_size`
+    (10000 by default) for at most `token_cache_ttl` seconds (60 by
+    default) or until they expire.
+    """
+
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 60
+
     def __init__(self, server: "TCPServer", server_config: dict[str, str], **config_dict: Any):
         super().__init__(server, server_config, **config_dict)
         self.global_secret = config_dict.get("secret")
         self.global_timeout = config_dict.get("timeout")
         self.global_prefix = config_dict.get("prefix", "")
-        self.protected_paths: dict[str, _TokenConfig] = collections.defaultdict(
-            lambda: {
-                "secret": self.global_secret,
-                "timeout": self.global_timeout,
-                "prefix": self.global_prefix,
-            }
-        )
+        self.token_cache_size = config_dict.get("token_cache_size", self.TOKEN_CACHE_SIZE)
+        self.token_cache_ttl = config_dict.get("token_cache_ttl", self.TOKEN_CACHE_TTL)
+        # Request path -> (mount point, expiration)
+        self.token_cache: collections.OrderedDict[bytes, tuple[bytes, float]] = collections.OrderedDict()
+        self.configure_paths()
+
+    def configure_paths(self) -> None:
+        # Not a defaultdict, which would grow with every path requested
+        self.default_path_config: _TokenConfig = {
+            "secret": self.global_secret,
+            "timeout": self.global_timeout,
+            "prefix": self.global_prefix,
+        }
+        self.protected_paths: dict[str, _TokenConfig] = {}
         for mount_config in self.server_config.get("mounts", []):
             self.protected_paths[mount_config["path"]] = {
                 "secret": mount_config.get("secret", self.global_secret),
                 "timeout": mount_config.get("token_timeout", self.global_timeout),
                 "prefix": mount_config.get("token_prefix", self.global_prefix),
             }
+        # Tokenised paths are matched against these, longest first
+        self.prefixes = sorted(
+            set(path_config["prefix"] for path_config in self.protected_paths.values()) | {self.global_prefix},
+            key=len,
+            reverse=True,
+        )
+        self.token_cache.clear()
+
+    def update_server_config(self, server_config: dict[str, Any]) -> None:
+        super().update_server_config(server_config)
+        self.configure_paths()
+
+    def check_token(self, path: str, prefix: str) -> Optional[tuple[str, _TokenConfig, float]]:
+        """Return the mount point, its configuration and the expiration
+        of a valid token if path is a tokenised path for a mount point
+        using prefix, None otherwise."""
+        components = path[len(prefix) :].strip("/").split("/", 2)
+        if len(components) < 3:
+            # Not enough components to be a tokenised path
+            return None
+        token, timestamp, mount_path = components
+        mount_path = "/".join([prefix, mount_path])
+        path_config = self.protected_paths.get(mount_path, self.default_path_config)
+        secret = path_config["secret"]
+        timeout = path_config["timeout"]
+        if not secret or path_config["prefix"] != prefix:
+            return None
+        try:
+            expiration = int(timestamp, 16) + timeout if timeout else float("inf")
+        except ValueError:
+            return None
+        if token != hashlib.md5((secret + "/" + components[2] + timestamp).encode()).hexdigest():
+            return None
+        if time.time() > expiration:
+            return None
+        return mount_path, path_config, expiration
 
     def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> Optional[HTTPResponse]:
-        path = client_request.request_path
-        secret = self.protected_paths[path]["secret"]
-        timeout = self.protected_paths[path]["timeout"]
-        prefix: str = self.protected_paths[path]["prefix"]
-        if secret:
-            # This path is token-protected
-            if not path.startswith(prefix):
-                # Incorrect prefix
-                # FIXME: note that something is probably wrong with
-                # the configuration here, we should probably log /
-                # warn the admin
-                return AUTH_FAILURE
-            else:
-                # Get rid of prefix and slashes
-                path = path[len(prefix) :].strip("/")
-                if path.count("/") < 2:
-                    # Not enough components to be a tokenised path
-                    return AUTH_FAILURE
-                # Split into token, timestamp, and path
-                token, timestamp, path = path.split("/", 2)
-                # Check the token is valid
-                if token != hashlib.md5(secret + "/" + path + timestamp).hexdigest():
-                    # Invalid token
-                    return AUTH_FAILURE
-                # Check the timeout is not expired, if needed
-                if timeout and (int(time.time()) - timeout) > int(timestamp, 16):
-                    return AUTH_FAILURE
-
-                # We have to remove the token and timestamp from the original
-                # path or else the server won't find the correct handler
-                # afterwards
-                client_request.request_path = "/".join([prefix, path])
+        request_path = client_request.request_path
+        now = self.server.loop.now()
+        cached = self.token_cache.get(request_path)
+        if cached is not None:
+            if cached[1] > now:
+                self.token_cache.move_to_end(request_path)
+                # We have to remove the token and timestamp from the
+                # original path or else the server won't find the
+                # correct handler afterwards
+                client_request.request_path = cached[0]
                 return AUTH_SUCCESS
-
+            del self.token_cache[request_path]
+
+        path = request_path.decode("ascii", "replace")
+        path_config = self.protected_paths.get(path)
+        if path_config is not None:
+            # A mount point requested without a token
+            return AUTH_FAILURE if path_config["secret"] else None
+
+        for prefix in self.prefixes:
+            if path.startswith(prefix):
+                result = self.check_token(path, prefix)
+                if result is not None:
+                    mount_path, path_config, expiration = result
+                    client_request.request_path = mount_path.encode("ascii")
+                    self.token_cache[request_path] = (
+                        client_request.request_path,
+                        min(expiration, now + self.token_cache_ttl),
+                    )
+                    if len(self.token_cache) > self.token_cache_size:
+                        self.token_cache.popitem(last=False)
+                    return AUTH_SUCCESS
+
+        if self.global_secret:
+            # FIXME: note that something is probably wrong with the
+            # configuration here if the prefix did not match, we should
+            # probably log / warn the admin
+            return AUTH_FAILURE
         return None
+
+
+class RemoteAuthorization(AbstractAuthorization):
+    """Asks an external HTTP service whether requests are authorized.
+
+    For each request whose method is in `methods` (GET by default) and
+    whose path starts with one of `paths` (any path by default), a JSON
+    object with the client address, request method, path, query string
+    and the headers listed in `headers` (Authorization, Cookie and
+    User-Agent by default) is POSTed to `url` from a worker thread.
+
+    The service answers 200 to authorize the request, 401 or 403 to deny
+    it, and 404 to leave the decision to the next handler. Other
+    answers, and errors, deny the request unless `allow_on_error` is
+    true. Requests not answered within `timeout` seconds (2 by default)
+    are errors. Up to `workers` (16 by default) requests are made at the
+    same time.
+    """
+
+    TIMEOUT = 2
+    WORKERS = 16
+    HEADERS = ("Authorization", "Cookie", "User-Agent")
+
+    def __init__(self, server: "TCPServer", server_config: dict[str, Any], **config_dict: Any):
+        super().__init__(server, server_config, **config_dict)
+        self.url = config_dict["url"]
+        self.timeout = config_dict.get("timeout", self.TIMEOUT)
+        self.methods = set(method.encode("ascii") for method in config_dict.get("methods", ["GET"]))
+        self.paths = tuple(path.encode("ascii") for path in config_dict.get("paths", [""]))
+        self.headers = config_dict.get("headers", self.HEADERS)
+        self.allow_on_error = config_dict.get("allow_on_error", False)
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            config_dict.get("workers", self.WORKERS), thread_name_prefix="savate-auth"
+        )
+
+    def authorize(self, client_address: tuple[str, int], client_request: HTTPParser) -> AuthResult:
+        if client_request.request_method not in self.methods or not client_request.request_path.startswith(self.paths):
+            return None
+        query = {
+            "address": client_address[0],
+            "method": client_request.request_method.decode("latin-1"),
+            "path": client_request.request_path.decode("latin-1"),
+            "query_string": (client_request.query_string or b"").decode("latin-1"),
+            "headers": dict(
+                (header, client_request.headers[header.encode("ascii")].decode("latin-1"))
+                for header in self.headers
+                if header.encode("ascii") in client_request.headers
+            ),
+        }
+        pending = AuthPending()
+        future = self.pool.submit(self.ask, query)
+        # The answer is handled back in the loop
+        future.add_done_callback(
+            functools.partial(self.server.executor.call_soon, functools.partial(self.answered, pending, query))
+        )
+        return pending
+
+    def ask(self, query: dict[str, Any]) -> int:
+        """Runs in a worker thread, return the service's answer status."""
+        request = urllib.request.Request(
+            self.url, json.dumps(query).encode("utf-8"), {"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+
+    def answered(self, pending: AuthPending, query: dict[str, Any], future: "concurrent.futures.Future[int]") -> None:
+        try:
+            status = future.result()
+        except (IOError, concurrent.futures.CancelledError) as exc:
+            self.server.logger.error("Authorization service error for %s: %s", query["path"], exc)
+            status = None
+        if status == 200:
+            pending.complete(AUTH_SUCCESS)
+        elif status in (401, 403):
+            pending.complete(AUTH_FAILURE)
+        elif status == 404:
+            pending.complete(None)
+        else:
+            if status is not None:
+                self.server.logger.error("Unexpected authorization service answer for %s: %s", query["path"], status)
+            pending.complete(None if self.allow_on_error else AUTH_FAILURE)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
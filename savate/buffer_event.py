@@ -1,7 +1,9 @@
 import errno
 import collections
 import socket
-from typing import Sequence
+from typing import Optional, Sequence
+
+from savate.metrics import Histogram
 
 
 class QueueSizeExceeded(Exception):
@@ -17,15 +19,37 @@ class BufferOutputHandler:
         self.sock = sock
         self.ready = True
         self.buffer_queue = collections.deque(memoryview(buff) for buff in initial_buffer_queue)
+        # Kept up to date as buffers are added and sent
+        self.queued_bytes = sum(len(buff) for buff in self.buffer_queue)
+        # Where to account for our queue size, if anywhere
+        self.histogram: Optional[Histogram] = None
 
     def add_buffer(self, buff: bytes) -> None:
         self.buffer_queue.append(memoryview(buff))
+        queued_bytes = self.queued_bytes + len(buff)
+        if self.histogram is not None:
+            self.histogram.move(self.queued_bytes, queued_bytes)
+        self.queued_bytes = queued_bytes
 
     def empty(self) -> bool:
         return len(self.buffer_queue) == 0
 
     def queue_size(self) -> int:
-        return sum(len(buf) for buf in self.buffer_queue)
+        return self.queued_bytes
+
+    def trim(self) -> int:
+        """Drop every queued buffer but the first one, which may have
+        been partially sent, and return the number of bytes dropped."""
+        if len(self.buffer_queue) < 2:
+            return 0
+        first_buffer = self.buffer_queue.popleft()
+        self.buffer_queue.clear()
+        self.buffer_queue.append(first_buffer)
+        dropped_bytes = self.queued_bytes - len(first_buffer)
+        if self.histogram is not None:
+            self.histogram.move(self.queued_bytes, len(first_buffer))
+        self.queued_bytes = len(first_buffer)
+        return dropped_bytes
 
     def flush(self) -> int:
         self.ready = True
@@ -47,6 +71,12 @@ class BufferOutputHandler:
                 self.ready = False
             else:
                 raise
-        if self.queue_size() > self.MAX_QUEUE_SIZE:
-            raise QueueSizeExceeded("%d > %d" % (self.queue_size(), self.MAX_QUEUE_SIZE))
+        finally:
+            if total_sent_bytes:
+                queued_bytes = self.queued_bytes - total_sent_bytes
+                if self.histogram is not None:
+                    self.histogram.move(self.queued_bytes, queued_bytes)
+                self.queued_bytes = queued_bytes
+        if self.queued_bytes > self.MAX_QUEUE_SIZE:
+            raise QueueSizeExceeded("%d > %d" % (self.queued_bytes, self.MAX_QUEUE_SIZE))
         return total_sent_bytes
@@ -0,0 +1,210 @@
+import ipaddress
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Union
+
+if TYPE_CHECKING:
+    from savate.clients import StreamClient
+    from savate.server import HTTPRequest, TCPServer
+
+
+DEFAULT_CLASS = "default"
+
+
+class PriorityClass:
+    """Streaming clients authorized by one of the `authorized_by`
+    authorization handlers (dotted class names), or connecting from one
+    of the `networks`, are reserved `share` (0 to 1) of each limit."""
+
+    def __init__(
+        self, name: str, share: float = 0, authorized_by: Iterable[str] = (), networks: Iterable[str] = ()
+    ) -> None:
+        self.name = name
+        self.share = float(share)
+        self.authorized_by = set(authorized_by)
+        self.networks: list[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = [
+            ipaddress.ip_network(network) for network in networks
+        ]
+
+    def matches(self, request: "HTTPRequest") -> bool:
+        auth_handler = request.authorized_by
+        if (
+            auth_handler is not None
+            and "%s.%s" % (type(auth_handler).__module__, type(auth_handler).__name__) in self.authorized_by
+        ):
+            return True
+        if self.networks:
+            address = ipaddress.ip_address(request.address[0])
+            return any(address in network for network in self.networks)
+        return False
+
+
+class CapacityManager:
+    """Decides which streaming clients are admitted.
+
+    Limits are on the number of clients (`clients_limit`) and on the
+    estimated egress bandwidth (`bandwidth_limit`, in bytes per second),
+    of the whole server and of each mount point. Bandwidth is estimated
+    as each mount's incoming bitrate times its number of clients, so that
+    it follows clients as they come and go.
+
+    Clients first in `priority_classes` have precedence over the
+    following ones, and over clients of no class. While a limit is
+    reached, a client whose class uses less than its reserved share of it
+    is still admitted, the most recent client of the lowest class being
+    shed to make room. Other clients are rejected.
+    """
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.clients_limit: Optional[int] = None
+        self.bandwidth_limit: Optional[int] = None
+        # Mount point -> (clients limit, bandwidth limit)
+        self.mount_limits: dict[str, tuple[Optional[int], Optional[int]]] = {}
+        self.classes: list[PriorityClass] = []
+        # Class name -> priority, 0 being the highest
+        self.priorities = {DEFAULT_CLASS: 0}
+        # Mount point -> class name -> number of clients
+        self.class_clients: dict[str, dict[str, int]] = {}
+        self.rejected: dict[tuple[str, str], int] = {}
+        self.shed: dict[tuple[str, str], int] = {}
+
+    def configure(
+        self,
+        clients_limit: Optional[int],
+        bandwidth_limit: Optional[int],
+        mount_limits: dict[str, tuple[Optional[int], Optional[int]]],
+        classes: list[PriorityClass],
+    ) -> None:
+        self.clients_limit = clients_limit
+        self.bandwidth_limit = bandwidth_limit
+        self.mount_limits = mount_limits
+        self.classes = classes
+        self.priorities = dict((priority_class.name, priority) for priority, priority_class in enumerate(classes))
+        self.priorities[DEFAULT_CLASS] = len(classes)
+
+    def has_bandwidth_limits(self) -> bool:
+        return bool(self.bandwidth_limit or any(limits[1] for limits in self.mount_limits.values()))
+
+    def rate(self, path: str) -> float:
+        return self.server.metrics.ingest_rate(path)
+
+    def classify(self, request: "HTTPRequest") -> str:
+        for priority_class in self.classes:
+            if priority_class.matches(request):
+                return priority_class.name
+        return DEFAULT_CLASS
+
+    def usage(self, paths: list[str], class_name: Optional[str], bandwidth: bool) -> float:
+        """Clients, or estimated bandwidth, of paths, only counting those
+        of class_name if given."""
+        usage = 0.0
+        for path in paths:
+            counts = self.class_clients.get(path, {})
+            clients = counts.get(class_name, 0) if class_name is not None else sum(counts.values())
+            usage += clients * self.rate(path) if bandwidth else clients
+        return usage
+
+    def admission_error(self, path: str, class_name: str) -> Optional[str]:
+        """Return which limit a new client of class_name for path is over
+        and cannot shed its way through, or None, having shed what had to
+        be."""
+        mount_clients_limit, mount_bandwidth_limit = self.mount_limits.get(path, (None, None))
+        all_paths = list(self.class_clients)
+        for reason, limit, paths, bandwidth in (
+            ("clients_limit", self.clients_limit, all_paths, False),
+            ("mount_clients_limit", mount_clients_limit, [path], False),
+            ("bandwidth_limit", self.bandwidth_limit, all_paths, True),
+            ("mount_bandwidth_limit", mount_bandwidth_limit, [path], True),
+        ):
+            if not limit:
+                continue
+            cost = self.rate(path) if bandwidth else 1
+            excess = self.usage(paths, None, bandwidth) + cost - limit
+            if excess <= 0:
+                continue
+            share = self.class_share(class_name)
+            if not share or self.usage(paths, class_name, bandwidth) + cost > share * limit:
+                return reason
+            if not self.shed_clients(paths, class_name, excess, bandwidth):
+                return reason
+        return None
+
+    def priority(self, class_name: str) -> int:
+        # Classes removed by a reload rank with the default one
+        return self.priorities.get(class_name, self.priorities[DEFAULT_CLASS])
+
+    def class_share(self, class_name: str) -> float:
+        for priority_class in self.classes:
+            if priority_class.name == class_name:
+                return priority_class.share
+        return 0
+
+    def shed_clients(self, paths: list[str], class_name: str, excess: float, bandwidth: bool) -> bool:
+        """Close clients of paths with a lower priority than class_name,
+        the lowest and most recent first, until excess clients or
+        bandwidth are freed. Return whether there were enough of them."""
+        priority = self.priority(class_name)
+        candidates = [
+            client
+            for client in self.server.all_clients()
+            if client.path in paths and self.priority(client.priority_class) > priority and not client.closed
+        ]
+        candidates.sort(key=lambda client: (self.priority(client.priority_class), client.connect_time), reverse=True)
+        victims = []
+        for client in candidates:
+            if excess <= 0:
+                break
+            victims.append(client)
+            excess -= self.rate(client.path) if bandwidth else 1
+        if excess > 0:
+            return False
+        for client in victims:
+            key = (client.path, client.priority_class)
+            self.shed[key] = self.shed.get(key, 0) + 1
+            client.close_reason = "shed"
+            client.close()
+        return True
+
+    def admit(self, request: "HTTPRequest", path: str) -> Optional[str]:
+        """Return the class of a new client of request for path, or None
+        if it is to be rejected."""
+        class_name = self.classify(request)
+        reason = self.admission_error(path, class_name)
+        if reason is not None:
+            key = (path, reason)
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+            return None
+        return class_name
+
+    def client_added(self, client: "StreamClient") -> None:
+        counts = self.class_clients.setdefault(client.path, {})
+        counts[client.priority_class] = counts.get(client.priority_class, 0) + 1
+
+    def client_removed(self, client: "StreamClient") -> None:
+        counts = self.class_clients.get(client.path, {})
+        clients = counts.get(client.priority_class, 0) - 1
+        if clients > 0:
+            counts[client.priority_class] = clients
+        else:
+            counts.pop(client.priority_class, None)
+            if not counts:
+                self.class_clients.pop(client.path, None)
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "clients_limit": self.clients_limit,
+            "bandwidth_limit": self.bandwidth_limit,
+            "mounts": dict(
+                (
+                    path,
+                    {
+                        "clients": counts,
+                        "bandwidth": self.usage([path], None, True),
+                        "clients_limit": self.mount_limits.get(path, (None, None))[0],
+                        "bandwidth_limit": self.mount_limits.get(path, (None, None))[1],
+                    },
+                )
+                for path, counts in self.class_clients.items()
+            ),
+            "rejected": dict(("%s %s" % key, count) for key, count in self.rejected.items()),
+            "shed": dict(("%s %s" % key, count) for key, count in self.shed.items()),
+        }
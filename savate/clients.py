@@ -1,17 +1,42 @@
 import socket
+import struct
 from typing import TYPE_CHECKING, Optional, Union
 
 from cyhttp11 import HTTPParser
 
+from savate.capacity import DEFAULT_CLASS
 from savate.looping import POLLOUT
 from savate.helpers import HTTPEventHandler, HTTPResponse
 from savate.sources import StreamSource
+from savate.tcpinfo import TCPInfo
 
 if TYPE_CHECKING:
     from savate.server import TCPServer
 
 
+# Not exposed by the socket module, Linux only
+SO_MAX_PACING_RATE = getattr(socket, "SO_MAX_PACING_RATE", 47)
+# Pacing rate meaning no pacing
+UNPACED = 0xFFFFFFFF
+
+
 class StreamClient(HTTPEventHandler):
+
+    # Whether queued data can be dropped without breaking the stream
+    # beyond what a player recovers from
+    trimmable = True
+
+    # Set by the server once the client is admitted
+    priority_class = DEFAULT_CLASS
+
+    # Set by ClientHealthMonitor
+    health = "healthy"
+    tcp_info: Optional[TCPInfo] = None
+
+    # Multiple of the stream bitrate clients are paced at once their burst
+    # is sent, to catch up with jitter
+    PACING_LIVE_MULTIPLE = 2
+
     def __init__(
         self,
         server: "TCPServer",
@@ -31,24 +56,74 @@ class StreamClient(HTTPEventHandler):
 
         super().__init__(server, sock, address, request_parser, http_response)
         self.source = source
+        # The mount point we're a client of, even when keepalived
+        self.path = source.path
+        self.mount_metrics = server.metrics.mount(self.path)
         self.timeout_state = False
         self.server.remove_inactivity_timeout(self)
+        # Whether the initial burst is still being sent, paced
+        self.bursting = False
+        self.live_pacing_rate: Optional[float] = None
+        self.corked = False
 
     @property
     def closed(self) -> bool:
-        return self.sock is None
+        # BaseIOEventHandler.close() deletes the socket
+        return getattr(self, "sock", None) is None
 
     def activate_timeout(self) -> None:
         if not self.timeout_state:
             self.timeout_state = True
             self.server.reset_inactivity_timeout(self)
 
+    def set_pacing_rate(self, rate: Optional[float]) -> None:
+        """Have the kernel send at most rate bytes per second, or as fast
+        as it can if rate is None."""
+        try:
+            self.sock.setsockopt(
+                socket.SOL_SOCKET,
+                SO_MAX_PACING_RATE,
+                struct.pack("=I", min(int(rate), UNPACED - 1) if rate else UNPACED),
+            )
+        except OSError as exc:
+            self.server.logger.warning("Cannot pace %s: %s", self.address, exc)
+
+    def start_pacing(self, burst_rate: float, live_rate: Optional[float]) -> None:
+        """Send the burst, already queued, at burst_rate, then the stream
+        at live_rate.
+
+        The pacing rate also applies to what is already in the kernel
+        send buffer, so it is only lowered once the burst had the time
+        to be delivered at burst_rate, not once it is written.
+        """
+        self.bursting = True
+        self.live_pacing_rate = live_rate
+        self.set_pacing_rate(burst_rate)
+        self.server.timeouts.reset_timeout(
+            self, self.server.loop.now() + self.output_buffer.queued_bytes / burst_rate, self.burst_done
+        )
+
+    def burst_done(self) -> None:
+        """Called once the initial burst is delivered, if it was paced."""
+        self.bursting = False
+        if not self.closed:
+            self.set_pacing_rate(self.live_pacing_rate)
+
+    def set_cork(self, cork: bool) -> None:
+        self.corked = cork
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, cork)
+        except OSError as exc:
+            self.server.logger.warning("Cannot cork %s: %s", self.address, exc)
+
     def add_packet(self, packet: bytes) -> None:
         self.output_buffer.add_buffer(packet)
         self.activate_timeout()
         self.server.loop.register(self, POLLOUT)
 
     def close(self) -> None:
+        if self.bursting:
+            self.server.timeouts.remove_timeout(self)
         self.server.remove_client(self)
         super().close()
 
@@ -58,7 +133,12 @@ class StreamClient(HTTPEventHandler):
         pass
 
     def flush(self) -> None:
+        bytes_sent = self.bytes_sent
         super().flush()
+        self.mount_metrics.bytes_out += self.bytes_sent - bytes_sent
+        if self.corked and not self.closed:
+            # The burst is written, send what is left of it
+            self.set_cork(False)
         if self.output_buffer.ready:
             # De-activate handler to avoid unnecessary notifications
             self.server.loop.register(self, 0)
@@ -95,6 +175,8 @@ class ShoutcastClient(StreamClient):
             self.metadata = b""
             self.bytes_count = 0
             self.add_packet = self.add_packet_with_metadata  # type: ignore[assignment]
+            # Metadata is inserted every ICY_META_INTERVAL bytes sent
+            self.trimmable = False
             headers[b"icy-metaint"] = b"%s" % self.ICY_META_INTERVAL
 
         super().__init__(
@@ -1,10 +1,22 @@
-import collections
+import functools
+import ipaddress
 import itertools
+import json
 import urllib.parse
-import socket
 import sys
 import re
-from typing import TYPE_CHECKING, Any, Optional, Union
+import socket
+import tempfile
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Union
+
+from savate.capacity import DEFAULT_CLASS, PriorityClass
+from savate.helpers import AddrInfo
+from savate.logs import LogAggregator
+from savate.looping import InstrumentedIOLoop
+from savate.profiler import SamplingProfiler
+from savate.relay import HedgedRelayGroup
+from savate.sockopts import CLIENT_ONLY_OPTIONS, check_socket_options
+from savate.tcpinfo import ClientHealthMonitor
 
 if TYPE_CHECKING:
     from savate.server import TCPServer
@@ -38,67 +50,361 @@ def convert_burst_size(size: Optional[Union[int, str]]) -> Optional[int]:
     raise BadConfig("Bad format for burst size.")
 
 
+def parse_source_url(source_url: Union[str, dict[str, Any]]) -> tuple[str, float]:
+    """Return the (url, weight) tuple for a `source_urls` entry.
+
+    Entries are either plain URLs or dicts with an `url` and an optional
+    `weight` key.
+    """
+    if isinstance(source_url, str):
+        return source_url, 1
+
+    try:
+        url = source_url["url"]
+    except (KeyError, TypeError):
+        raise BadConfig("Source URL entries must be strings or dicts with an url.")
+    weight = source_url.get("weight", 1)
+    if not isinstance(weight, (int, float)) or weight <= 0:
+        raise BadConfig("Source URL weight must be a positive number.")
+    return url, weight
+
+
+def check_pacing(conf: dict[str, Any]) -> None:
+    for key in ("pacing_burst_multiple", "pacing_live_multiple"):
+        multiple = conf.get(key)
+        if multiple is not None and (not isinstance(multiple, (int, float)) or multiple < 0):
+            raise BadConfig("%s must be a positive number." % key)
+
+
+def check_admission(config_dict: dict[str, Any]) -> None:
+    max_connections = config_dict.get("max_connections_per_ip")
+    if max_connections is not None:
+        try:
+            if int(max_connections) < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise BadConfig("max_connections_per_ip must be a positive integer.")
+    for key in (
+        "connection_rate_per_ip",
+        "connection_burst_per_ip",
+        "connection_rate_per_subnet",
+        "connection_burst_per_subnet",
+    ):
+        value = config_dict.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or value < 0):
+            raise BadConfig("%s must be a positive number." % key)
+    for key, max_prefix in (("subnet_prefix_v4", 32), ("subnet_prefix_v6", 128)):
+        prefix = config_dict.get(key)
+        if prefix is not None and (not isinstance(prefix, int) or not 0 <= prefix <= max_prefix):
+            raise BadConfig("%s must be an integer between 0 and %d." % (key, max_prefix))
+    try:
+        for network in config_dict.get("admission_exempt", []):
+            ipaddress.ip_network(network)
+    except (TypeError, ValueError) as exc:
+        raise BadConfig("Bad admission_exempt network: %s." % exc)
+    if config_dict.get("admission_reject", "close") not in ("close", "429"):
+        raise BadConfig("admission_reject must be close or 429.")
+
+
+def check_socket_config(conf: dict[str, Any]) -> None:
+    try:
+        check_socket_options(conf.get("client_socket_options", {}), CLIENT_ONLY_OPTIONS)
+        check_socket_options(conf.get("source_socket_options", {}))
+    except ValueError as exc:
+        raise BadConfig("Bad socket options: %s." % exc)
+
+
+def validate_config(config_dict: Any) -> None:
+    """Check a configuration for the errors that would otherwise only be
+    found half way through applying it."""
+    if not isinstance(config_dict, dict):
+        raise BadConfig("The configuration must be a dictionary.")
+    convert_burst_size(config_dict.get("burst_size"))
+    convert_burst_size(config_dict.get("max_buffered_bytes"))
+    if config_dict.get("overload_action", "pause") not in ("pause", "reject"):
+        raise BadConfig("overload_action must be pause or reject.")
+    check_admission(config_dict)
+    convert_burst_size(config_dict.get("output_memory_budget"))
+    if config_dict.get("output_memory_action", "evict") not in ("evict", "trim"):
+        raise BadConfig("output_memory_action must be evict or trim.")
+    convert_burst_size(config_dict.get("bandwidth_limit"))
+    class_names = set()
+    for class_conf in config_dict.get("priority_classes", []):
+        if not isinstance(class_conf, dict) or not class_conf.get("name"):
+            raise BadConfig("Priority classes must be dictionaries with a name.")
+        if class_conf["name"] in class_names or class_conf["name"] == DEFAULT_CLASS:
+            raise BadConfig("Priority class names must be unique, and not %s." % DEFAULT_CLASS)
+        class_names.add(class_conf["name"])
+        try:
+            priority_class = PriorityClass(**class_conf)
+        except (TypeError, ValueError) as exc:
+            raise BadConfig("Bad priority class %s: %s." % (class_conf["name"], exc))
+        if not 0 <= priority_class.share <= 1:
+            raise BadConfig("Priority class shares must be between 0 and 1.")
+    check_pacing(config_dict)
+    for key in ("tcp_info_interval", "tcp_dead_timeout"):
+        value = config_dict.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or value < 0):
+            raise BadConfig("%s must be a positive number." % key)
+    check_socket_config(config_dict)
+    for mount_conf in config_dict.get("mounts", []):
+        if not isinstance(mount_conf, dict) or "path" not in mount_conf:
+            raise BadConfig("Mounts must be dictionaries with a path.")
+        check_pacing(mount_conf)
+        check_socket_config(mount_conf)
+        convert_burst_size(mount_conf.get("burst_size"))
+        convert_burst_size(mount_conf.get("bandwidth_limit"))
+        clients_limit = mount_conf.get("clients_limit")
+        if clients_limit is not None:
+            try:
+                if int(clients_limit) <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise BadConfig("Mount clients_limit must be a positive integer.")
+        for source_url in mount_conf.get("source_urls", []):
+            parse_source_url(source_url)
+    for handler_conf in itertools.chain(
+        config_dict.get("auth", []), config_dict.get("status", {}).values(), config_dict.get("statistics", [])
+    ):
+        if not isinstance(handler_conf, dict) or "." not in str(handler_conf.get("handler", "")):
+            raise BadConfig("Handlers must be dictionaries with a dotted handler name.")
+
+
+class ConfigDiff:
+    """The differences between two configurations."""
+
+    HANDLER_SECTIONS = ("auth", "status", "statistics")
+
+    def __init__(self, old_config: dict[str, Any], new_config: dict[str, Any]) -> None:
+        old_mounts = dict((mount_conf["path"], mount_conf) for mount_conf in old_config.get("mounts", []))
+        new_mounts = dict((mount_conf["path"], mount_conf) for mount_conf in new_config.get("mounts", []))
+        self.added_mounts = set(new_mounts) - set(old_mounts)
+        self.removed_mounts = set(old_mounts) - set(new_mounts)
+        self.changed_mounts = set(
+            path for path in set(old_mounts) & set(new_mounts) if old_mounts[path] != new_mounts[path]
+        )
+        self.changed_globals = set(
+            key
+            for key in set(old_config) | set(new_config)
+            if key != "mounts" and key not in self.HANDLER_SECTIONS and old_config.get(key) != new_config.get(key)
+        )
+        self.all_mounts = set(old_mounts) | set(new_mounts)
+
+    def __bool__(self) -> bool:
+        return bool(self.added_mounts or self.removed_mounts or self.changed_mounts or self.changed_globals)
+
+    def __str__(self) -> str:
+        return "%d mounts added, %d removed, %d changed, global options changed: %s" % (
+            len(self.added_mounts),
+            len(self.removed_mounts),
+            len(self.changed_mounts),
+            ", ".join(sorted(self.changed_globals)) or "none",
+        )
+
+    def affected_mounts(self, inherited_options: set[str]) -> set[str]:
+        """Return the mounts to reconfigure, all of them if one of the
+        global options mounts inherit changed."""
+        if self.changed_globals & inherited_options:
+            return self.all_mounts
+        return self.added_mounts | self.removed_mounts | self.changed_mounts
+
+
+def load_config(
+    config_file: str, current_config: Optional[dict[str, Any]] = None
+) -> tuple[dict[str, Any], Optional[ConfigDiff]]:
+    """Read and validate a configuration file, and compare it with the
+    current configuration if any.
+
+    This does not touch the server, so that it can run outside of the
+    loop.
+    """
+    with open(config_file) as conf_file:
+        config_dict = json.load(conf_file)
+    validate_config(config_dict)
+    if current_config is None:
+        return config_dict, None
+    return config_dict, ConfigDiff(current_config, config_dict)
+
+
+def match_handler(old_handlers: list[tuple[dict[str, Any], Any]], handler_conf: dict[str, Any]) -> Any:
+    """Pop and return the handler built from handler_conf in old_handlers,
+    a list of (handler configuration, handler) tuples, or None."""
+    for index, (old_conf, handler) in enumerate(old_handlers):
+        if old_conf == handler_conf:
+            del old_handlers[index]
+            return handler
+    return None
+
+
+def handler_module(handler_conf: dict[str, Any]) -> str:
+    return handler_conf["handler"].rsplit(".", 1)[0]
+
+
 class ServerConfiguration:
     def __init__(self, server: "TCPServer", config_dict: dict[str, Any]):
         self.server = server
         self.config_dict = config_dict
 
         self.modules_loaded: set[str] = set()  # keep trace of the modules we load
+        # Global options looked up for a mount, and so inherited by mounts.
+        # Changing the other ones does not require going through every
+        # mount.
+        self.inherited_options: set[str] = set()
 
     def __getitem__(self, key: str) -> Any:
         return self.config_dict[key]
 
+    @property
+    def config_dict(self) -> dict[str, Any]:
+        return self._config_dict
+
+    @config_dict.setter
+    def config_dict(self, config_dict: dict[str, Any]) -> None:
+        self._config_dict = config_dict
+        # index mounts configuration by path
+        self.mounts: dict[str, dict[str, Any]] = dict(
+            (mount_conf["path"], mount_conf) for mount_conf in config_dict.get("mounts", [])
+        )
+
+    def get_mount_option(self, path: str, key: str, default: Any = None) -> Any:
+        """Return the value of a mount option for path, falling back on the
+        global option then default."""
+        self.inherited_options.add(key)
+        return self.mounts.get(path, {}).get(key, self.config_dict.get(key, default))
+
     def configure(self) -> None:
         self.configure_stats()
         self.configure_authorization()
         self.configure_status()
         self.configure_relays()
         self.configure_limits()
-
-    def reconfigure(self, config_dict: dict[str, Any]) -> None:
+        self.server.admission.configure(self.config_dict)
+        self.configure_overload()
+        self.configure_governor()
+        self.configure_loop()
+        self.configure_profiler()
+        self.configure_listener()
+        self.configure_health_monitor()
+        self.server.log_aggregator.set_interval(
+            float(self.config_dict.get("log_aggregation_interval", LogAggregator.INTERVAL))
+        )
+        self.schedule_relays_refresh()
+
+    def reconfigure(self, config_dict: dict[str, Any], diff: Optional[ConfigDiff] = None) -> None:
+        """Switch to config_dict, only touching what changed.
+
+        diff is the ConfigDiff between the current configuration and
+        config_dict, it is computed if not given.
+        """
+        old_config = self.config_dict
+        if diff is None:
+            diff = ConfigDiff(old_config, config_dict)
+        self.server.logger.info("Reconfiguring: %s", diff)
         self.config_dict = config_dict
+
+        self.reconfigure_handlers(old_config, bool(diff))
+        affected_mounts = diff.affected_mounts(self.inherited_options)
+        self.reconfigure_relays(affected_mounts)
+
+        # Take new configuration into account
+        self.server.resolver.ttl = self.config_dict.get("dns_ttl", self.server.resolver.DEFAULT_TTL)
+        self.configure_relays(affected_mounts)
+        self.configure_limits()
+        self.server.admission.configure(self.config_dict)
+        self.configure_overload()
+        self.configure_governor()
+        self.configure_loop()
+        self.configure_profiler()
+        self.configure_listener()
+        self.configure_health_monitor()
+        self.server.log_aggregator.set_interval(
+            float(self.config_dict.get("log_aggregation_interval", LogAggregator.INTERVAL))
+        )
+        self.schedule_relays_refresh()
+
+    def reconfigure_handlers(self, old_config: dict[str, Any], server_config_changed: bool) -> None:
+        # Pair current handlers with the configuration they were built from
+        old_auth = list(zip(old_config.get("auth", []), self.server.auth_handlers))
+        old_status = [
+            (status_conf, self.server.status_handlers[handler_path])
+            for handler_path, status_conf in old_config.get("status", {}).items()
+            if handler_path in self.server.status_handlers
+        ]
+        old_stats = list(zip(old_config.get("statistics", []), self.server.statistics_handlers))
+
+        # Handlers whose configuration did not change are kept
+        auth_handlers = [match_handler(old_auth, auth_conf) for auth_conf in self.config_dict.get("auth", [])]
+        status_handlers = dict(
+            (handler_path, match_handler(old_status, status_conf))
+            for handler_path, status_conf in self.config_dict.get("status", {}).items()
+        )
+        stats_handlers = [match_handler(old_stats, stats_conf) for stats_conf in self.config_dict.get("statistics", [])]
+
+        # Whatever is left over has been removed or changed.
         # authorization, status and statistics handlers may have a close method
-        for handler in itertools.chain(
-            self.server.auth_handlers, self.server.status_handlers, self.server.statistics_handlers
-        ):
+        removed_confs = []
+        for handler_conf, handler in itertools.chain(old_auth, old_status, old_stats):
+            removed_confs.append(handler_conf)
             if callable(getattr(handler, "close", None)):
                 handler.close()  # type: ignore[attr-defined]
-        # make sure modules will be reloaded
-        for module_name in self.modules_loaded:
-            sys.modules.pop(module_name, None)
-        self.modules_loaded = set()
-        # Drop authorization, status and statistics handlers, they will be
-        # properly re-created anyway
-        self.server.auth_handlers = []
-        self.server.status_handlers = {}
-        self.server.statistics_handlers = []
-        self.configure_authorization()
-        self.configure_status()
-        self.configure_stats()
-
-        # Here comes the tricky part: identifying which relays we need
-        # to drop
-        tmp_relays = self.server.relays
-        self.server.relays = {}
 
-        # use a dict to index all relays configurations
-        # values are tuples ( burstsizes or None, keepalive or None)
+        handler_confs = list(
+            itertools.chain(
+                zip(self.config_dict.get("auth", []), auth_handlers),
+                ((self.config_dict["status"][path], handler) for path, handler in status_handlers.items()),
+                zip(self.config_dict.get("statistics", []), stats_handlers),
+            )
+        )
+        # make sure modules will be reloaded, unless a handler we keep
+        # still uses them
+        modules_kept = set(handler_module(conf) for conf, handler in handler_confs if handler is not None)
+        modules_reloaded = set(handler_module(conf) for conf in removed_confs) | set(
+            handler_module(conf) for conf, handler in handler_confs if handler is None
+        )
+        for module_name in modules_reloaded - modules_kept:
+            sys.modules.pop(module_name, None)
+        self.modules_loaded = set(handler_module(conf) for conf, handler in handler_confs)
+
+        if server_config_changed:
+            # Kept handlers may depend on global or mounts options
+            for handler in itertools.chain(auth_handlers, status_handlers.values()):
+                if handler is not None:
+                    handler.update_server_config(self.config_dict)
+
+        # Build the new handlers
+        for index, auth_conf in enumerate(self.config_dict.get("auth", [])):
+            if auth_handlers[index] is None:
+                auth_handlers[index] = self.load_handler(auth_conf, self.config_dict)
+        for handler_path, status_handler in status_handlers.items():
+            if status_handler is None:
+                status_handlers[handler_path] = self.load_handler(
+                    self.config_dict["status"][handler_path], self.config_dict
+                )
+        for index, stats_conf in enumerate(self.config_dict.get("statistics", [])):
+            if stats_handlers[index] is None:
+                stats_handlers[index] = self.load_handler(stats_conf)
+
+        self.server.auth_handlers = auth_handlers
+        self.server.status_handlers = status_handlers
+        self.server.statistics_handlers = stats_handlers
+
+    def reconfigure_relays(self, paths: set[str]) -> None:
+        """Update or drop the relays of mounts in paths."""
+        # use a dict to index these mounts relays configurations
+        # values are tuples ( burstsizes or None, keepalive or None, weight)
         # if a relay is represented in the index, it means it exists
         relay_index = dict(
             (
-                (url, mount["path"]),
+                (url, path),
                 (
-                    convert_burst_size(
-                        mount.get(
-                            "burst_size",
-                            self.config_dict.get("burst_size"),
-                        ),
-                    ),
-                    mount.get("keepalive", self.config_dict.get("keepalive")),
+                    convert_burst_size(self.get_mount_option(path, "burst_size")),
+                    self.get_mount_option(path, "keepalive"),
+                    weight,
                 ),
             )
-            for mount in self.config_dict.get("mounts", [])
-            for url in mount.get("source_urls", [])
+            for path in paths
+            if path in self.mounts
+            for url, weight in map(parse_source_url, self.mounts[path].get("source_urls", []))
         )
         # source index same as relays but with source instances as values
         source_index = dict(
@@ -106,11 +412,13 @@ class ServerConfiguration:
                 source.sock,
                 source,
             )
-            for sources in self.server.sources.values()
-            for source in sources
+            for path in paths
+            for source in self.server.sources.get(path, {})
         )
 
-        for relay in list(tmp_relays.values()):
+        for relay in list(self.server.relays.values()):
+            if relay.path not in paths:
+                continue
             relay_params = relay_index.get((relay.url, relay.path), None)
             if relay_params is not None:
                 # update relay burst size
@@ -122,87 +430,106 @@ class ServerConfiguration:
                 except (ValueError, TypeError):
                     relay.keepalive = None
 
+                relay.weight = relay_params[2]
+
                 # update sources burst size
                 source = source_index.get(relay.sock)
                 if source is not None:
                     source.update_burst_size(relay.burst_size)
                     source.keepalive = relay.keepalive
-
-                self.server.relays[relay.sock] = relay
+                    self.server.source_selectors[source.path].add_source(source, relay.weight)
             else:
-                source = source_index.get(relay.sock)
-                if source is not None:
-                    self.server.logger.info(
-                        "Dropping source %s since it has " "been removed from configuration", source
-                    )
-                    source.close()
-                else:
-                    # This relay has not been yet added as a source
-                    relay.close()
-
-        # Any relay marked to be restarted must be checked as well
-        relays_to_restart = self.server.relays_to_restart
-        self.server.relays_to_restart = collections.deque()
-
-        for timeout, relay in relays_to_restart:
-            if (relay.url, relay.path) in relay_index:
-                self.server.relays_to_restart.append((timeout, relay))
-
-        # Take new configuration into account
-        self.configure_relays()
-        self.configure_limits()
-
-    def configure_relays(self) -> None:
+                self.server.logger.info("Dropping %s since it has been removed from configuration", relay)
+                self.server.drop_relay(relay)
+
+        # Hedged relay groups too
+        for group_key, group in list(self.server.relay_groups.items()):
+            if group_key[1] in paths and (group_key not in relay_index or not self.is_hedged(group_key[1])):
+                group.close()
+                del self.server.relay_groups[group_key]
+
+        # Any relay waiting to be (re)started must be checked as well
+        for key in self.server.relay_scheduler.pending_keys():
+            if key[1] in paths and (key[0], key[1]) not in relay_index:
+                self.server.relay_scheduler.cancel(key)
+
+        for path in paths:
+            if path in self.server.source_selectors:
+                self.server.source_selectors[path].hot_standby = self.get_mount_option(path, "hot_standby", False)
+
+    def configure_relays(self, paths: Optional[Iterable[str]] = None) -> None:
+        """Start the missing relays of mounts in paths, or of all mounts."""
         conf = self.config_dict
         server = self.server
-        global_burst_size = conf.get("burst_size", None)
-        global_on_demand = conf.get("on_demand", False)
-        global_keepalive = conf.get("keepalive", False)
 
-        net_resolve_all = conf.get("net_resolve_all", False)
+        scheduler = server.relay_scheduler
+        scheduler.restart_delay = conf.get("relay_restart_delay", scheduler.RESTART_DELAY)
+        scheduler.max_delay = conf.get("relay_restart_max_delay", scheduler.MAX_RESTART_DELAY)
+        scheduler.connect_limit = conf.get("relay_connect_limit", scheduler.CONNECT_LIMIT)
 
-        # index
-        relay_index = dict(
-            (
-                (relay.url, relay.path, relay.addr_info),
-                relay,
-            )
-            for relay in itertools.chain(
-                iter(self.server.relays.values()),
-                (relay for timeout, relay in self.server.relays_to_restart),
-            )
-        )
+        # index of running relays and of the ones waiting to be started
+        relay_index = set(relay.key for relay in server.relays.values()) | scheduler.pending_keys()
 
-        for mount_conf in conf.get("mounts", {}):
+        if paths is None:
+            mounts = conf.get("mounts", [])
+        else:
+            mounts = [self.mounts[path] for path in paths if path in self.mounts]
+        for mount_conf in mounts:
             if "source_urls" not in mount_conf:
                 continue
 
-            mount_burst_size = convert_burst_size(mount_conf.get("burst_size", global_burst_size))
-            mount_on_demand = mount_conf.get("on_demand", global_on_demand)
-            mount_keep_alive = mount_conf.get("keepalive", global_keepalive)
             path = mount_conf["path"]
-            for source_url in mount_conf["source_urls"]:
+            mount_burst_size = convert_burst_size(self.get_mount_option(path, "burst_size"))
+            mount_on_demand = self.get_mount_option(path, "on_demand", False)
+            if self.get_mount_option(path, "hot_standby", False):
+                # Backup sources need to be kept running to be able to
+                # take over at any time
+                mount_on_demand = False
+            mount_keep_alive = self.get_mount_option(path, "keepalive", False)
+            for source_url, weight in map(parse_source_url, mount_conf["source_urls"]):
                 parsed_url = urllib.parse.urlparse(source_url)
                 if parsed_url.scheme in ("udp", "multicast"):
                     if (source_url, path, None) not in relay_index:
                         server.logger.info("Trying to relay %s", source_url)
-                        server.add_relay(source_url, path, burst_size=mount_burst_size)
+                        server.add_relay(
+                            source_url,
+                            path,
+                            burst_size=mount_burst_size,
+                            weight=weight,
+                            merge_feeds=mount_conf.get("merge_feeds", False),
+                        )
                 else:
-                    if mount_conf.get("net_resolve_all", net_resolve_all):
-                        for address_info in socket.getaddrinfo(
+                    if self.is_hedged(path):
+                        group = server.relay_groups.get((source_url, path))
+                        if group is None:
+                            server.logger.info("Trying to relay %s from its fastest address", source_url)
+                            group = HedgedRelayGroup(server, source_url, path)
+                            server.relay_groups[(source_url, path)] = group
+                        group.burst_size = mount_burst_size
+                        group.on_demand = mount_on_demand
+                        group.keepalive = mount_keep_alive
+                        group.weight = weight
+                        server.resolver.resolve(
+                            parsed_url.hostname,
+                            parsed_url.port,
+                            functools.partial(self.update_relay_group, source_url, path),
+                        )
+                    elif self.get_mount_option(path, "net_resolve_all", False):
+                        # Resolution happens in the background, relays
+                        # are added once it's done
+                        server.resolver.resolve(
                             parsed_url.hostname,
                             parsed_url.port,
-                            socket.AF_UNSPEC,
-                            socket.SOCK_STREAM,
-                            socket.IPPROTO_TCP,
-                        ):
-                            if (source_url, path, address_info) not in relay_index:
-                                server.logger.info(
-                                    "Trying to relay %s from %s:%s", source_url, address_info[4][0], address_info[4][1]
-                                )
-                                server.add_relay(
-                                    source_url, path, address_info, mount_burst_size, mount_on_demand, mount_keep_alive
-                                )
+                            functools.partial(
+                                self.add_resolved_relays,
+                                source_url,
+                                path,
+                                mount_burst_size,
+                                mount_on_demand,
+                                mount_keep_alive,
+                                weight,
+                            ),
+                        )
                     else:
                         if (source_url, path, None) not in relay_index:
                             server.logger.info("Trying to relay %s", source_url)
@@ -212,48 +539,183 @@ class ServerConfiguration:
                                 burst_size=mount_burst_size,
                                 on_demand=mount_on_demand,
                                 keepalive=mount_keep_alive,
+                                weight=weight,
                             )
 
+    def add_resolved_relays(
+        self,
+        source_url: str,
+        path: str,
+        burst_size: Optional[int],
+        on_demand: bool,
+        keepalive: Optional[int],
+        weight: float,
+        addr_infos: list[AddrInfo],
+    ) -> None:
+        server = self.server
+        if not addr_infos:
+            # Resolution failed, keep whatever relays we have
+            return
+        if (source_url, path) not in self.relay_urls():
+            # Removed from the configuration while we were resolving
+            return
+
+        relays = dict(
+            (relay.addr_info, relay)
+            for relay in server.relays.values()
+            if relay.url == source_url and relay.path == path
+        )
+        pending_addr_infos = set(
+            key[2] for key in server.relay_scheduler.pending_keys() if key[0] == source_url and key[1] == path
+        )
+        # Drop the relays whose address has vanished from DNS
+        for addr_info in set(relays) | pending_addr_infos:
+            if addr_info is not None and addr_info not in addr_infos:
+                server.logger.info(
+                    "Dropping relay %s from %s:%s, address is gone", source_url, addr_info[4][0], addr_info[4][1]
+                )
+                if addr_info in relays:
+                    server.drop_relay(relays[addr_info])
+                else:
+                    server.relay_scheduler.cancel((source_url, path, addr_info))
+
+        known_addr_infos = set(relays) | pending_addr_infos
+        for address_info in addr_infos:
+            if address_info not in known_addr_infos:
+                server.logger.info("Trying to relay %s from %s:%s", source_url, address_info[4][0], address_info[4][1])
+                server.add_relay(
+                    source_url,
+                    path,
+                    address_info,
+                    burst_size,
+                    on_demand,
+                    keepalive,
+                    weight,
+                )
+
+    def update_relay_group(self, source_url: str, path: str, addr_infos: list[AddrInfo]) -> None:
+        group = self.server.relay_groups.get((source_url, path))
+        # Resolution failures keep the current addresses
+        if group is not None and addr_infos:
+            group.update_addresses(addr_infos)
+
+    def is_hedged(self, path: str) -> bool:
+        return bool(
+            self.get_mount_option(path, "net_resolve_all", False)
+            and self.get_mount_option(path, "hedged_connect", False)
+        )
+
+    def relay_urls(self) -> set[tuple[str, str]]:
+        return set(
+            (url, mount["path"])
+            for mount in self.config_dict.get("mounts", [])
+            for url, weight in map(parse_source_url, mount.get("source_urls", []))
+        )
+
+    def schedule_relays_refresh(self) -> None:
+        self.server.timeouts.reset_timeout(
+            "relays refresh", self.server.loop.now() + self.server.resolver.ttl, self.refresh_relays
+        )
+
+    def refresh_relays(self) -> None:
+        # Resolve relay host names again, so that DNS changes get noticed
+        self.server.resolver.clear()
+        self.configure_relays()
+        self.schedule_relays_refresh()
+
+    def load_handler(self, handler_conf: dict[str, Any], *args: Any) -> Any:
+        handler_name = handler_conf["handler"]
+        handler_module_name, handler_class_name = handler_name.rsplit(".", 1)
+        self.modules_loaded.add(handler_module_name)
+        handler_module = __import__(handler_module_name, {}, {}, [""])
+        handler_class = getattr(handler_module, handler_class_name)
+        return handler_class(self.server, *args, **handler_conf)
+
     def configure_authorization(self) -> None:
         conf = self.config_dict
-        server = self.server
         for auth_handler in conf.get("auth", []):
-            handler_name = auth_handler["handler"]
-            handler_module, handler_class = handler_name.rsplit(".", 1)
-            self.modules_loaded.add(handler_module)
-            handler_module = __import__(handler_module, {}, {}, [""])
-            handler_class = getattr(handler_module, handler_class)
-            handler_instance = handler_class(server, conf, **auth_handler)
-            server.add_auth_handler(handler_instance)
+            self.server.add_auth_handler(self.load_handler(auth_handler, conf))
 
     def configure_status(self) -> None:
         conf = self.config_dict
-        server = self.server
         for handler_path, status_handler in list(conf.get("status", {}).items()):
-            handler_name = status_handler["handler"]
-            handler_module, handler_class = handler_name.rsplit(".", 1)
-            self.modules_loaded.add(handler_module)
-            handler_module = __import__(handler_module, {}, {}, [""])
-            handler_class = getattr(handler_module, handler_class)
-            handler_instance = handler_class(server, conf, **status_handler)
-            server.add_status_handler(handler_path, handler_instance)
+            self.server.add_status_handler(handler_path, self.load_handler(status_handler, conf))
 
     def configure_stats(self) -> None:
         conf = self.config_dict
-        server = self.server
         for stat_handler in conf.get("statistics", {}):
-            handler_name = stat_handler["handler"]
-            handler_module, handler_class = handler_name.rsplit(".", 1)
-            self.modules_loaded.add(handler_module)
-            handler_module = __import__(handler_module, {}, {}, [""])
-            handler_class = getattr(handler_module, handler_class)
-            handler_instance = handler_class(server, **stat_handler)
-            self.server.add_stats_handler(handler_instance)
+            self.server.add_stats_handler(self.load_handler(stat_handler))
 
     def configure_limits(self) -> None:
-        # set limits for maximum simultaneous clients
+        # set limits for maximum simultaneous clients and bandwidth
         try:
-            self.server.clients_limit = int(self.config_dict.get("clients_limit"))  # type: ignore[arg-type]
-            self.server.logger.info("Set client limit to %d", self.server.clients_limit)
+            clients_limit: Optional[int] = int(self.config_dict.get("clients_limit"))  # type: ignore[arg-type]
+            self.server.logger.info("Set client limit to %d", clients_limit)
         except (ValueError, TypeError):
-            self.server.clients_limit = None
+            clients_limit = None
+        mount_limits = {}
+        for path, mount_conf in self.mounts.items():
+            if mount_conf.get("clients_limit") or mount_conf.get("bandwidth_limit"):
+                mount_limits[path] = (
+                    int(mount_conf["clients_limit"]) if mount_conf.get("clients_limit") else None,
+                    convert_burst_size(mount_conf.get("bandwidth_limit")),
+                )
+        self.server.capacity.configure(
+            clients_limit,
+            convert_burst_size(self.config_dict.get("bandwidth_limit")),
+            mount_limits,
+            [PriorityClass(**class_conf) for class_conf in self.config_dict.get("priority_classes", [])],
+        )
+
+    def configure_loop(self) -> None:
+        # loop_instrumentation itself is only read at startup
+        loop = self.server.loop
+        if isinstance(loop, InstrumentedIOLoop):
+            loop.slow_handler_budget = float(
+                self.config_dict.get("loop_slow_handler_budget", InstrumentedIOLoop.SLOW_HANDLER_BUDGET)
+            )
+            loop.set_slow_log_size(int(self.config_dict.get("loop_slow_log_size", InstrumentedIOLoop.SLOW_LOG_SIZE)))
+
+    def configure_profiler(self) -> None:
+        profiler = self.server.profiler
+        profiler.directory = self.config_dict.get("profile_dir") or tempfile.gettempdir()
+        profiler.duration = float(self.config_dict.get("profile_duration", SamplingProfiler.DURATION))
+        profiler.interval = float(self.config_dict.get("profile_interval", SamplingProfiler.INTERVAL))
+
+    def configure_overload(self) -> None:
+        max_loop_lag = self.config_dict.get("max_loop_lag")
+        self.server.overload.configure(
+            float(max_loop_lag) if max_loop_lag else None,
+            convert_burst_size(self.config_dict.get("max_buffered_bytes")),
+            self.config_dict.get("overload_action", "pause"),
+        )
+
+    def configure_listener(self) -> None:
+        if hasattr(self.server, "sock"):
+            # Only wake us up once clients sent their request
+            self.server.sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, int(self.config_dict.get("defer_accept", 0))
+            )
+
+    def configure_health_monitor(self) -> None:
+        interval = self.config_dict.get("tcp_info_interval")
+        self.server.health_monitor.configure(
+            float(interval) if interval else None,
+            float(self.config_dict.get("tcp_dead_timeout", ClientHealthMonitor.DEAD_TIMEOUT)),
+            bool(self.config_dict.get("tcp_evict_dead", True)),
+        )
+
+    def socket_options(self, path: str, kind: str) -> dict[str, Any]:
+        """Return the kind ("client" or "source") socket options for path,
+        mount options overriding global ones."""
+        key = "%s_socket_options" % kind
+        self.inherited_options.add(key)
+        options = dict(self.config_dict.get(key, {}))
+        options.update(self.mounts.get(path, {}).get(key, {}))
+        return options
+
+    def configure_governor(self) -> None:
+        self.server.governor.configure(
+            convert_burst_size(self.config_dict.get("output_memory_budget")),
+            self.config_dict.get("output_memory_action", "evict"),
+        )
@@ -0,0 +1,73 @@
+import collections
+import concurrent.futures
+import errno
+import socket
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from savate import helpers
+from savate.looping import BaseIOEventHandler, POLLIN
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+class LoopExecutor(BaseIOEventHandler):
+    """Runs blocking calls in a thread pool, and their callbacks back in
+    the event loop.
+
+    Threads wake the loop up by writing to a socket pair, the callbacks
+    are then run from handle_event().
+    """
+
+    MAX_WORKERS = 4
+
+    def __init__(self, server: "TCPServer", max_workers: int = MAX_WORKERS) -> None:
+        self.server = server
+        self.sock, self.wakeup_sock = socket.socketpair()
+        self.sock.setblocking(False)
+        self.wakeup_sock.setblocking(False)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="savate")
+        # deque.append() and popleft() are thread safe
+        self.callbacks: collections.deque[Callable[[], None]] = collections.deque()
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        callback: Optional[Callable[["concurrent.futures.Future[Any]"], None]] = None,
+    ) -> "concurrent.futures.Future[Any]":
+        """Call func(*args) in a worker thread; callback, if any, is then
+        called from the loop with the resulting future."""
+        future = self.pool.submit(func, *args)
+        if callback is not None:
+            future.add_done_callback(partial(self.call_soon, callback))
+        return future
+
+    def call_soon(self, callback: Callable[..., None], *args: Any) -> None:
+        """Thread safe way of having callback(*args) called from the loop."""
+        self.callbacks.append(partial(callback, *args))
+        try:
+            self.wakeup_sock.send(b"\0")
+        except IOError as exc:
+            # A full socket buffer means a wakeup is already pending
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def handle_event(self, eventmask: int) -> None:
+        if eventmask & POLLIN:
+            while helpers.handle_eagain(self.sock.recv, 4096):
+                pass
+            while self.callbacks:
+                callback = self.callbacks.popleft()
+                try:
+                    callback()
+                except Exception:
+                    self.server.logger.exception("Exception in callback %s:", callback)
+        else:
+            self.server.logger.error("%s: unexpected eventmask %s", self, eventmask)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.wakeup_sock.close()
+        BaseIOEventHandler.close(self)
@@ -143,8 +143,26 @@ class FLVSource(StreamSource):
                 return True
         return False
 
+    def buffered_bytes(self) -> dict[str, int]:
+        # Burst groups tags are kept along with their joined data
+        return {
+            "burst": sum(len(data) for data in self.burst_groups_data),
+            "burst_tags": sum(len(tag.raw_data) + len(tag.body) for group in self.burst_groups for tag in group),
+            "packets_group": sum(len(tag.raw_data) + len(tag.body) for tag in self.packets_group),
+            "initial_tags": sum(len(tag.raw_data) + len(tag.body) for tag in self.initial_tags),
+            "buffer": len(self.buffer_data),
+        }
+
+    def find_sync_point(self, packet: bytes) -> Optional[int]:
+        # Packets groups are the only safe place to splice an FLV
+        # stream, see add_to_packets_group()
+        return None
+
     def add_to_packets_group(self, flv_tag: FLVTag) -> None:
         if self.is_sync_point(flv_tag):
+            # Clients migrated from another source start at the
+            # beginning of a packets group, i.e. on a keyframe
+            self.attach_pending_clients()
             # Current packets group is over, publish all of its
             # packets. It seems buffering is needed to avoid a
             # skyrocketing CPU consumption, hence the ''.join()
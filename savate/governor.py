@@ -0,0 +1,100 @@
+import logging
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from savate.clients import StreamClient
+    from savate.server import TCPServer
+
+
+class MemoryGovernor:
+    """Keeps the bytes queued for streaming clients within a budget.
+
+    Every CHECK_INTERVAL seconds, if more than `budget` bytes are
+    queued, the clients known to be lagging then the ones that are the
+    furthest behind, in seconds of their mount's incoming bitrate, are
+    trimmed (their queue is dropped
+    and they skip ahead to live) or evicted until the total is back
+    under TARGET_RATIO of the budget. Clients whose stream would not
+    survive trimming are always evicted.
+    """
+
+    CHECK_INTERVAL = 1
+    TARGET_RATIO = 0.9
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.budget: Optional[int] = None
+        self.action = "evict"
+        self.queued_bytes = 0
+        self.trimmed = 0
+        self.trimmed_bytes = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+
+    def configure(self, budget: Optional[int], action: str) -> None:
+        if action not in ("evict", "trim"):
+            raise ValueError("Unknown output memory action %r" % action)
+        self.action = action
+        if budget and not self.budget:
+            self.schedule_check()
+        elif self.budget and not budget:
+            self.server.timeouts.remove_timeout(self)
+        self.budget = budget
+
+    def schedule_check(self) -> None:
+        self.server.timeouts.reset_timeout(self, self.server.loop.now() + self.CHECK_INTERVAL, self.check)
+
+    def lag(self, client: "StreamClient") -> tuple[bool, float]:
+        """Whether client is lagging, and how far behind it is, in
+        seconds."""
+        return (
+            client.health != "healthy",
+            client.output_buffer.queued_bytes / max(self.server.metrics.ingest_rate(client.path), 1.0),
+        )
+
+    def check(self) -> None:
+        self.queued_bytes = self.server.metrics.queue_sizes().total
+        if self.budget and self.queued_bytes > self.budget:
+            self.enforce(self.queued_bytes - int(self.budget * self.TARGET_RATIO))
+        if self.budget:
+            self.schedule_check()
+
+    def enforce(self, excess_bytes: int) -> None:
+        trimmed = evicted = 0
+        for client in sorted(self.server.all_clients(), key=self.lag, reverse=True):
+            if excess_bytes <= 0:
+                break
+            if client.closed:
+                continue
+            if self.action == "trim" and client.trimmable:
+                freed_bytes = client.output_buffer.trim()
+                self.trimmed_bytes += freed_bytes
+                trimmed += 1
+            else:
+                freed_bytes = client.output_buffer.queued_bytes
+                self.evicted_bytes += freed_bytes
+                evicted += 1
+                client.close_reason = "memory_budget"
+                client.close()
+            excess_bytes -= freed_bytes
+        self.trimmed += trimmed
+        self.evicted += evicted
+        self.server.log_aggregator.event(
+            "Output memory budget exceeded",
+            "-",
+            logging.WARNING,
+            "Output memory budget exceeded, %d bytes queued, trimmed %d and evicted %d clients",
+            self.queued_bytes,
+            trimmed,
+            evicted,
+        )
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "queued_bytes": self.queued_bytes,
+            "trimmed": self.trimmed,
+            "trimmed_bytes": self.trimmed_bytes,
+            "evicted": self.evicted,
+            "evicted_bytes": self.evicted_bytes,
+        }
@@ -1,14 +1,16 @@
 import errno
 import collections
+import logging
 import signal
 import socket
-from typing import TYPE_CHECKING, Any, Callable, Iterable, NoReturn, Optional, Protocol, TypeVar, Union
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, NoReturn, Optional, Protocol, TypeVar, Union
 
 from cyhttp11 import HTTPParser
 
 from savate import looping
 from savate.looping import BaseIOEventHandler
 from savate import buffer_event
+from savate.logs import event_path
 
 if TYPE_CHECKING:
     from savate.server import TCPServer
@@ -90,6 +92,8 @@ class HTTPEventHandler(BaseIOEventHandler):
         self.status = response.status
         self.connect_time = server.loop.now()
         self.bytes_sent = 0
+        # Why we closed the connection, if we did
+        self.close_reason: Optional[str] = None
 
     def close(self) -> None:
         self.server.remove_inactivity_timeout(self)
@@ -103,7 +107,15 @@ class HTTPEventHandler(BaseIOEventHandler):
         try:
             bytes_sent = self.output_buffer.flush()
         except buffer_event.QueueSizeExceeded as exc:
-            self.server.logger.info("Client queue size exceeded for %s: %s", self, exc)
+            self.server.log_aggregator.event(
+                "Client queue size exceeded",
+                event_path(self),
+                logging.INFO,
+                "Client queue size exceeded for %s: %s",
+                self,
+                exc,
+            )
+            self.close_reason = "queue_exceeded"
             self.close()
             return None
 
@@ -122,13 +134,19 @@ class HTTPEventHandler(BaseIOEventHandler):
                 self.finish()
             except IOError as exc:
                 if exc.errno in (errno.EPIPE, errno.ECONNRESET):
-                    self.server.logger.error("Connection closed by %s", self)
+                    self.server.log_aggregator.event(
+                        "Connection closed by client", event_path(self), logging.ERROR, "Connection closed by %s", self
+                    )
+                    self.close_reason = "epipe"
                     self.close()
                 else:
                     raise
         elif eventmask & (looping.POLLERR | looping.POLLHUP):
             # Error / Hangup, client probably closed connection
-            self.server.logger.error("Connection closed by %s", self)
+            self.server.log_aggregator.event(
+                "Connection closed by client", event_path(self), logging.ERROR, "Connection closed by %s", self
+            )
+            self.close_reason = "hangup"
             self.close()
         else:
             self.server.logger.error("%s: unexpected eventmask %d (%s)", self, eventmask, event_mask_str(eventmask))
@@ -141,6 +159,53 @@ class HTTPEventHandler(BaseIOEventHandler):
         )
 
 
+class StreamingHTTPEventHandler(HTTPEventHandler):
+    """An HTTPEventHandler whose response body is pulled from an iterator
+    of bytes as the socket becomes writable, so that only a few chunks of
+    it are ever held in memory and generating it does not block the loop.
+
+    The response has no Content-Length, closing the connection marks
+    the end of the body.
+    """
+
+    # Pull chunks until at least that many bytes are queued
+    LOW_WATER_MARK = 64 * 2**10
+
+    def __init__(
+        self,
+        server: "TCPServer",
+        sock: socket.socket,
+        address: tuple[str, int],
+        request_parser: HTTPParser,
+        response: "HTTPResponse",
+        body_chunks: Iterator[bytes],
+    ) -> None:
+        response.headers[b"Content-Length"] = None
+        super().__init__(server, sock, address, request_parser, response)
+        self.body_chunks: Optional[Iterator[bytes]] = body_chunks
+
+    def close(self) -> None:
+        if self.body_chunks is not None and hasattr(self.body_chunks, "close"):
+            self.body_chunks.close()
+        self.body_chunks = None
+        super().close()
+
+    def flush(self) -> None:
+        while self.body_chunks is not None and self.output_buffer.queued_bytes < self.LOW_WATER_MARK:
+            try:
+                chunk = next(self.body_chunks)
+            except StopIteration:
+                self.body_chunks = None
+            else:
+                if chunk:
+                    self.output_buffer.add_buffer(chunk)
+        super().flush()
+
+    def finish(self) -> None:
+        if self.body_chunks is None:
+            super().finish()
+
+
 class HTTPResponse:
     def __init__(
         self, status: int, reason: bytes, headers: Optional[dict[bytes, Optional[bytes]]] = None, body: bytes = b""
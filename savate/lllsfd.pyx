@@ -6,6 +6,7 @@ Currently supports timerfd.
 
 import os
 import fcntl
+import math
 import struct
 
 from savate cimport lllsfd
@@ -22,6 +23,21 @@ TFD_NONBLOCK = lllsfd._TFD_NONBLOCK
 TFD_CLOEXEC = lllsfd._TFD_CLOEXEC
 TFD_TIMER_ABSTIME = lllsfd._TFD_TIMER_ABSTIME
 
+NANOSECONDS = 1000000000
+
+
+def _split_seconds(seconds):
+    '''
+    Splits seconds into whole seconds and nanoseconds, rounding up so
+    that a timer never expires before the requested time.
+    '''
+    whole = math.floor(seconds)
+    nanoseconds = math.ceil((seconds - whole) * NANOSECONDS)
+    if nanoseconds >= NANOSECONDS:
+        whole += 1
+        nanoseconds -= NANOSECONDS
+    return int(whole), int(nanoseconds)
+
 
 class TimerFD:
     '''
@@ -29,7 +45,7 @@ class TimerFD:
     timerfd_create(2) manual page for a proper description of the
     underlying API / concepts.
 
-    Subsecond precision is not supported as of now.
+    Times are in seconds, and may be fractional.
     '''
 
     EXPIRATIONS_UNPACKER = struct.Struct('=Q')
@@ -62,7 +78,10 @@ class TimerFD:
         if ret != 0:
             global errno
             raise IOError(errno, os.strerror(errno))
-        return curr_value.it_value.tv_sec, curr_value.it_interval.tv_sec
+        return (
+            curr_value.it_value.tv_sec + curr_value.it_value.tv_nsec / NANOSECONDS,
+            curr_value.it_interval.tv_sec + curr_value.it_interval.tv_nsec / NANOSECONDS,
+        )
 
     def settime(self, expiration, repeat = 0, flags = 0):
         '''
@@ -76,10 +95,12 @@ class TimerFD:
         '''
         cdef itimerspec new_value
 
-        new_value.it_value.tv_sec = expiration
-        new_value.it_value.tv_nsec = 0
-        new_value.it_interval.tv_sec = repeat
-        new_value.it_interval.tv_nsec = 0
+        value_sec, value_nsec = _split_seconds(expiration)
+        interval_sec, interval_nsec = _split_seconds(repeat)
+        new_value.it_value.tv_sec = value_sec
+        new_value.it_value.tv_nsec = value_nsec
+        new_value.it_interval.tv_sec = interval_sec
+        new_value.it_interval.tv_nsec = interval_nsec
 
         ret = lllsfd.timerfd_settime(self._fd, flags, &new_value, NULL)
         if ret != 0:
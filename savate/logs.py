@@ -0,0 +1,60 @@
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+class LogAggregator:
+    """Collapses per-connection log events into periodic summaries.
+
+    Events are counted by kind and mount point, and a summary line with
+    the counts is logged every `interval` seconds, at the level of the
+    events. Each event is still logged at debug level. An interval of 0
+    logs every event at its own level instead.
+    """
+
+    INTERVAL = 10
+
+    def __init__(self, server: "TCPServer", interval: float = INTERVAL) -> None:
+        self.server = server
+        self.interval = interval
+        # (kind, path) -> [level, count]
+        self.counts: dict[tuple[str, str], list[int]] = {}
+
+    def event(self, kind: str, path: str, level: int, msg: str, *args: Any) -> None:
+        logger = self.server.logger
+        if not self.interval:
+            logger.log(level, msg, *args)
+            return
+        logger.debug(msg, *args)
+        if not self.counts:
+            self.server.timeouts.reset_timeout(self, self.server.loop.now() + self.interval, self.flush)
+        key = (kind, path)
+        counts = self.counts.get(key)
+        if counts is None:
+            self.counts[key] = [level, 1]
+        else:
+            counts[0] = max(counts[0], level)
+            counts[1] += 1
+
+    def flush(self) -> None:
+        counts, self.counts = self.counts, {}
+        self.server.timeouts.remove_timeout(self)
+        for (kind, path), (level, count) in sorted(counts.items()):
+            self.server.logger.log(level, "%s: %d in the last %s seconds for %s", kind, count, self.interval, path)
+
+    def set_interval(self, interval: float) -> None:
+        if interval != self.interval:
+            self.flush()
+            self.interval = interval
+
+
+def event_path(handler: Any) -> str:
+    """The mount point a handler is related to, for aggregation."""
+    path = getattr(handler, "path", None)
+    if path is None:
+        request_parser = getattr(handler, "request_parser", None)
+        path = getattr(request_parser, "request_path", None)
+    if isinstance(path, bytes):
+        path = path.decode("latin-1")
+    return path or "-"
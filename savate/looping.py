@@ -1,10 +1,13 @@
 import time
 import errno
+import collections
 import select
 import logging
 import socket
 from abc import ABC, abstractmethod
-from typing import Literal, Optional
+from typing import Any, Literal, Optional
+
+from savate.metrics import Histogram
 
 
 try:
@@ -48,6 +51,9 @@ class IOLoop:
         self.injected_events: dict[int, int] = {}
         self.logger = logger or logging.getLogger("looping")
         self._now = time.time()
+        # Longest time spent handling the events of one poll() since it
+        # was last reset, i.e. how long events may have waited
+        self.max_busy_time = 0.0
 
     def register(self, io_event_handler: BaseIOEventHandler, eventmask: int) -> None:
         if io_event_handler.fileno() not in self.handlers:
@@ -83,23 +89,34 @@ class IOLoop:
     def now(self) -> float:
         return self._now
 
-    def once(self, timeout: float = 0) -> None:
+    def poll(self, timeout: float) -> list[tuple[int, int]]:
         while True:
             try:
                 if Poller == select.poll:  # type: ignore[comparison-overlap]
-                    events_list = self.poller.poll(timeout * 1000)
+                    return self.poller.poll(timeout * 1000)
                 else:
                     # We specify maxevents here, since the default -1
                     # means maxevents will be set to FD_SETSIZE - 1,
                     # i.e. 1023, when calling epoll_wait()
-                    events_list = self.poller.poll(timeout, len(self.handlers) or -1)
-                break
+                    return self.poller.poll(timeout, len(self.handlers) or -1)
             except IOError as exc:
                 if exc.errno == errno.EINTR:
                     continue
                 else:
                     raise
 
+    def dispatch(self, handler: BaseIOEventHandler, fd: int, eventmask: int) -> None:
+        try:
+            handler.handle_event(eventmask)
+        except Exception as exc:
+            # We're kinda hardcore
+            self.logger.exception("Exception when handling eventmask %s for fd %s:", eventmask, fd)
+            self.unregister(handler)
+            handler.close()
+
+    def once(self, timeout: float = 0) -> None:
+        events_list = self.poll(timeout)
+
         # Update our idea of the current time
         self._now = time.time()
 
@@ -114,10 +131,106 @@ class IOLoop:
                 except:
                     pass
                 continue
-            try:
-                handler.handle_event(eventmask)
-            except Exception as exc:
-                # We're kinda hardcore
-                self.logger.exception("Exception when handling eventmask %s for fd %s:", eventmask, fd)
-                self.unregister(handler)
-                handler.close()
+            self.dispatch(handler, fd, eventmask)
+
+        busy_time = time.time() - self._now
+        if busy_time > self.max_busy_time:
+            self.max_busy_time = busy_time
+
+
+class InstrumentedIOLoop(IOLoop):
+    """An IOLoop keeping track of where its time goes.
+
+    Each iteration is split between waiting in poll() and dispatching the
+    events it returned; the time spent dispatching is how late the loop
+    is to handle the next events. CPU and wall clock time are accounted
+    per handler class, and handlers taking more than slow_handler_budget
+    seconds are kept in a bounded log.
+    """
+
+    SLOW_HANDLER_BUDGET = 0.05
+    SLOW_LOG_SIZE = 100
+
+    def __init__(
+        self,
+        logger: Optional[logging.Logger] = None,
+        slow_handler_budget: float = SLOW_HANDLER_BUDGET,
+        slow_log_size: int = SLOW_LOG_SIZE,
+    ) -> None:
+        super().__init__(logger)
+        self.slow_handler_budget = slow_handler_budget
+        self.iterations = 0
+        self.events = 0
+        self.poll_time = 0.0
+        self.last_poll_time = 0.0
+        self.dispatch_time = 0.0
+        self.max_dispatch_time = 0.0
+        # In microseconds
+        self.dispatch_times = Histogram()
+        self.events_per_poll = Histogram()
+        # Handler class name -> [calls, CPU time, wall clock time]
+        self.handler_times: dict[str, list[Any]] = {}
+        # (time, handler class name, handler, eventmask, duration)
+        self.slow_handlers: collections.deque[tuple[float, str, str, int, float]] = collections.deque(
+            maxlen=slow_log_size
+        )
+
+    def set_slow_log_size(self, slow_log_size: int) -> None:
+        if slow_log_size != self.slow_handlers.maxlen:
+            self.slow_handlers = collections.deque(self.slow_handlers, maxlen=slow_log_size)
+
+    def dispatch(self, handler: BaseIOEventHandler, fd: int, eventmask: int) -> None:
+        start_cpu = time.thread_time()
+        start = time.perf_counter()
+        super().dispatch(handler, fd, eventmask)
+        duration = time.perf_counter() - start
+        cpu_time = time.thread_time() - start_cpu
+
+        class_name = type(handler).__name__
+        handler_times = self.handler_times.get(class_name)
+        if handler_times is None:
+            handler_times = self.handler_times[class_name] = [0, 0.0, 0.0]
+        handler_times[0] += 1
+        handler_times[1] += cpu_time
+        handler_times[2] += duration
+        if duration > self.slow_handler_budget:
+            self.slow_handlers.append((self._now, class_name, str(handler), eventmask, duration))
+
+    def poll(self, timeout: float) -> list[tuple[int, int]]:
+        start = time.perf_counter()
+        events_list = super().poll(timeout)
+        self.last_poll_time = time.perf_counter() - start
+        self.events += len(events_list)
+        self.events_per_poll.add(len(events_list))
+        return events_list
+
+    def once(self, timeout: float = 0) -> None:
+        start = time.perf_counter()
+        super().once(timeout)
+        dispatch_time = time.perf_counter() - start - self.last_poll_time
+        self.iterations += 1
+        self.poll_time += self.last_poll_time
+        self.dispatch_time += dispatch_time
+        self.max_dispatch_time = max(self.max_dispatch_time, dispatch_time)
+        self.dispatch_times.add(int(dispatch_time * 1000000))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "iterations": self.iterations,
+            "events": self.events,
+            "poll_time": self.poll_time,
+            "dispatch_time": self.dispatch_time,
+            "max_dispatch_time": self.max_dispatch_time,
+            "median_dispatch_time": self.dispatch_times.percentile(0.5) / 1000000,
+            "p99_dispatch_time": self.dispatch_times.percentile(0.99) / 1000000,
+            "events_per_poll": self.events_per_poll.as_dict(),
+            "handlers": dict(
+                (class_name, {"calls": calls, "cpu_time": cpu_time, "wall_time": wall_time})
+                for class_name, (calls, cpu_time, wall_time) in self.handler_times.items()
+            ),
+            "slow_handler_budget": self.slow_handler_budget,
+            "slow_handlers": [
+                {"time": when, "class": class_name, "handler": handler, "eventmask": eventmask, "duration": duration}
+                for when, class_name, handler, eventmask, duration in self.slow_handlers
+            ],
+        }
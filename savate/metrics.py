@@ -0,0 +1,247 @@
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from savate.clients import StreamClient
+    from savate.server import TCPServer
+    from savate.sources import StreamSource
+
+
+class Histogram:
+    """Counts values in power of two buckets.
+
+    Bucket n holds the values v such that 2 ** (n - 1) <= v < 2 ** n,
+    bucket 0 holds zeros. Values can be moved from one bucket to another
+    as they change, which is cheap enough to be done on every update.
+    """
+
+    BUCKETS = 64
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+
+    def add(self, value: int) -> None:
+        self.counts[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+
+    def remove(self, value: int) -> None:
+        self.counts[value.bit_length()] -= 1
+        self.count -= 1
+        self.total -= value
+
+    def move(self, old_value: int, new_value: int) -> None:
+        self.total += new_value - old_value
+        old_bucket = old_value.bit_length()
+        new_bucket = new_value.bit_length()
+        if old_bucket != new_bucket:
+            self.counts[old_bucket] -= 1
+            self.counts[new_bucket] += 1
+
+    @staticmethod
+    def upper_bound(bucket: int) -> int:
+        """The largest value bucket can hold."""
+        return (1 << bucket) - 1
+
+    def percentile(self, fraction: float) -> int:
+        """Return an upper bound of the given fraction (0 to 1) percentile
+        of the values, or -1 if there are none."""
+        if not self.count:
+            return -1
+        rank = max(1, fraction * self.count)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.upper_bound(bucket)
+        return self.upper_bound(self.BUCKETS - 1)
+
+    def average(self) -> float:
+        if not self.count:
+            return -1
+        return self.total / self.count
+
+    def as_dict(self) -> dict[int, int]:
+        """Return non-empty buckets, as {upper bound: count}."""
+        return dict((self.upper_bound(bucket), count) for bucket, count in enumerate(self.counts) if count)
+
+
+class ExactHistogram(Histogram):
+    """A Histogram also counting the exact values held by each bucket,
+    so that a value of a given rank can be found exactly by only sorting
+    the values of the bucket it falls in."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Bucket -> {value: count}
+        self.values: list[dict[int, int]] = [{} for _ in range(self.BUCKETS)]
+
+    def add_value(self, value: int) -> None:
+        values = self.values[value.bit_length()]
+        values[value] = values.get(value, 0) + 1
+
+    def remove_value(self, value: int) -> None:
+        values = self.values[value.bit_length()]
+        count = values[value] - 1
+        if count:
+            values[value] = count
+        else:
+            del values[value]
+
+    def add(self, value: int) -> None:
+        super().add(value)
+        self.add_value(value)
+
+    def remove(self, value: int) -> None:
+        super().remove(value)
+        self.remove_value(value)
+
+    def move(self, old_value: int, new_value: int) -> None:
+        # Called on every output queue change, hence inlined
+        if old_value == new_value:
+            return
+        self.total += new_value - old_value
+        old_bucket = old_value.bit_length()
+        new_bucket = new_value.bit_length()
+        if old_bucket != new_bucket:
+            self.counts[old_bucket] -= 1
+            self.counts[new_bucket] += 1
+        values = self.values[old_bucket]
+        count = values[old_value] - 1
+        if count:
+            values[old_value] = count
+        else:
+            del values[old_value]
+        values = self.values[new_bucket]
+        values[new_value] = values.get(new_value, 0) + 1
+
+
+def nth_value(histograms: list[ExactHistogram], rank: int) -> int:
+    """Return the rank-th smallest (from 1) of the values held by
+    histograms, or -1 if there are not that many."""
+    seen = 0
+    for bucket in range(Histogram.BUCKETS):
+        bucket_count = sum(histogram.counts[bucket] for histogram in histograms)
+        if seen + bucket_count < rank:
+            seen += bucket_count
+            continue
+        values: dict[int, int] = {}
+        for histogram in histograms:
+            for value, count in histogram.values[bucket].items():
+                values[value] = values.get(value, 0) + count
+        for value in sorted(values):
+            seen += values[value]
+            if seen >= rank:
+                return value
+    return -1
+
+
+class MountMetrics:
+    def __init__(self) -> None:
+        self.clients = 0
+        self.peak_clients = 0
+        # Number of clients that ever connected, and left
+        self.total_clients = 0
+        self.left_clients = 0
+        # Bytes received by sources that are gone, see
+        # ServerMetrics.bytes_in()
+        self.closed_sources_bytes_in = 0
+        self.bytes_out = 0
+        # Clients closed by us, by reason
+        self.drops: dict[str, int] = {}
+        self.relay_restarts = 0
+        # Streaming clients output queue sizes, in bytes
+        self.queue_sizes = ExactHistogram()
+        # Streaming clients session lengths, in seconds
+        self.session_lengths = Histogram()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "clients": self.clients,
+            "peak_clients": self.peak_clients,
+            "total_clients": self.total_clients,
+        }
+
+
+class ServerMetrics:
+    """Aggregates maintained as clients come and go, so that status
+    handlers don't need to walk every client."""
+
+    # Interval, in seconds, between updates of the mounts incoming bitrates
+    RATE_INTERVAL = 1
+    # Weight of the last measure in the mounts bitrate averages
+    SMOOTHING = 0.5
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.mounts: dict[str, MountMetrics] = {}
+        # Mount point -> (bytes received, incoming bytes per second)
+        self.rates: dict[str, tuple[int, float]] = {}
+
+    def mount(self, path: str) -> MountMetrics:
+        mount_metrics = self.mounts.get(path)
+        if mount_metrics is None:
+            mount_metrics = self.mounts[path] = MountMetrics()
+        return mount_metrics
+
+    def queue_sizes(self) -> Histogram:
+        """Return the output queue sizes of all streaming clients."""
+        histogram = Histogram()
+        for mount_metrics in self.mounts.values():
+            for bucket, count in enumerate(mount_metrics.queue_sizes.counts):
+                histogram.counts[bucket] += count
+            histogram.count += mount_metrics.queue_sizes.count
+            histogram.total += mount_metrics.queue_sizes.total
+        return histogram
+
+    def queue_size_range(self) -> tuple[int, int, int]:
+        """Return the exact smallest, median and largest output queue
+        sizes of all streaming clients, -1 if there are none."""
+        histograms = [mount_metrics.queue_sizes for mount_metrics in self.mounts.values()]
+        count = sum(histogram.count for histogram in histograms)
+        if not count:
+            return -1, -1, -1
+        return nth_value(histograms, 1), nth_value(histograms, count // 2 + 1), nth_value(histograms, count)
+
+    def bytes_in(self, path: str) -> int:
+        return self.mount(path).closed_sources_bytes_in + sum(
+            source.bytes_received for source in self.server.sources.get(path, {})
+        )
+
+    def update_rates(self) -> None:
+        rates = {}
+        for path in self.server.sources:
+            bytes_in = self.bytes_in(path)
+            previous_bytes_in, rate = self.rates.get(path, (bytes_in, 0.0))
+            rate = self.SMOOTHING * (bytes_in - previous_bytes_in) / self.RATE_INTERVAL + (1 - self.SMOOTHING) * rate
+            rates[path] = (bytes_in, rate)
+        self.rates = rates
+        self.server.timeouts.reset_timeout(self, self.server.loop.now() + self.RATE_INTERVAL, self.update_rates)
+
+    def ingest_rate(self, path: str) -> float:
+        """The incoming bitrate of path, in bytes per second, 0 if
+        unknown yet."""
+        return self.rates.get(path, (0, 0.0))[1]
+
+    def source_removed(self, source: "StreamSource") -> None:
+        self.mount(source.path).closed_sources_bytes_in += source.bytes_received
+
+    def client_added(self, client: "StreamClient") -> None:
+        mount_metrics = client.mount_metrics
+        mount_metrics.clients += 1
+        mount_metrics.total_clients += 1
+        mount_metrics.peak_clients = max(mount_metrics.peak_clients, mount_metrics.clients)
+        mount_metrics.queue_sizes.add(client.output_buffer.queued_bytes)
+        client.output_buffer.histogram = mount_metrics.queue_sizes
+
+    def client_removed(self, client: "StreamClient") -> None:
+        mount_metrics = client.mount_metrics
+        mount_metrics.clients -= 1
+        mount_metrics.left_clients += 1
+        if client.close_reason is not None:
+            mount_metrics.drops[client.close_reason] = mount_metrics.drops.get(client.close_reason, 0) + 1
+        mount_metrics.session_lengths.add(int(self.server.loop.now() - client.connect_time))
+        if client.output_buffer.histogram is mount_metrics.queue_sizes:
+            mount_metrics.queue_sizes.remove(client.output_buffer.queued_bytes)
+            client.output_buffer.histogram = None
@@ -0,0 +1,176 @@
+import collections
+from typing import Hashable, Optional
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+
+ADAPTATION_FIELD_PRESENT = 0x20
+RANDOM_ACCESS_INDICATOR = 0x40
+
+
+def find_random_access_point(data: bytes) -> Optional[int]:
+    """Return the offset of the first packet of data whose adaptation field
+    has its random_access_indicator set, or None if there is none.
+
+    data is expected to start on a packet boundary.
+    """
+    for offset in range(0, len(data) - 5, PACKET_SIZE):
+        if data[offset] != SYNC_BYTE:
+            continue
+        if (
+            data[offset + 3] & ADAPTATION_FIELD_PRESENT
+            and data[offset + 4]
+            and data[offset + 5] & RANDOM_ACCESS_INDICATOR
+        ):
+            return offset
+    return None
+
+
+NULL_PID = 0x1FFF
+PAYLOAD_PRESENT = 0x10
+
+
+class _PIDState:
+    def __init__(self) -> None:
+        # Sequence number of the next packet to output
+        self.next_seq: Optional[int] = None
+        # Out of order packets and their arrival time, waiting for a
+        # missing one
+        self.held: dict[int, tuple[bytes, float]] = {}
+        self.last_output = 0.0
+        # Packet contents hash -> sequence number, used to align feeds
+        self.history: collections.OrderedDict[int, int] = collections.OrderedDict()
+        # Hashes of the last packets without payload
+        self.recent: collections.deque[int] = collections.deque(maxlen=64)
+
+
+class TSMerger:
+    """Merges several redundant copies (feeds) of the same MPEG-TS stream
+    into one, SMPTE 2022-7 style.
+
+    Each feed is expected to deliver its packets in order. For each PID,
+    continuity counters are unwrapped into per-feed sequence numbers,
+    which are aligned between feeds by matching packet contents. Each
+    packet is then output once, in sequence order: when one is missing,
+    the following ones are held for up to MAX_HOLD_TIME seconds so that
+    another feed can fill the gap. Null packets are dropped.
+    """
+
+    MAX_HOLD_TIME = 0.1
+    MAX_HELD_PACKETS = 1024
+    HISTORY_SIZE = 1024
+    # Re-align feeds on a PID that did not output anything for this
+    # many seconds
+    RESYNC_DELAY = 0.5
+
+    def __init__(self) -> None:
+        self.remainders: dict[Hashable, bytes] = {}
+        self.pids: dict[int, _PIDState] = {}
+        # feed id -> {PID: (last continuity counter, last sequence number)}
+        self.feeds: dict[Hashable, dict[int, tuple[int, int]]] = {}
+        self.duplicate_packets = 0
+        self.lost_packets = 0
+
+    def remove_feed(self, feed_id: Hashable) -> None:
+        self.remainders.pop(feed_id, None)
+        self.feeds.pop(feed_id, None)
+
+    def feed(self, feed_id: Hashable, data: bytes, now: float) -> bytes:
+        """Add data received from feed_id, and return the merged data that
+        is ready to be published."""
+        data = self.remainders.pop(feed_id, b"") + data
+        end = len(data) - (len(data) % PACKET_SIZE)
+        if end < len(data):
+            self.remainders[feed_id] = data[end:]
+        feed_state = self.feeds.setdefault(feed_id, {})
+        output: list[bytes] = []
+        for offset in range(0, end, PACKET_SIZE):
+            packet = data[offset : offset + PACKET_SIZE]
+            if packet[0] == SYNC_BYTE:
+                self.merge_packet(feed_state, packet, now, output)
+        for pid_state in self.pids.values():
+            if pid_state.held:
+                self.release_expired(pid_state, now, output)
+        return b"".join(output)
+
+    def merge_packet(
+        self, feed_state: dict[int, tuple[int, int]], packet: bytes, now: float, output: list[bytes]
+    ) -> None:
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid == NULL_PID:
+            return
+        pid_state = self.pids.get(pid)
+        if pid_state is None:
+            pid_state = self.pids[pid] = _PIDState()
+        packet_hash = hash(packet)
+
+        if not packet[3] & PAYLOAD_PRESENT:
+            # Continuity counters are only incremented along with
+            # payloads, use the packet contents instead
+            if packet_hash not in pid_state.recent:
+                pid_state.recent.append(packet_hash)
+                output.append(packet)
+            else:
+                self.duplicate_packets += 1
+            return
+
+        cc = packet[3] & 0x0F
+        stalled = (now - pid_state.last_output) > self.RESYNC_DELAY
+        seq: Optional[int]
+        if pid_state.next_seq is None:
+            # First packet ever seen on this PID
+            seq = pid_state.next_seq = 0
+        elif pid in feed_state:
+            last_cc, last_seq = feed_state[pid]
+            seq = last_seq + ((cc - last_cc) & 0x0F)
+        else:
+            seq = pid_state.history.get(packet_hash)
+            if seq is None:
+                if not stalled:
+                    # Cannot align this feed yet
+                    return
+                seq = pid_state.next_seq
+        if stalled and seq < pid_state.next_seq:
+            # This feed is lagging behind or has been restarted, and
+            # nothing better is available: follow it
+            seq = pid_state.next_seq
+        feed_state[pid] = (cc, seq)
+
+        if seq < pid_state.next_seq:
+            self.duplicate_packets += 1
+            return
+
+        pid_state.history[packet_hash] = seq
+        if len(pid_state.history) > self.HISTORY_SIZE:
+            pid_state.history.popitem(last=False)
+
+        if seq == pid_state.next_seq:
+            output.append(packet)
+            pid_state.next_seq += 1
+            pid_state.last_output = now
+            self.release_held(pid_state, output)
+        elif seq not in pid_state.held:
+            pid_state.held[seq] = (packet, now)
+            if len(pid_state.held) > self.MAX_HELD_PACKETS:
+                self.skip_gap(pid_state, now, output)
+        else:
+            self.duplicate_packets += 1
+
+    def release_held(self, pid_state: _PIDState, output: list[bytes]) -> None:
+        while pid_state.next_seq in pid_state.held:
+            output.append(pid_state.held.pop(pid_state.next_seq)[0])
+            pid_state.next_seq += 1
+
+    def release_expired(self, pid_state: _PIDState, now: float, output: list[bytes]) -> None:
+        while pid_state.held:
+            if (now - pid_state.held[min(pid_state.held)][1]) <= self.MAX_HOLD_TIME:
+                break
+            # No feed had the missing packets
+            self.skip_gap(pid_state, now, output)
+
+    def skip_gap(self, pid_state: _PIDState, now: float, output: list[bytes]) -> None:
+        next_seq = min(pid_state.held)
+        self.lost_packets += next_seq - (pid_state.next_seq or 0)
+        pid_state.next_seq = next_seq
+        pid_state.last_output = now
+        self.release_held(pid_state, output)
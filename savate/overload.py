@@ -0,0 +1,123 @@
+import socket
+from typing import TYPE_CHECKING, Any, Optional
+
+from savate import looping
+from savate.helpers import HTTPResponse
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+class OverloadGuard:
+    """Stops taking new connections while the server is overloaded.
+
+    Every CHECK_INTERVAL seconds, the loop lag (the longest time the
+    loop spent handling the events of one poll() since the previous
+    check) and the bytes queued for streaming clients are compared
+    with `max_loop_lag` and `max_buffered_bytes`. Past either of them,
+    the listening socket is either no longer polled (`pause`), leaving
+    new connections in the kernel backlog, or new connections are sent
+    a prebuilt 503 response and closed (`reject`). New connections are
+    taken again once both are below RESUME_RATIO of their threshold.
+    """
+
+    CHECK_INTERVAL = 0.25
+    RESUME_RATIO = 0.5
+    # Weight of the last measure in the loop lag average
+    SMOOTHING = 0.5
+
+    REJECTION = HTTPResponse(
+        503,
+        b"Service Unavailable",
+        {b"Content-Type": b"text/plain", b"Retry-After": b"5", b"Connection": b"close"},
+        b"Server overloaded\n",
+    ).as_bytes()
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.enabled = False
+        self.max_loop_lag: Optional[float] = None
+        self.max_buffered_bytes: Optional[int] = None
+        self.action = "pause"
+        self.overloaded = False
+        self.loop_lag = 0.0
+        self.buffered_bytes = 0
+        self.overloads = 0
+        self.rejected = 0
+
+    def configure(self, max_loop_lag: Optional[float], max_buffered_bytes: Optional[int], action: str) -> None:
+        if action not in ("pause", "reject"):
+            raise ValueError("Unknown overload action %r" % action)
+        if self.overloaded:
+            self.resume()
+        self.max_loop_lag = max_loop_lag
+        self.max_buffered_bytes = max_buffered_bytes
+        self.action = action
+        was_enabled = self.enabled
+        self.enabled = bool(max_loop_lag or max_buffered_bytes)
+        if self.enabled and not was_enabled:
+            self.schedule_check()
+        elif was_enabled and not self.enabled:
+            self.server.timeouts.remove_timeout(self)
+
+    def schedule_check(self) -> None:
+        self.server.timeouts.reset_timeout(self, self.server.loop.now() + self.CHECK_INTERVAL, self.check)
+
+    def check(self) -> None:
+        lag = self.server.loop.max_busy_time
+        self.server.loop.max_busy_time = 0.0
+        self.loop_lag = self.SMOOTHING * lag + (1 - self.SMOOTHING) * self.loop_lag
+        self.buffered_bytes = self.server.metrics.queue_sizes().total
+
+        ratio = self.RESUME_RATIO if self.overloaded else 1
+        overloaded = bool(
+            (self.max_loop_lag and self.loop_lag > self.max_loop_lag * ratio)
+            or (self.max_buffered_bytes and self.buffered_bytes > self.max_buffered_bytes * ratio)
+        )
+        if overloaded and not self.overloaded:
+            self.pause()
+        elif self.overloaded and not overloaded:
+            self.resume()
+        self.schedule_check()
+
+    def accepting(self) -> bool:
+        return self.server.state == self.server.STATE_RUNNING and hasattr(self.server, "sock")
+
+    def pause(self) -> None:
+        self.server.logger.warning(
+            "Overloaded (loop lag %.3fs, %d bytes buffered), %s new connections",
+            self.loop_lag,
+            self.buffered_bytes,
+            "pausing" if self.action == "pause" else "rejecting",
+        )
+        self.overloaded = True
+        self.overloads += 1
+        if self.action == "pause" and self.accepting():
+            self.server.loop.register(self.server, 0)
+
+    def resume(self) -> None:
+        self.server.logger.warning(
+            "No longer overloaded (loop lag %.3fs, %d bytes buffered), accepting new connections",
+            self.loop_lag,
+            self.buffered_bytes,
+        )
+        self.overloaded = False
+        if self.action == "pause" and self.accepting():
+            self.server.loop.register(self.server, looping.POLLIN)
+
+    def reject(self, client_socket: socket.socket) -> None:
+        self.rejected += 1
+        try:
+            client_socket.send(self.REJECTION, socket.MSG_DONTWAIT)
+        except IOError:
+            pass
+        client_socket.close()
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "overloaded": self.overloaded,
+            "loop_lag": self.loop_lag,
+            "buffered_bytes": self.buffered_bytes,
+            "overloads": self.overloads,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,109 @@
+import collections
+import concurrent.futures
+import os
+import signal
+import tempfile
+import time
+import types
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+def write_folded(filename: str, samples: dict[str, int]) -> str:
+    with open(filename, "w") as profile_file:
+        for stack, count in sorted(samples.items()):
+            profile_file.write("%s %d\n" % (stack, count))
+    return filename
+
+
+class SamplingProfiler:
+    """Statistical profiler of the main thread.
+
+    While running, SIGPROF is delivered every `interval` seconds of CPU
+    time, and the interrupted Python stack is counted. When done, the
+    samples are written in the folded stacks format ("frame;frame;frame
+    count" lines, as read by flamegraph.pl or speedscope) in a file of
+    `directory`. Nothing is done while it is not running.
+    """
+
+    DURATION = 30
+    INTERVAL = 0.005
+
+    def __init__(
+        self,
+        server: "TCPServer",
+        directory: Optional[str] = None,
+        duration: float = DURATION,
+        interval: float = INTERVAL,
+    ) -> None:
+        self.server = server
+        self.directory = directory or tempfile.gettempdir()
+        self.duration = duration
+        self.interval = interval
+        self.samples: collections.Counter[str] = collections.Counter()
+        self.filename: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self.filename is not None
+
+    def start(self, duration: Optional[float] = None) -> Optional[str]:
+        """Start profiling for duration seconds, and return the name of
+        the file the profile will be written to, or None if a profile is
+        already running."""
+        if self.running:
+            self.server.logger.warning("A profile is already running, to %s", self.filename)
+            return None
+        duration = duration or self.duration
+        self.filename = os.path.join(
+            self.directory, "savate-%d-%s.folded" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S"))
+        )
+        self.samples.clear()
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.server.timeouts.reset_timeout((self, "stop"), self.server.loop.now() + duration, self.stop)
+        self.server.logger.info("Profiling for %s seconds, to %s", duration, self.filename)
+        return self.filename
+
+    def sample(self, signum: int, frame: Optional[types.FrameType]) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, synchronous: bool = False) -> None:
+        """Stop profiling and write the profile, from a worker thread
+        unless synchronous, e.g. when the server shuts down and its
+        executor will not run it."""
+        filename = self.filename
+        if filename is None:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.server.timeouts.remove_timeout((self, "stop"))
+        self.filename = None
+        samples = dict(self.samples)
+        self.samples.clear()
+        self.server.logger.info("Profile done, %d samples", sum(samples.values()))
+        if synchronous:
+            try:
+                write_folded(filename, samples)
+            except IOError:
+                self.server.logger.exception("Cannot write profile:")
+            else:
+                self.server.logger.info("Profile written to %s", filename)
+        else:
+            # Writing it is left to a worker thread
+            self.server.executor.submit(write_folded, filename, samples, callback=self.profile_written)
+
+    def profile_written(self, future: "concurrent.futures.Future[str]") -> None:
+        try:
+            filename = future.result()
+        except IOError:
+            self.server.logger.exception("Cannot write profile:")
+        else:
+            self.server.logger.info("Profile written to %s", filename)
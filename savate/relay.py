@@ -1,8 +1,10 @@
+import collections
 import errno
+import random
 import urllib.parse
 import socket
 import struct
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
 import cyhttp11
 
@@ -12,11 +14,102 @@ from savate import helpers
 from savate.helpers import AddrInfo, HTTPError, HTTPParseError
 from savate.sources import MPEGTSSource
 from savate import buffer_event
+from savate.sockopts import apply_socket_options
 
 if TYPE_CHECKING:
     from savate.server import TCPServer
 
 
+RelayKey = tuple[str, str, Optional[AddrInfo]]
+
+
+class RelayScheduler:
+    """Schedules relay starts and restarts.
+
+    Failed relays are restarted after an exponential backoff delay,
+    randomised so that edges do not all reconnect to a restarted origin
+    at the same time; the delay goes back to its minimum once a relay has
+    been running for max_delay seconds. At most connect_limit relays may
+    be connecting at once, the other ones wait for a free slot.
+    """
+
+    RESTART_DELAY = 1
+    MAX_RESTART_DELAY = 60
+    CONNECT_LIMIT = 32
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.restart_delay: float = self.RESTART_DELAY
+        self.max_delay: float = self.MAX_RESTART_DELAY
+        self.connect_limit: Optional[int] = self.CONNECT_LIMIT
+        self.failures: dict[RelayKey, int] = {}
+        self.connected_at: dict[RelayKey, float] = {}
+        self.connecting: set[RelayKey] = set()
+        # Relays waiting for their restart delay to expire
+        self.restarting: dict[RelayKey, Callable[[], None]] = {}
+        # Relays waiting for a connection slot
+        self.waiting: collections.OrderedDict[RelayKey, Callable[[], None]] = collections.OrderedDict()
+
+    def pending_keys(self) -> set[RelayKey]:
+        return set(self.restarting) | set(self.waiting)
+
+    def start(self, key: RelayKey, start: Callable[[], None]) -> None:
+        """Call start() to start the relay identified by key as soon as a
+        connection slot is available."""
+        self.restarting.pop(key, None)
+        if self.connect_limit is not None and len(self.connecting) >= self.connect_limit:
+            self.waiting[key] = start
+            return
+        self.waiting.pop(key, None)
+        self.connecting.add(key)
+        try:
+            start()
+        except Exception:
+            self.server.logger.exception("Cannot start relay %s for %s:", key[0], key[1])
+            self.restart(key, start)
+
+    def start_waiting(self) -> None:
+        while self.waiting and (self.connect_limit is None or len(self.connecting) < self.connect_limit):
+            key, start = self.waiting.popitem(last=False)
+            self.start(key, start)
+
+    def connected(self, key: RelayKey) -> None:
+        self.connected_at[key] = self.server.loop.now()
+        self.connecting.discard(key)
+        self.start_waiting()
+
+    def restart(self, key: RelayKey, start: Callable[[], None]) -> None:
+        """Schedule a restart of the relay identified by key, which just
+        failed or stopped."""
+        self.connecting.discard(key)
+        connected_at = self.connected_at.pop(key, None)
+        if connected_at is not None and (self.server.loop.now() - connected_at) >= self.max_delay:
+            # It's been running fine for a while, start afresh
+            self.failures.pop(key, None)
+        failures = self.failures.get(key, 0)
+        self.failures[key] = failures + 1
+        self.server.metrics.mount(key[1]).relay_restarts += 1
+        delay = min(self.max_delay, self.restart_delay * 2 ** min(failures, 32))
+        delay = random.uniform(delay / 2, delay)
+        self.server.logger.info("Restarting relay %s for %s in %.1f seconds", key[0], key[1], delay)
+        self.restarting[key] = start
+        self.server.timeouts.reset_timeout(
+            ("relay restart", key), self.server.loop.now() + delay, self.start, key, start
+        )
+        self.start_waiting()
+
+    def cancel(self, key: RelayKey) -> None:
+        """Forget about the relay identified by key, it has been removed
+        from the configuration."""
+        self.server.timeouts.remove_timeout(("relay restart", key))
+        self.restarting.pop(key, None)
+        self.waiting.pop(key, None)
+        self.failures.pop(key, None)
+        self.connected_at.pop(key, None)
+        self.connecting.discard(key)
+        self.start_waiting()
+
+
 class Relay(looping.BaseIOEventHandler):
     def __init__(
         self,
@@ -25,6 +118,7 @@ class Relay(looping.BaseIOEventHandler):
         path: str,
         addr_info: Optional[AddrInfo] = None,
         burst_size: Optional[int] = None,
+        weight: float = 1,
     ) -> None:
         self.server = server
         self.url = url
@@ -38,9 +132,27 @@ class Relay(looping.BaseIOEventHandler):
         self.path = path
         self.addr_info = addr_info
         self.burst_size = burst_size
+        self.weight = weight
         self.on_demand = False
+        self.merge_feeds = False
         self.keepalive: Optional[int] = None
 
+    @property
+    def key(self) -> RelayKey:
+        return (self.url, self.path, self.addr_info)
+
+    def restart(self) -> None:
+        self.server.start_relay(
+            self.url,
+            self.path,
+            self.addr_info,
+            self.burst_size,
+            self.on_demand,
+            self.keepalive,
+            self.weight,
+            self.merge_feeds,
+        )
+
     def close(self) -> None:
         self.server.remove_inactivity_timeout(self)
         self.server.loop.unregister(self)
@@ -74,8 +186,13 @@ class UDPRelay(Relay):
         path: str,
         addr_info: Optional[AddrInfo] = None,
         burst_size: Optional[int] = None,
+        weight: float = 1,
+        merge_feeds: bool = False,
     ) -> None:
-        super().__init__(server, url, path, addr_info, burst_size)
+        super().__init__(server, url, path, addr_info, burst_size, weight)
+        # Whether to merge this relay with the other redundant feeds of
+        # the same path
+        self.merge_feeds = merge_feeds
 
         # UDP, possibly multicast input
         self.udp_address = (self.host_address, self.host_port)
@@ -87,9 +204,12 @@ class UDPRelay(Relay):
             multicast_request = struct.pack("=4sl", socket.inet_aton(self.host_address), socket.INADDR_ANY)
             self.sock.setsockopt(socket.SOL_IP, socket.IP_ADD_MEMBERSHIP, multicast_request)
             # The socket is now multicast ready
+        apply_socket_options(self.sock, self.server.config.socket_options(self.path, "source"), self.server.logger)
         self.initial_buffer_data = b""
         self.server.loop.register(self, looping.POLLIN)
         self.server.update_activity(self)
+        # There is no connection to wait for
+        self.server.relay_scheduler.connected(self.key)
 
     def handle_event(self, eventmask: int) -> None:
         if eventmask & looping.POLLIN:
@@ -108,10 +228,15 @@ class UDPRelay(Relay):
                     fake_response_parser = cyhttp11.HTTPClientParser()
                     fake_response_parser.body = self.initial_buffer_data
                     # FIXME: we're assuming an MPEG-TS source
-                    fake_response_parser.headers["Content-Type"] = "video/MP2T"
-                    self.server.add_source(
-                        self.path, self.sock, self.udp_address, fake_response_parser, self.burst_size
-                    )
+                    fake_response_parser.headers[b"Content-Type"] = b"video/MP2T"
+                    if self.merge_feeds:
+                        self.server.add_feed(
+                            self.path, self.sock, self.udp_address, fake_response_parser, self.burst_size
+                        )
+                    else:
+                        self.server.add_source(
+                            self.path, self.sock, self.udp_address, fake_response_parser, self.burst_size
+                        )
                     break
 
 
@@ -130,11 +255,13 @@ class HTTPRelay(Relay):
         burst_size: Optional[int] = None,
         on_demand: bool = False,
         keepalive: Optional[int] = None,
+        weight: float = 1,
     ) -> None:
-        super().__init__(server, url, path, addr_info, burst_size)
+        super().__init__(server, url, path, addr_info, burst_size, weight)
 
         self.on_demand = on_demand
         self.od_source: Optional[sources.StreamSource] = None
+        self.source: Optional[sources.StreamSource] = None
 
         # when a source disconnects, its clients can be kept while we try to
         # reconnect to it, this "keepalive" must be an integer in seconds or
@@ -146,7 +273,13 @@ class HTTPRelay(Relay):
 
     def connect(self) -> None:
         self.create_socket()
-        self.register()
+        if self.addr_info:
+            self.connect_to(self.addr_info[4][:2])
+        else:
+            # Don't block the loop on name resolution, also make sure
+            # we time out if it takes too long
+            self.server.update_activity(self)
+            self.server.resolver.resolve(self.host_address, self.host_port, self.handle_resolved, self.sock.family)
 
     def create_socket(self) -> None:
         addr_info = self.addr_info
@@ -159,9 +292,29 @@ class HTTPRelay(Relay):
             self.sock = socket.socket()
 
         self.sock.setblocking(False)
-        error = self.sock.connect_ex((self.host_address, self.host_port))
+        # Before connecting, for the receive buffer to count in the
+        # window scale negotiation
+        apply_socket_options(self.sock, self.server.config.socket_options(self.path, "source"), self.server.logger)
+
+    def handle_resolved(self, addr_infos: list[AddrInfo]) -> None:
+        if not hasattr(self, "sock"):
+            # We've been closed in the meantime
+            return
+        if not addr_infos:
+            self.server.logger.error("Cannot relay %s, %s does not resolve", self.url, self.host_address)
+            self.close()
+            return
+        try:
+            self.connect_to(addr_infos[0][4][:2])
+        except socket.error as exc:
+            self.server.logger.error("Cannot relay %s: %s", self.url, exc)
+            self.close()
+
+    def connect_to(self, address: tuple[str, int]) -> None:
+        error = self.sock.connect_ex(address)
         if error and error != errno.EINPROGRESS:
             raise socket.error(error, errno.errorcode[error])
+        self.register()
 
     def register(self) -> None:
         # self.handle_event = self.handle_connect
@@ -250,6 +403,8 @@ class HTTPRelay(Relay):
             self.close()
             return
 
+        self.server.relay_scheduler.connected(self.key)
+
         if self.on_demand and self.od_source:
             # give back the control to the source
             self.od_source.on_demand_connected(self.sock, self.response_parser)
@@ -267,9 +422,214 @@ class HTTPRelay(Relay):
         )
         if self.on_demand:
             self.od_source = source
+        self.source = source
         self.server.register_source(source)
 
     def close(self) -> None:
         super().close()
         if self.od_source is not None:
             self.od_source.close()
+
+
+class HedgedRelayGroup:
+    """Relays an URL from the best of its resolved addresses.
+
+    Connections to the addresses are raced happy eyeballs style: attempts
+    are started CONNECT_DELAY seconds apart, or as soon as the previous
+    one fails, and the first one getting a valid response is kept while
+    the other ones are cancelled. The remaining addresses are fallbacks,
+    only connected to when the kept relay fails.
+
+    Addresses are tried by rank: the ones with the best observed
+    throughput and connect time come first, then the ones that were never
+    tried, then the ones that failed.
+    """
+
+    CONNECT_DELAY = 0.25
+    # Weight of new measures in connect time and throughput averages
+    SMOOTHING = 0.5
+    # Addresses with less than that fraction of the best throughput are
+    # ranked after the other ones
+    SLOW_RATIO = 0.5
+
+    def __init__(
+        self,
+        server: "TCPServer",
+        url: str,
+        path: str,
+        burst_size: Optional[int] = None,
+        on_demand: bool = False,
+        keepalive: Optional[int] = None,
+        weight: float = 1,
+    ) -> None:
+        self.server = server
+        self.url = url
+        self.path = path
+        self.burst_size = burst_size
+        self.on_demand = on_demand
+        self.keepalive = keepalive
+        self.weight = weight
+        self.addr_infos: list[AddrInfo] = []
+        self.connect_times: dict[AddrInfo, float] = {}
+        self.throughputs: dict[AddrInfo, float] = {}
+        self.failed: set[AddrInfo] = set()
+        # Addresses left to try, best first
+        self.queue: list[AddrInfo] = []
+        self.attempts: dict[AddrInfo, "HedgedHTTPRelay"] = {}
+        self.winner: Optional["HedgedHTTPRelay"] = None
+        self.started_at = 0.0
+        self.won_at = 0.0
+
+    def __str__(self) -> str:
+        return "<%s relaying %s for %s>" % (self.__class__.__name__, self.url, self.path)
+
+    @property
+    def key(self) -> RelayKey:
+        return (self.url, self.path, None)
+
+    def update_addresses(self, addr_infos: list[AddrInfo]) -> None:
+        started = bool(self.addr_infos)
+        self.addr_infos = addr_infos
+        for stats in (self.connect_times, self.throughputs):
+            for addr_info in list(stats):
+                if addr_info not in addr_infos:
+                    del stats[addr_info]
+        self.failed.intersection_update(addr_infos)
+        self.queue = [addr_info for addr_info in self.queue if addr_info in addr_infos]
+
+        if self.winner is not None and self.winner.addr_info not in addr_infos:
+            self.server.logger.info("%s: dropping %s, address is gone", self, self.winner.addr_info)
+            self.server.drop_relay(self.winner)
+            self.winner = None
+            started = False
+        if not started:
+            self.server.relay_scheduler.start(self.key, self.connect)
+
+    def ranked_addr_infos(self) -> list[AddrInfo]:
+        best_throughput = max(self.throughputs.values(), default=0)
+
+        def rank(addr_info: AddrInfo) -> tuple[bool, bool, bool, float]:
+            return (
+                addr_info in self.failed,
+                addr_info not in self.connect_times,
+                self.throughputs.get(addr_info, best_throughput) < best_throughput * self.SLOW_RATIO,
+                self.connect_times.get(addr_info, 0.0),
+            )
+
+        # sorted() is stable, DNS order is kept for equal ranks
+        return sorted(self.addr_infos, key=rank)
+
+    def average(self, stats: dict[AddrInfo, float], addr_info: AddrInfo, value: float) -> None:
+        if addr_info in stats:
+            value = self.SMOOTHING * value + (1 - self.SMOOTHING) * stats[addr_info]
+        stats[addr_info] = value
+
+    def connect(self) -> None:
+        if self.winner is not None:
+            # The previous winner stopped, remember how well it did
+            source = self.winner.source
+            duration = self.server.loop.now() - self.won_at
+            if source is not None and duration > 0:
+                self.average(self.throughputs, self.winner.addr_info, source.bytes_received / duration)
+            self.winner = None
+        if not self.addr_infos:
+            raise Exception("No address to relay %s from" % self.url)
+        self.started_at = self.server.loop.now()
+        self.queue = self.ranked_addr_infos()
+        self.connect_next()
+
+    def connect_next(self) -> None:
+        self.server.timeouts.remove_timeout((self, "hedge"))
+        while self.winner is None and self.queue:
+            addr_info = self.queue.pop(0)
+            try:
+                self.attempts[addr_info] = HedgedHTTPRelay(self, addr_info)
+            except socket.error as exc:
+                self.server.logger.error("%s: cannot connect to %s: %s", self, addr_info[4], exc)
+                self.failed.add(addr_info)
+                continue
+            if self.queue:
+                self.server.timeouts.reset_timeout(
+                    (self, "hedge"), self.server.loop.now() + self.CONNECT_DELAY, self.connect_next
+                )
+            return
+        if self.winner is None and not self.attempts:
+            # Every address failed
+            self.server.relay_scheduler.restart(self.key, self.connect)
+
+    def won(self, winner: "HedgedHTTPRelay") -> None:
+        self.server.logger.info("%s: relaying from %s", self, winner.addr_info[4])
+        self.winner = winner
+        self.won_at = self.server.loop.now()
+        self.failed.discard(winner.addr_info)
+        self.average(self.connect_times, winner.addr_info, self.won_at - self.started_at)
+        self.server.timeouts.remove_timeout((self, "hedge"))
+        self.queue = []
+        self.attempts.pop(winner.addr_info, None)
+        for loser in list(self.attempts.values()):
+            loser.close()
+        self.attempts = {}
+        self.server.relays[winner.sock] = winner
+
+    def attempt_closed(self, attempt: "HedgedHTTPRelay") -> None:
+        if self.attempts.get(attempt.addr_info) is not attempt:
+            return
+        del self.attempts[attempt.addr_info]
+        if self.winner is None:
+            self.failed.add(attempt.addr_info)
+            self.connect_next()
+
+    def close(self) -> None:
+        self.server.timeouts.remove_timeout((self, "hedge"))
+        self.server.relay_scheduler.cancel(self.key)
+        self.queue = []
+        for attempt in list(self.attempts.values()):
+            attempt.close()
+        self.attempts = {}
+        if self.winner is not None and hasattr(self.winner, "sock") and self.server.relays.get(self.winner.sock):
+            self.server.drop_relay(self.winner)
+        self.winner = None
+
+
+class HedgedHTTPRelay(HTTPRelay):
+    """An HTTPRelay attempt of a HedgedRelayGroup.
+
+    It is only added to the server's relays if it wins the race, so that
+    losing and failing attempts do not get restarted on their own.
+    """
+
+    addr_info: AddrInfo
+
+    def __init__(self, group: HedgedRelayGroup, addr_info: AddrInfo) -> None:
+        self.group = group
+        super().__init__(
+            group.server,
+            group.url,
+            group.path,
+            addr_info,
+            group.burst_size,
+            group.on_demand,
+            group.keepalive,
+            group.weight,
+        )
+
+    @property
+    def key(self) -> RelayKey:
+        return self.group.key
+
+    def restart(self) -> None:
+        self.group.connect()
+
+    def transform_response(self) -> None:
+        if self.group.winner is None:
+            if self.response_parser.status_code in (200,):
+                self.group.won(self)
+        elif self.group.winner is not self:
+            # Too late
+            self.close()
+            return
+        super().transform_response()
+
+    def close(self) -> None:
+        super().close()
+        self.group.attempt_closed(self)
@@ -0,0 +1,77 @@
+import concurrent.futures
+import socket
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Optional
+
+from savate.helpers import AddrInfo
+
+if TYPE_CHECKING:
+    from savate.executor import LoopExecutor
+    from savate.server import TCPServer
+
+
+_ResolverKey = tuple[Optional[str], Optional[int], int]
+ResolverCallback = Callable[[list[AddrInfo]], None]
+
+
+class Resolver:
+    """Asynchronous getaddrinfo() with a TTL cache.
+
+    Lookups are run in the server's executor threads; callbacks are
+    called from the loop with the list of resolved addresses, which is
+    empty if resolution failed. Concurrent lookups for the same name are
+    coalesced.
+    """
+
+    # Cache entries lifetime, in seconds
+    DEFAULT_TTL = 300
+
+    def __init__(self, server: "TCPServer", executor: "LoopExecutor", ttl: float = DEFAULT_TTL) -> None:
+        self.server = server
+        self.executor = executor
+        self.ttl = ttl
+        # key -> (expiration, addresses)
+        self.cache: dict[_ResolverKey, tuple[float, list[AddrInfo]]] = {}
+        self.pending: dict[_ResolverKey, list[ResolverCallback]] = {}
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def resolve(
+        self, host: Optional[str], port: Optional[int], callback: ResolverCallback, family: int = socket.AF_UNSPEC
+    ) -> None:
+        """Resolve host and port to a list of TCP addresses, and call
+        callback with it. The callback is called immediately on cache
+        hits."""
+        key = (host, port, family)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > self.server.loop.now():
+            callback(cached[1])
+            return
+
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+
+        self.pending[key] = [callback]
+        self.executor.submit(
+            socket.getaddrinfo,
+            host,
+            port,
+            family,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            callback=partial(self.handle_result, key),
+        )
+
+    def handle_result(self, key: _ResolverKey, future: "concurrent.futures.Future[list[AddrInfo]]") -> None:
+        callbacks = self.pending.pop(key, [])
+        try:
+            addr_infos = future.result()
+        except (socket.error, concurrent.futures.CancelledError) as exc:
+            self.server.logger.error("Cannot resolve %s:%s: %s", key[0], key[1], exc)
+            addr_infos = []
+        else:
+            self.cache[key] = (self.server.loop.now() + self.ttl, addr_infos)
+        for callback in callbacks:
+            callback(addr_infos)
@@ -0,0 +1,57 @@
+from typing import TYPE_CHECKING, Optional
+
+from savate.sources import StreamSource
+
+if TYPE_CHECKING:
+    from savate.server import TCPServer
+
+
+class SourceSelector:
+    """Picks the source new clients of a given mount point are attached to.
+
+    Each source is given a weight (1 by default, or the `weight` of its
+    `source_urls` entry); the selected source is the healthy one with the
+    lowest clients / weight ratio. Sources are added and removed as they
+    come and go, so that no per-request list has to be built.
+
+    In hot standby mode, the selected source is the healthy one with the
+    highest weight (the first registered one for equal weights); the
+    other ones are only kept running as backups.
+    """
+
+    def __init__(self, server: "TCPServer", path: str, hot_standby: bool = False) -> None:
+        self.server = server
+        self.path = path
+        self.hot_standby = hot_standby
+        self.weights: dict[StreamSource, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def add_source(self, source: StreamSource, weight: float = 1) -> None:
+        self.weights[source] = weight
+
+    def remove_source(self, source: StreamSource) -> None:
+        self.weights.pop(source, None)
+
+    def load(self, source: StreamSource) -> float:
+        source_dict = self.server.sources[self.path][source]
+        return (len(source_dict["clients"]) + len(source_dict["pending_clients"])) / self.weights[source]
+
+    def select(self, exclude: Optional[StreamSource] = None) -> StreamSource:
+        best_source = None
+        best_key: tuple[bool, float] = (True, 0.0)
+        for source in self.weights:
+            if source is exclude:
+                continue
+            # Healthy sources always come first, unhealthy ones are
+            # only used when there is nothing better
+            if self.hot_standby:
+                key = (not source.is_healthy(), -self.weights[source])
+            else:
+                key = (not source.is_healthy(), self.load(source))
+            if best_source is None or key < best_key:
+                best_source, best_key = source, key
+        if best_source is None:
+            raise LookupError("No source available for %s" % self.path)
+        return best_source
@@ -2,14 +2,15 @@ import socket
 from datetime import datetime
 import logging
 import collections
-import random
 import re
 import itertools
 import errno
+import functools
 import urllib.parse
 import json
 import types
-from typing import Iterable, Optional, Type, TypedDict
+import concurrent.futures
+from typing import Any, Iterable, Optional, Type, TypedDict
 
 import cyhttp11
 
@@ -22,14 +23,29 @@ from savate import clients
 from savate import sources
 from savate import relay
 from savate import timeouts
+from savate import selection
+from savate import metrics
+from savate import executor
+from savate import resolver
+from savate import profiler
+from savate import logs
+from savate import admission
+from savate import overload
+from savate import governor
+from savate import capacity
+from savate import tcpinfo
+from savate.sockopts import apply_socket_options
 from savate import stats, status
-from savate.auth import AbstractAuthorization
+from savate.auth import AbstractAuthorization, AuthPending
 
 
 class HTTPRequest(looping.BaseIOEventHandler):
 
     REQUEST_MAX_SIZE = 4096
 
+    # Maximum time, in seconds, to wait for an asynchronous authorization
+    AUTH_TIMEOUT = 5
+
     def __init__(self, server: "TCPServer", sock: socket.socket, address: tuple[str, int]) -> None:
         self.server = server
         self.sock = sock
@@ -38,15 +54,22 @@ class HTTPRequest(looping.BaseIOEventHandler):
         self.request_size = 0
         self.request_buffer = b""
         self.request_parser = cyhttp11.HTTPParser()
+        self.auth_pending: Optional[AuthPending] = None
+        # The handler that authorized the request, if any
+        self.authorized_by: Optional[AbstractAuthorization] = None
 
     def close(self) -> None:
         self.server.remove_inactivity_timeout(self)
+        self.server.timeouts.remove_timeout((self, "auth"))
         self.server.loop.unregister(self)
         looping.BaseIOEventHandler.close(self)
 
     def handle_event(self, eventmask: int) -> None:
         if eventmask & looping.POLLIN:
             self.handle_read()
+        elif eventmask & (looping.POLLERR | looping.POLLHUP):
+            # Client went away, e.g. while waiting for authorization
+            self.close()
 
     def handle_read(self) -> None:
         while True:
@@ -69,7 +92,6 @@ class HTTPRequest(looping.BaseIOEventHandler):
                 raise HTTPParseError("Oversized HTTP request from %s, %s" % (self.sock, self.address))
 
     def transform_request(self) -> None:
-        loop = self.server.loop
         # FIXME: should we shutdown() read or write depending on what
         # we do here ? (i.e. SHUT_RD for GETs, SHUT_WD for sources)
 
@@ -88,25 +110,104 @@ class HTTPRequest(looping.BaseIOEventHandler):
 
         self.server.request_in(self.request_parser, self.sock)
 
-        # Authorization
-        for auth_handler in self.server.auth_handlers:
+        self.authorize(0)
+
+    def authorize(self, index: int) -> None:
+        """Run the authorization handlers from index on, then dispatch the
+        request if it was not denied."""
+        auth_handlers = self.server.auth_handlers
+        while index < len(auth_handlers):
+            auth_handler = auth_handlers[index]
             auth_result = auth_handler.authorize(self.address, self.request_parser)
-            if auth_result is None:
-                continue
-            elif not isinstance(auth_result, HTTPResponse):
-                # Wrong response from auth handler
-                raise RuntimeError("Wrong response from authorization handler %s" % auth_handler)
-            elif auth_result.status == 200:
-                # Request authorized
-                break
-            else:
-                # Access denied
-                loop.register(
-                    helpers.HTTPEventHandler(self.server, self.sock, self.address, self.request_parser, auth_result),
-                    looping.POLLOUT,
+            if isinstance(auth_result, AuthPending):
+                # Park the request until the handler makes up its mind
+                self.auth_pending = auth_result
+                self.server.loop.register(self, 0)
+                self.server.timeouts.reset_timeout(
+                    (self, "auth"), self.server.loop.now() + self.AUTH_TIMEOUT, self.auth_timed_out
                 )
+                auth_result.add_callback(functools.partial(self.auth_completed, auth_handler, index, auth_result))
+                return
+            if not self.handle_auth_result(auth_handler, auth_result):
+                return
+            if auth_result is not None:
+                break
+            index += 1
+        self.dispatch_request()
+
+    def handle_auth_result(self, auth_handler: AbstractAuthorization, auth_result: Optional[HTTPResponse]) -> bool:
+        """Return whether the request may go on, responding otherwise."""
+        if auth_result is None:
+            return True
+        elif not isinstance(auth_result, HTTPResponse):
+            # Wrong response from auth handler
+            raise RuntimeError("Wrong response from authorization handler %s" % auth_handler)
+        elif auth_result.status == 200:
+            # Request authorized
+            self.authorized_by = auth_handler
+            return True
+        else:
+            # Access denied
+            self.respond(auth_result)
+            return False
+
+    def auth_completed(
+        self, auth_handler: AbstractAuthorization, index: int, pending: AuthPending, auth_result: Optional[HTTPResponse]
+    ) -> None:
+        if pending is not self.auth_pending or not hasattr(self, "sock"):
+            # Timed out, or the client went away
+            return
+        self.auth_pending = None
+        self.server.timeouts.remove_timeout((self, "auth"))
+        try:
+            if not self.handle_auth_result(auth_handler, auth_result):
                 return
+            if auth_result is None:
+                self.authorize(index + 1)
+            else:
+                self.dispatch_request()
+        except Exception:
+            # Same as what the loop does for exceptions in handlers
+            self.server.logger.exception("Exception when resuming %s:", self)
+            self.close()
+
+    def auth_timed_out(self) -> None:
+        self.server.logger.error("Authorization timeout for %s", self.address)
+        self.auth_pending = None
+        self.respond(
+            HTTPResponse(503, b"Service Unavailable", {b"Content-Type": b"text/plain"}, b"Authorization timeout\n")
+        )
 
+    def respond(self, response: HTTPResponse) -> None:
+        self.server.loop.register(
+            helpers.HTTPEventHandler(self.server, self.sock, self.address, self.request_parser, response),
+            looping.POLLOUT,
+        )
+
+    def pace(self, client: clients.StreamClient, path: str) -> None:
+        """Have client sent its burst at pacing_burst_multiple times the
+        stream bitrate, if set, and then at pacing_live_multiple times."""
+        config = self.server.config
+        burst_multiple = config.get_mount_option(path, "pacing_burst_multiple")
+        bitrate = self.server.metrics.ingest_rate(path)
+        if not burst_multiple or not bitrate:
+            return
+        live_multiple = config.get_mount_option(path, "pacing_live_multiple", client.PACING_LIVE_MULTIPLE)
+        client.start_pacing(burst_multiple * bitrate, live_multiple * bitrate if live_multiple else None)
+
+    def tune(self, client: clients.StreamClient, path: str) -> None:
+        """Apply the mount's own client socket options, the global ones
+        having been applied at accept time."""
+        config = self.server.config
+        mount_options = config.mounts.get(path, {}).get("client_socket_options")
+        if mount_options:
+            apply_socket_options(self.sock, mount_options, self.server.logger)
+        if config.socket_options(path, "client").get("cork_burst"):
+            # Until the burst is written, for it to go out in full segments
+            client.set_cork(True)
+
+    def dispatch_request(self) -> None:
+        loop = self.server.loop
         path = self.request_parser.request_path.decode("ascii")
 
         response = None
@@ -134,7 +235,7 @@ class HTTPRequest(looping.BaseIOEventHandler):
                     # Used by some clients to know the stream type
                     # before attempting playout
                     if self.request_parser.request_method in [b"HEAD"]:
-                        source = list(self.server.sources[path].keys())[0]
+                        source = next(iter(self.server.sources[path]))
                         response = HTTPResponse(
                             200,
                             b"OK",
@@ -144,25 +245,29 @@ class HTTPRequest(looping.BaseIOEventHandler):
                                 b"Connection": b"close",
                             },
                         )
-                    # Check for server clients limit
-                    elif self.server.clients_limit is not None and (
-                        self.server.clients_limit == self.server.clients_connected
-                    ):
-                        response = HTTPResponse(503, b"Cannot handle response." b" Too many clients.")
                     else:
-                        # FIXME: proper source selection
-                        source = random.choice(list(self.server.sources[path].keys()))
-                        new_client = clients.find_client(
-                            self.server, source, self.sock, self.address, self.request_parser
-                        )
-                        # FIXME: this call may actually need to instatiate
-                        # the client itself (e.g. if the source needs some
-                        # dedicated code in its clients)
-                        source.new_client(new_client)
-                        # FIXME: see above wrt to proper source selection
-                        self.server.sources[path][source]["clients"][new_client.fileno()] = new_client
-                        self.server.clients_connected += 1
-                        loop.register(new_client, looping.POLLOUT)
+                        # Check for clients and bandwidth limits
+                        priority_class = self.server.capacity.admit(self, path)
+                        if priority_class is None:
+                            response = HTTPResponse(503, b"Cannot handle response." b" Too many clients.")
+                        else:
+                            source = self.server.source_selectors[path].select()
+                            new_client = clients.find_client(
+                                self.server, source, self.sock, self.address, self.request_parser
+                            )
+                            new_client.priority_class = priority_class
+                            self.tune(new_client, path)
+                            # FIXME: this call may actually need to instatiate
+                            # the client itself (e.g. if the source needs some
+                            # dedicated code in its clients)
+                            source.new_client(new_client)
+                            # Now that its burst is queued
+                            self.pace(new_client, path)
+                            self.server.sources[path][source]["clients"][new_client.fileno()] = new_client
+                            self.server.clients_connected += 1
+                            self.server.metrics.client_added(new_client)
+                            self.server.capacity.client_added(new_client)
+                            loop.register(new_client, looping.POLLOUT)
                 else:
                     # Stream does not exist
                     response = HTTPResponse(404, b"Stream Not Found")
@@ -172,17 +277,22 @@ class HTTPRequest(looping.BaseIOEventHandler):
             response = HTTPResponse(405, b"Method Not Allowed")
 
         if response is not None:
-            loop.register(
-                helpers.HTTPEventHandler(self.server, self.sock, self.address, self.request_parser, response),
-                looping.POLLOUT,
-            )
+            self.respond(response)
 
 
 class InactivityTimeout(Exception):
     pass
 
 
-_SourceDict = TypedDict("_SourceDict", {"source": sources.StreamSource, "clients": dict[int, clients.StreamClient]})
+_SourceDict = TypedDict(
+    "_SourceDict",
+    {
+        "source": sources.StreamSource,
+        "clients": dict[int, clients.StreamClient],
+        # Clients waiting for this source's next sync point
+        "pending_clients": dict[int, clients.StreamClient],
+    },
+)
 
 
 class TCPServer(looping.BaseIOEventHandler):
@@ -194,7 +304,8 @@ class TCPServer(looping.BaseIOEventHandler):
     # Maximum I/O inactivity timeout, in seconds
     INACTIVITY_TIMEOUT = 10
 
-    RESTART_DELAY = 1
+    # Interval, in seconds, between checks for stalled sources
+    STALL_CHECK_INTERVAL = 1
 
     STATE_RUNNING = "RUNNING"
     STATE_STOPPED = "STOPPED"
@@ -210,25 +321,42 @@ class TCPServer(looping.BaseIOEventHandler):
         self.logger = logger or logging.getLogger("savate")
         self.keepalived: dict[bytes, list[clients.StreamClient]] = collections.defaultdict(list)
         self.sources: dict[str, dict[sources.StreamSource, _SourceDict]] = {}
+        self.source_selectors: dict[str, selection.SourceSelector] = {}
         self.relays: dict[socket.socket, relay.Relay] = {}
-        self.relays_to_restart: collections.deque[tuple[float, relay.Relay]] = collections.deque()
+        self.relay_scheduler = relay.RelayScheduler(self)
+        self.relay_groups: dict[tuple[str, str], relay.HedgedRelayGroup] = {}
         self.auth_handlers: list[AbstractAuthorization] = []
         self.status_handlers: dict[str, status.BaseStatusClient] = {}
         self.statistics_handlers: list[stats.StatsHandler] = []
         self.state = self.STATE_RUNNING
         self.reloading = False
+        self.reload_pending = False
         self.timeouts: timeouts.Timeouts = None
         self.io_timeouts: timeouts.IOTimeout = None
+        self.executor: executor.LoopExecutor = None
+        self.resolver: resolver.Resolver = None
         # keep a counter for limit on *streaming* clients
         self.clients_connected = 0
-        # max number of clients
-        self.clients_limit: Optional[int] = None
+        self.metrics = metrics.ServerMetrics(self)
+        self.profiler = profiler.SamplingProfiler(self)
+        self.log_aggregator = logs.LogAggregator(self)
+        self.admission = admission.AdmissionControl(self)
+        self.overload = overload.OverloadGuard(self)
+        self.governor = governor.MemoryGovernor(self)
+        self.capacity = capacity.CapacityManager(self)
+        self.health_monitor = tcpinfo.ClientHealthMonitor(self)
+        self.profile_requested = False
 
     def create_loop(self) -> None:
-        self.loop = looping.IOLoop(self.logger)
+        if self.config.config_dict.get("loop_instrumentation", False):
+            self.loop: looping.IOLoop = looping.InstrumentedIOLoop(self.logger)
+        else:
+            self.loop = looping.IOLoop(self.logger)
         self.loop.register(self, looping.POLLIN)
         # Our timeout handler
         self.loop.register(self.timeouts, looping.POLLIN)
+        # Our thread pool callbacks handler
+        self.loop.register(self.executor, looping.POLLIN)
 
     def create_socket(self) -> None:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -242,6 +370,12 @@ class TCPServer(looping.BaseIOEventHandler):
         if not self.timeouts:
             self.timeouts = timeouts.Timeouts(self)
             self.io_timeouts = timeouts.IOTimeout(self.timeouts)
+        # Same goes for the executor's socket pair
+        if not self.executor:
+            self.executor = executor.LoopExecutor(self)
+            self.resolver = resolver.Resolver(
+                self, self.executor, self.config.config_dict.get("dns_ttl", resolver.Resolver.DEFAULT_TTL)
+            )
 
     def handle_event(self, eventmask: int) -> None:
         if eventmask & looping.POLLIN:
@@ -270,7 +404,18 @@ class TCPServer(looping.BaseIOEventHandler):
 
     def handle_new_incoming(self) -> None:
         client_socket, client_address = self.sock.accept()
+        if self.overload.overloaded and self.overload.action == "reject":
+            self.overload.reject(client_socket)
+            return
+        if self.admission.enabled:
+            admitted_socket = self.admission.admit(client_socket, client_address)
+            if admitted_socket is None:
+                return
+            client_socket = admitted_socket
         self.logger.info("New client <fd:%d, id:0x%s>, %s", client_socket.fileno(), id(client_socket), client_address)
+        socket_options = self.config.config_dict.get("client_socket_options")
+        if socket_options:
+            apply_socket_options(client_socket, socket_options, self.logger)
         new_handler = HTTPRequest(self, client_socket, client_address)
         self.reset_inactivity_timeout(new_handler)
 
@@ -303,12 +448,32 @@ class TCPServer(looping.BaseIOEventHandler):
         burst_size: Optional[int] = None,
         on_demand: bool = False,
         keepalive: Optional[int] = None,
+        weight: float = 1,
+        merge_feeds: bool = False,
+    ) -> None:
+        self.relay_scheduler.start(
+            (url, path, address_info),
+            functools.partial(
+                self.start_relay, url, path, address_info, burst_size, on_demand, keepalive, weight, merge_feeds
+            ),
+        )
+
+    def start_relay(
+        self,
+        url: str,
+        path: str,
+        address_info: Optional[helpers.AddrInfo] = None,
+        burst_size: Optional[int] = None,
+        on_demand: bool = False,
+        keepalive: Optional[int] = None,
+        weight: float = 1,
+        merge_feeds: bool = False,
     ) -> None:
         tmp_relay: relay.Relay
         if urllib.parse.urlparse(url).scheme in ("udp", "multicast"):
-            tmp_relay = relay.UDPRelay(self, url, path, address_info, burst_size)
+            tmp_relay = relay.UDPRelay(self, url, path, address_info, burst_size, weight, merge_feeds)
         else:
-            tmp_relay = relay.HTTPRelay(self, url, path, address_info, burst_size, on_demand, keepalive)
+            tmp_relay = relay.HTTPRelay(self, url, path, address_info, burst_size, on_demand, keepalive, weight)
         self.relays[tmp_relay.sock] = tmp_relay
 
     def add_auth_handler(self, handler: AbstractAuthorization) -> None:
@@ -332,14 +497,40 @@ class TCPServer(looping.BaseIOEventHandler):
         source = sources.find_source(self, sock, address, request_parser, path, burst_size)
         self.register_source(source)
 
+    def add_feed(
+        self,
+        path: str,
+        sock: socket.socket,
+        address: tuple[str, int],
+        request_parser: cyhttp11.HTTPParser,
+        burst_size: Optional[int] = None,
+    ) -> None:
+        for source in self.sources.get(path, {}):
+            if isinstance(source, sources.MergedMPEGTSSource):
+                source.add_feed(sock, address, request_parser.body)
+                return
+
+        self.register_source(
+            sources.MergedMPEGTSSource(self, sock, address, "video/MP2T", request_parser, path, burst_size)
+        )
+
     def register_source(self, source: sources.StreamSource) -> None:
         self.logger.info("New source (%s) for %s: %s", source.__class__.__name__, source.path, source.address)
-        self.sources.setdefault(source.path, {})[source] = {"source": source, "clients": {}}
+        self.sources.setdefault(source.path, {})[source] = {"source": source, "clients": {}, "pending_clients": {}}
+        if source.path not in self.source_selectors:
+            self.source_selectors[source.path] = selection.SourceSelector(
+                self, source.path, self.config.get_mount_option(source.path, "hot_standby", False)
+            )
+        self.source_selectors[source.path].add_source(source, source.relay.weight if source.relay else 1)
+        if source.relay is None:
+            # Relays sockets are tuned before connecting
+            apply_socket_options(source.sock, self.config.socket_options(source.path, "source"), self.logger)
         self.reset_inactivity_timeout(source)
+        self.schedule_stall_check(source)
         self.loop.register(source, looping.POLLIN)
 
         # check if there are listeners waiting
-        if self.keepalived[source.path]:
+        if self.keepalived.get(source.path):
             # cancel timeout
             self.timeouts.remove_timeout(source.path)
             for client in self.keepalived[source.path]:
@@ -347,7 +538,8 @@ class TCPServer(looping.BaseIOEventHandler):
                     # the client disconnected so we just ignore it
                     continue
                 client.source = source
-                self.sources[source.path][source]["clients"][client.fileno()] = client
+                # Resume streaming on a sync point of the new source
+                source.add_pending_client(client)
 
             del self.keepalived[source.path]
 
@@ -355,17 +547,65 @@ class TCPServer(looping.BaseIOEventHandler):
         self.reset_inactivity_timeout(handler)
 
     def check_for_relay_restart(self, handler: looping.BaseIOEventHandler) -> None:
-        # If this is one of our relays, mark it for restart
+        # If this is one of our relays, schedule its restart
         if handler.sock in self.relays:
-            # It will be restarted in one second from now
-            # FIXME: use real timers
-            self.relays_to_restart.append((self.loop.now() + self.RESTART_DELAY, self.relays.pop(handler.sock)))
+            tmp_relay = self.relays.pop(handler.sock)
+            self.relay_scheduler.restart(tmp_relay.key, tmp_relay.restart)
+
+    def drop_relay(self, tmp_relay: relay.Relay) -> None:
+        # Forget about the relay first, it must not be restarted
+        self.relays.pop(tmp_relay.sock, None)
+        self.relay_scheduler.cancel(tmp_relay.key)
+        for source in self.sources.get(tmp_relay.path, {}):
+            if source.sock is tmp_relay.sock:
+                # The relay is already running as a source
+                source.close()
+                return
+        tmp_relay.close()
+
+    def schedule_stall_check(self, source: sources.StreamSource) -> None:
+        self.timeouts.reset_timeout(
+            (source, "stall"), self.loop.now() + self.STALL_CHECK_INTERVAL, self.check_source_stall, source
+        )
+
+    def check_source_stall(self, source: sources.StreamSource) -> None:
+        selector = self.source_selectors[source.path]
+        source_dict = self.sources[source.path][source]
+        if (
+            len(selector) > 1
+            and not source.is_healthy()
+            and (source_dict["clients"] or source_dict["pending_clients"])
+            and selector.select(exclude=source).is_healthy()
+        ):
+            # Fail over to the backup sources without waiting for the
+            # inactivity timeout
+            stalled_clients = list(
+                itertools.chain(source_dict["clients"].values(), source_dict["pending_clients"].values())
+            )
+            self.logger.warning("Source %s stalled, migrating its %d clients", source, len(stalled_clients))
+            source_dict["clients"] = {}
+            source_dict["pending_clients"] = {}
+            self.migrate_clients(source, stalled_clients)
+        self.schedule_stall_check(source)
+
+    def migrate_clients(self, source: sources.StreamSource, clients_list: Iterable[clients.StreamClient]) -> None:
+        selector = self.source_selectors[source.path]
+        for client in clients_list:
+            new_source = selector.select(exclude=source)
+            client.source = new_source
+            # Switch clients on the new source's next sync point
+            new_source.add_pending_client(client)
+            # if source is on demand and not running, then start it
+            if new_source.on_demand != new_source.DISABLED:
+                new_source.on_demand_activate()
 
     def remove_source(self, source: sources.StreamSource) -> None:
         # De-activate the timeout handling for this source
         self.remove_inactivity_timeout(source)
         # Remove on demand closing timeout
         self.timeouts.remove_timeout(source)
+        self.timeouts.remove_timeout((source, "stall"))
+        self.metrics.source_removed(source)
 
         keepalive = source.keepalive
 
@@ -374,16 +614,16 @@ class TCPServer(looping.BaseIOEventHandler):
             # There is at least one other source for this path,
             # migrate the clients to it
             tmp_source = self.sources[source.path].pop(source)
-            # Simple even distribution amongst the remaining sources
-            for client, new_source in zip(
-                iter(tmp_source["clients"].values()), itertools.cycle(list(self.sources[source.path].keys()))
-            ):
-                client.source = new_source
-                self.sources[source.path][new_source]["clients"][client.fileno()] = client
-                # if source is on demand and not running, then start it
-                new_source.on_demand_activate()
+            self.source_selectors[source.path].remove_source(source)
+            self.migrate_clients(
+                source, itertools.chain(tmp_source["clients"].values(), tmp_source["pending_clients"].values())
+            )
         else:
-            for client in self.sources[source.path][source]["clients"].values():
+            source_dict = self.sources[source.path][source]
+            # Closing clients removes them from source_dict, iterate on a copy
+            for client in list(
+                itertools.chain(source_dict["clients"].values(), source_dict["pending_clients"].values())
+            ):
                 if keepalive:
                     # try to keep the clients
                     client.source = None  # type: ignore[assignment]
@@ -393,6 +633,7 @@ class TCPServer(looping.BaseIOEventHandler):
                     # be weird
                     self.keepalived[source.path].append(client)
                 else:
+                    client.close_reason = "source_closed"
                     client.close()
             if keepalive:
                 # timeout n seconds
@@ -402,6 +643,7 @@ class TCPServer(looping.BaseIOEventHandler):
                     for client in self.keepalived[source.path]:
                         # in case client was disconnected already
                         if not client.closed:
+                            client.close_reason = "keepalive_expired"
                             client.close()
                     del self.keepalived[source.path]
 
@@ -411,27 +653,31 @@ class TCPServer(looping.BaseIOEventHandler):
                     my_closure,
                 )
             del self.sources[source.path]
+            del self.source_selectors[source.path]
         self.loop.unregister(source)
         self.check_for_relay_restart(source)
 
     def remove_client(self, client: clients.StreamClient) -> None:
         self.clients_connected -= 1
+        self.metrics.client_removed(client)
+        self.capacity.client_removed(client)
         source = client.source
         self.loop.unregister(client)
         if source is None:
             return None
 
-        del self.sources[source.path][source]["clients"][client.fileno()]
-        # FIXME: what to do with this one ?
-        self.logger.info(
-            "Dropping client for path %s, %s",
-            source.path,
-            client.address,
+        source_dict = self.sources[source.path][source]
+        if source_dict["clients"].pop(client.fileno(), None) is None:
+            source_dict["pending_clients"].pop(client.fileno(), None)
+        self.log_aggregator.event(
+            "Dropped client", source.path, logging.INFO, "Dropping client for path %s, %s", source.path, client.address
         )
 
     def all_clients(self) -> Iterable[clients.StreamClient]:
         return itertools.chain.from_iterable(
-            source_dict["clients"].values() for source in self.sources.values() for source_dict in source.values()
+            itertools.chain(source_dict["clients"].values(), source_dict["pending_clients"].values())
+            for source in self.sources.values()
+            for source_dict in source.values()
         )
 
     def publish_packet(self, source: sources.StreamSource, packet: bytes) -> None:
@@ -440,33 +686,47 @@ class TCPServer(looping.BaseIOEventHandler):
             client.add_packet(packet)
 
     def serve_forever(self) -> None:
+        self.metrics.update_rates()
         while self.state == self.STATE_RUNNING or (self.state == self.STATE_SHUTTING_DOWN and any(self.all_clients())):
             self.loop.once(self.LOOP_TIMEOUT)
 
-            while self.relays_to_restart and self.relays_to_restart[0][0] < self.loop.now():
-                self.logger.info("Restarting relay %s", self.relays_to_restart[0][1])
-                tmp_relay = self.relays_to_restart.popleft()[1]
-                self.add_relay(
-                    tmp_relay.url,
-                    tmp_relay.path,
-                    tmp_relay.addr_info,
-                    tmp_relay.burst_size,
-                    tmp_relay.on_demand,
-                    tmp_relay.keepalive,
+            if self.reloading and not self.reload_pending:
+                self.reloading = False
+                self.reload_pending = True
+                # Reading, validating and diffing the configuration
+                # happens outside of the loop
+                self.executor.submit(
+                    configuration.load_config,
+                    self.config_file,
+                    self.config.config_dict,
+                    callback=self.config_loaded,
                 )
 
-            if self.reloading:
-                self.reloading = False
-                with open(self.config_file) as conf_file:
-                    try:
-                        config_dict = json.load(conf_file)
-                        self.config.reconfigure(config_dict)
-                    except (ValueError, configuration.BadConfig):
-                        self.logger.exception("Bad config file:")
+            if self.profile_requested:
+                self.profile_requested = False
+                self.profiler.start()
 
         # FIXME: we should probably close() every source/client and
         # the server instance itself
         self.logger.info("Shutting down")
+        # The executor is closed below, write a running profile now
+        self.profiler.stop(synchronous=True)
+        self.log_aggregator.flush()
+        for stat in self.statistics_handlers:
+            stat.close()
+        self.executor.close()
+
+    def config_loaded(
+        self,
+        future: "concurrent.futures.Future[tuple[dict[str, Any], Optional[configuration.ConfigDiff]]]",
+    ) -> None:
+        self.reload_pending = False
+        try:
+            config_dict, diff = future.result()
+        except (IOError, ValueError, configuration.BadConfig):
+            self.logger.exception("Bad config file:")
+            return
+        self.config.reconfigure(config_dict, diff)
 
     def stop(self, signum: int, _frame: Optional[types.FrameType]) -> None:
         self.logger.info("Received signal %s, stopping main loop", find_signal_str(signum))
@@ -476,6 +736,10 @@ class TCPServer(looping.BaseIOEventHandler):
         self.logger.info("Received signal %s, reloading configuration", find_signal_str(signum))
         self.reloading = True
 
+    def profile(self, signum: int, _frame: Optional[types.FrameType]) -> None:
+        self.logger.info("Received signal %s, starting profiler", find_signal_str(signum))
+        self.profile_requested = True
+
     def graceful_stop(self, signum: int, _frame: Optional[types.FrameType]) -> None:
         self.logger.info("Received signal %s, performing graceful stop", find_signal_str(signum))
         # Close our accept() socket
@@ -65,6 +65,11 @@ class ShoutcastSource(LowBitrateSource):
         super().on_demand_connected(sock, request_parser)
         self.set_headers()
 
+    def buffered_bytes(self) -> dict[str, int]:
+        buffered_bytes = super().buffered_bytes()
+        buffered_bytes["working_buffer"] = len(self.working_buffer)
+        return buffered_bytes
+
     def metadata_parse(self) -> None:
         packet_cuts = []
         packet = memoryview(self.working_buffer)
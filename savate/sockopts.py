@@ -0,0 +1,52 @@
+import logging
+import socket
+from typing import Any, Callable
+
+# Not exposed by the socket module before Python 3.12, Linux only
+TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", 25)
+
+# Option name -> (level, option, value conversion)
+SOCKET_OPTIONS: dict[str, tuple[int, int, Callable[[Any], Any]]] = {
+    "sndbuf": (socket.SOL_SOCKET, socket.SO_SNDBUF, int),
+    "rcvbuf": (socket.SOL_SOCKET, socket.SO_RCVBUF, int),
+    "notsent_lowat": (socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, int),
+    "nodelay": (socket.IPPROTO_TCP, socket.TCP_NODELAY, int),
+    "congestion": (socket.IPPROTO_TCP, socket.TCP_CONGESTION, lambda value: value.encode("ascii")),
+}
+
+# Options handled by savate rather than set once on the socket
+CLIENT_ONLY_OPTIONS = ("cork_burst",)
+
+
+def check_socket_options(options: Any, allowed: tuple[str, ...] = ()) -> None:
+    """Raise ValueError if options is not a valid dictionary of socket
+    options."""
+    if not isinstance(options, dict):
+        raise ValueError("socket options must be a dictionary")
+    for name, value in options.items():
+        if name in allowed:
+            continue
+        if name not in SOCKET_OPTIONS:
+            raise ValueError("unknown socket option %r" % name)
+        if name == "congestion":
+            if not isinstance(value, str):
+                raise ValueError("congestion must be a string")
+        elif not isinstance(value, (int, bool)) or value < 0:
+            raise ValueError("%s must be a positive integer" % name)
+
+
+def apply_socket_options(sock: socket.socket, options: dict[str, Any], logger: logging.Logger) -> None:
+    """Set options on sock, logging those the kernel refuses. TCP
+    options are skipped for other sockets."""
+    is_tcp = sock.type == socket.SOCK_STREAM
+    for name, value in options.items():
+        option = SOCKET_OPTIONS.get(name)
+        if option is None:
+            continue
+        level, option_name, convert = option
+        if level == socket.IPPROTO_TCP and not is_tcp:
+            continue
+        try:
+            sock.setsockopt(level, option_name, convert(value))
+        except OSError as exc:
+            logger.warning("Cannot set socket option %s to %s: %s", name, value, exc)
@@ -5,6 +5,7 @@ from cyhttp11 import HTTPParser
 
 from savate import helpers
 from savate import looping
+from savate import mpegts
 
 if TYPE_CHECKING:
     from savate.clients import StreamClient
@@ -20,6 +21,12 @@ class StreamSource(looping.BaseIOEventHandler):
     # Stay connected for 20 seconds to the source when all clients are
     # disconnected
     ON_DEMAND_TIMEOUT = 20
+    # A source that did not receive any data for this many seconds is
+    # not considered healthy anymore
+    STALL_DELAY = 5
+    # Clients migrated from another source are attached at the next sync
+    # point, or after this many seconds if none shows up
+    SYNC_MAX_WAIT = 2
 
     # ondemand states
     DISABLED = 0
@@ -58,6 +65,9 @@ class StreamSource(looping.BaseIOEventHandler):
 
         self.on_demand = self.RUNNING if on_demand else self.DISABLED
         self.relay = server.relays.get(sock)  # some sources doesn't have relay
+        self.last_packet_time = server.loop.now()
+        self.bytes_received = 0
+        self.pending_since = 0.0
 
     def on_demand_activate(self) -> None:
         """Method which reconnects the relay"""
@@ -94,6 +104,7 @@ class StreamSource(looping.BaseIOEventHandler):
         self.on_demand = self.RUNNING
         self.sock = sock
         self.request_parser = request_parser
+        self.last_packet_time = self.server.loop.now()
         self.server.loop.register(self, looping.POLLIN)
 
     def __str__(self) -> str:
@@ -104,6 +115,11 @@ class StreamSource(looping.BaseIOEventHandler):
             self.content_type,
         )
 
+    def is_healthy(self) -> bool:
+        if self.on_demand in (self.STOPPED, self.CONNECTING):
+            return False
+        return (self.server.loop.now() - self.last_packet_time) < self.STALL_DELAY
+
     def close(self) -> None:
         self.server.remove_source(self)
         self.relay = None  # prevent cyclic reference
@@ -112,6 +128,8 @@ class StreamSource(looping.BaseIOEventHandler):
     def recv_packet(self, buffer_size: int = RECV_BUFFER_SIZE) -> Optional[bytes]:
         packet = helpers.handle_eagain(self.sock.recv, buffer_size)
         if packet:
+            self.last_packet_time = self.server.loop.now()
+            self.bytes_received += len(packet)
             self.server.update_activity(self)
         return packet
 
@@ -145,9 +163,9 @@ class StreamSource(looping.BaseIOEventHandler):
         self.publish_packet(packet)
 
     def publish_packet(self, packet: bytes) -> None:
-        clients = self.server.sources[self.path][self]["clients"]
+        source_dict = self.server.sources[self.path][self]
 
-        if not clients and self.on_demand == self.RUNNING:
+        if not source_dict["clients"] and not source_dict["pending_clients"] and self.on_demand == self.RUNNING:
             # activate timeout for desactivating source
             self.on_demand = self.CLOSING
             self.server.timeouts.reset_timeout(
@@ -156,8 +174,42 @@ class StreamSource(looping.BaseIOEventHandler):
                 self.on_demand_deactivate,
             )
 
+        if source_dict["pending_clients"]:
+            sync_point = self.find_sync_point(packet)
+            if sync_point is None and (self.server.loop.now() - self.pending_since) > self.SYNC_MAX_WAIT:
+                # No sync point in sight, give up and splice here
+                sync_point = 0
+            if sync_point is not None:
+                if sync_point:
+                    self.server.publish_packet(self, packet[:sync_point])
+                    packet = packet[sync_point:]
+                self.attach_pending_clients()
+
         self.server.publish_packet(self, packet)
 
+    def find_sync_point(self, packet: bytes) -> Optional[int]:
+        """Return the offset in packet where clients migrated from another
+        source can safely start receiving data, or None.
+
+        Published packets are aligned on frames/packets by default, so
+        any packet boundary will do. This is meant to be overriden in
+        subclasses.
+        """
+        return 0
+
+    def add_pending_client(self, client: "StreamClient") -> None:
+        """Add a client migrated from another source; it will only start
+        receiving data from this source at its next sync point."""
+        pending_clients = self.server.sources[self.path][self]["pending_clients"]
+        if not pending_clients:
+            self.pending_since = self.server.loop.now()
+        pending_clients[client.fileno()] = client
+
+    def attach_pending_clients(self) -> None:
+        source_dict = self.server.sources[self.path][self]
+        source_dict["clients"].update(source_dict["pending_clients"])
+        source_dict["pending_clients"].clear()
+
     def new_client(self, client: "StreamClient") -> None:
         if self.on_demand == self.STOPPED:
             self.on_demand_activate()
@@ -168,6 +220,10 @@ class StreamSource(looping.BaseIOEventHandler):
     def update_burst_size(self, new_burst_size: Optional[int]) -> None:
         pass
 
+    def buffered_bytes(self) -> dict[str, int]:
+        """Return the number of bytes held by this source, by buffer."""
+        return {}
+
 
 class BufferedRawSource(StreamSource):
 
@@ -227,6 +283,9 @@ class BufferedRawSource(StreamSource):
         self.burst_size = new_burst_size
         self.burst_packets.maxbytes = new_burst_size
 
+    def buffered_bytes(self) -> dict[str, int]:
+        return {"burst": self.burst_packets.current_size, "buffer": len(self.output_buffer_data)}
+
 
 class FixedPacketSizeSource(BufferedRawSource):
 
@@ -262,6 +321,9 @@ class MPEGTSSource(FixedPacketSizeSource):
     # Socket low water mark
     RECV_LOW_WATER_MARK = 1
 
+    def find_sync_point(self, packet: bytes) -> Optional[int]:
+        return mpegts.find_random_access_point(packet)
+
 
 class LowBitrateSource(BufferedRawSource):
 
@@ -319,14 +381,112 @@ try:
             else:
                 self.recv_buffer_count = max(len(buffers), self.RECV_BUFFER_COUNT_MIN)
 
+            packet = b"".join(buffers)
+            self.last_packet_time = self.server.loop.now()
+            self.bytes_received += len(packet)
             self.server.update_activity(self)
-            return b"".join(buffers)
+            return packet
 
 except ImportError:
     # recvmmsg() is not available, we'll use regular recv() instead
     pass
 
 
+class MergedMPEGTSSource(MPEGTSSource):
+    """
+    An MPEG-TS source fed by several redundant UDP/multicast feeds of the
+    same stream, which are merged packet by packet to fill any gap in one
+    of the feeds with the other ones.
+
+    The first feed is the source's own socket, the other ones are
+    attached with add_feed().
+    """
+
+    def __init__(
+        self,
+        server: "TCPServer",
+        sock: socket.socket,
+        address: tuple[str, int],
+        content_type: str,
+        request_parser: Optional[HTTPParser] = None,
+        path: Optional[str] = None,
+        burst_size: Optional[int] = None,
+        on_demand: bool = False,
+        keepalive: Optional[int] = None,
+    ) -> None:
+        super().__init__(server, sock, address, content_type, request_parser, path, burst_size, on_demand, keepalive)
+        self.merger = mpegts.TSMerger()
+        self.feeds: list[MPEGTSFeed] = []
+        self.output_buffer_data = self.merger.feed(self, self.output_buffer_data, server.loop.now())
+
+    def add_feed(self, sock: socket.socket, address: tuple[str, int], initial_data: bytes) -> None:
+        self.server.logger.info("New feed for %s: %s", self, address)
+        feed = MPEGTSFeed(self.server, self, sock, address)
+        self.feeds.append(feed)
+        self.server.reset_inactivity_timeout(feed)
+        self.server.loop.register(feed, looping.POLLIN)
+        self.handle_feed_packet(feed, initial_data)
+
+    def handle_packet(self, packet: bytes) -> None:
+        self.handle_feed_packet(self, packet)
+
+    def handle_feed_packet(self, feed: looping.BaseIOEventHandler, packet: bytes) -> None:
+        super().handle_packet(self.merger.feed(feed, packet, self.server.loop.now()))
+
+    def buffered_bytes(self) -> dict[str, int]:
+        buffered_bytes = super().buffered_bytes()
+        buffered_bytes["merger"] = sum(
+            len(data) for data in self.merger.remainders.values()
+        ) + mpegts.PACKET_SIZE * sum(len(pid_state.held) for pid_state in self.merger.pids.values())
+        return buffered_bytes
+
+    def close(self) -> None:
+        for feed in list(self.feeds):
+            feed.close()
+        super().close()
+
+
+class MPEGTSFeed(looping.BaseIOEventHandler):
+    """An additional redundant input of a :class:`MergedMPEGTSSource`."""
+
+    RECV_BUFFER_SIZE = MPEGTSSource.RECV_BUFFER_SIZE
+
+    def __init__(
+        self, server: "TCPServer", source: MergedMPEGTSSource, sock: socket.socket, address: tuple[str, int]
+    ) -> None:
+        self.server = server
+        self.source = source
+        self.sock = sock
+        self.address = address
+
+    def __str__(self) -> str:
+        return "<%s for %s, %s>" % (self.__class__.__name__, self.source.path, self.address)
+
+    def close(self) -> None:
+        self.server.remove_inactivity_timeout(self)
+        self.server.loop.unregister(self)
+        self.source.feeds.remove(self)
+        self.source.merger.remove_feed(self)
+        self.server.check_for_relay_restart(self)
+        looping.BaseIOEventHandler.close(self)
+
+    def handle_event(self, eventmask: int) -> None:
+        if eventmask & looping.POLLIN:
+            while True:
+                packet = helpers.handle_eagain(self.sock.recv, self.RECV_BUFFER_SIZE)
+                if packet is None:
+                    # EAGAIN
+                    break
+                self.server.update_activity(self)
+                # The merged source is alive as long as one of its feeds is
+                self.source.last_packet_time = self.server.loop.now()
+                self.source.bytes_received += len(packet)
+                self.server.update_activity(self.source)
+                self.source.handle_feed_packet(self, packet)
+        else:
+            self.server.logger.error("%s: unexpected eventmask %s", self, eventmask)
+
+
 from savate.flv_source import FLVSource
 from savate.shoutcast_source import (
     ShoutcastSource,
@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
+import json
+import os
+import queue
 import socket
+import threading
 from datetime import datetime
-from typing import TYPE_CHECKING, Any, Optional
+from typing import IO, TYPE_CHECKING, Any, Optional, Union
 
 from cyhttp11 import HTTPParser
 
@@ -30,6 +34,9 @@ class StatsHandler(ABC):
     ) -> None:
         ...
 
+    def close(self) -> None:
+        pass
+
 
 class ApacheLogger(StatsHandler):
     """Simple stat handler that just log requests in an Apache like format."""
@@ -61,3 +68,168 @@ class ApacheLogger(StatsHandler):
             request_parser.headers.get("Referer", "-"),
             request_parser.headers.get("User-Agent", "-"),
         )
+
+
+def _text(value: Union[bytes, str, None], default: Any = "-") -> Any:
+    if value is None:
+        return default
+    if isinstance(value, bytes):
+        return value.decode("latin-1")
+    return value
+
+
+# (time, address, method, path, HTTP version, status code, size,
+# duration, referer, user agent)
+_AccessRecord = tuple[float, str, Any, Any, Any, int, int, Optional[float], Any, Any]
+
+
+class BufferedAccessLogger(StatsHandler):
+    """Access log written to `file` by a background thread, in the
+    Apache combined format or as JSON lines (`format`: `apache`, the
+    default, or `json`).
+
+    Records are queued by the loop, up to `queue_size` (65536 by
+    default); further records are dropped and counted rather than
+    stalling the loop. The thread writes them by batches of at most
+    `flush_size` records (1000 by default), at least every
+    `flush_interval` seconds (1 by default), and reopens the file when
+    it is rotated.
+    """
+
+    QUEUE_SIZE = 65536
+    FLUSH_SIZE = 1000
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, server: "TCPServer", **config: Any) -> None:
+        super().__init__(server, **config)
+        self.filename = config["file"]
+        self.format = config.get("format", "apache")
+        if self.format not in ("apache", "json"):
+            raise ValueError("Unknown access log format %r" % self.format)
+        self.flush_size = config.get("flush_size", self.FLUSH_SIZE)
+        self.flush_interval = config.get("flush_interval", self.FLUSH_INTERVAL)
+        self.records: queue.Queue[Optional[_AccessRecord]] = queue.Queue(config.get("queue_size", self.QUEUE_SIZE))
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.log_file: Optional[IO[str]] = None
+        self.log_file_id: Optional[tuple[int, int]] = None
+        self.writer = threading.Thread(target=self.write_records, name="savate-access-log", daemon=True)
+        self.writer.start()
+
+    def request_in(self, request_parser: HTTPParser, sock: socket.socket) -> None:
+        pass
+
+    def request_out(
+        self,
+        request_parser: HTTPParser,
+        sock: socket.socket,
+        address: tuple[str, int],
+        size: int = 0,
+        connect_time: Optional[float] = None,
+        status_code: int = 200,
+    ) -> None:
+        # Only gather the fields here, formatting is left to the writer
+        now = self.server.loop.now()
+        try:
+            self.records.put_nowait(
+                (
+                    now,
+                    address[0],
+                    request_parser.request_method,
+                    request_parser.request_path,
+                    request_parser.http_version,
+                    status_code,
+                    size,
+                    now - connect_time if connect_time is not None else None,
+                    request_parser.headers.get(b"Referer"),
+                    request_parser.headers.get(b"User-Agent"),
+                )
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def format_record(self, record: _AccessRecord) -> str:
+        when, address, method, path, http_version, status_code, size, duration, referer, user_agent = record
+        if self.format == "json":
+            return json.dumps(
+                {
+                    "time": datetime.fromtimestamp(when).isoformat(),
+                    "address": address,
+                    "method": _text(method),
+                    "path": _text(path),
+                    "http_version": _text(http_version),
+                    "status": status_code,
+                    "size": size,
+                    "duration": duration,
+                    "referer": _text(referer, None),
+                    "user_agent": _text(user_agent, None),
+                }
+            )
+        return '%s - - [%s] "%s %s %s" %d %s "%s" "%s"' % (
+            address,
+            datetime.fromtimestamp(when).astimezone().strftime("%d/%b/%Y:%H:%M:%S %z"),
+            _text(method),
+            _text(path),
+            _text(http_version),
+            status_code,
+            size if size > 0 else "-",
+            _text(referer),
+            _text(user_agent),
+        )
+
+    def open_log_file(self) -> IO[str]:
+        """Return the log file, reopened if it was moved away."""
+        try:
+            stat = os.stat(self.filename)
+            file_id: Optional[tuple[int, int]] = (stat.st_dev, stat.st_ino)
+        except OSError:
+            file_id = None
+        if self.log_file is None or file_id != self.log_file_id:
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = open(self.filename, "a")
+            stat = os.fstat(self.log_file.fileno())
+            self.log_file_id = (stat.st_dev, stat.st_ino)
+        return self.log_file
+
+    def write_records(self) -> None:
+        done = False
+        while not done:
+            lines = []
+            try:
+                record = self.records.get(timeout=self.flush_interval)
+                while record is not None:
+                    lines.append(self.format_record(record))
+                    if len(lines) >= self.flush_size:
+                        break
+                    record = self.records.get_nowait()
+                else:
+                    done = True
+            except queue.Empty:
+                pass
+
+            dropped = self.dropped
+            if dropped != self.reported_dropped:
+                self.server.logger.warning("Access log queue full, dropped %d records", dropped - self.reported_dropped)
+                self.reported_dropped = dropped
+            if not lines:
+                continue
+            try:
+                log_file = self.open_log_file()
+                log_file.write("\n".join(lines) + "\n")
+                log_file.flush()
+            except (IOError, OSError):
+                self.server.logger.exception("Cannot write access log to %s:", self.filename)
+        if self.log_file is not None:
+            self.log_file.close()
+
+    def close(self) -> None:
+        """Write the queued records and stop the writer thread."""
+        while True:
+            try:
+                self.records.put(None, timeout=self.flush_interval)
+                break
+            except queue.Full:
+                if not self.writer.is_alive():
+                    break
+        self.writer.join()
@@ -1,13 +1,19 @@
 import os
+import heapq
+import itertools
 import json
 import pprint
 import socket
+import tracemalloc
+import urllib.parse
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Optional
 
 from cyhttp11 import HTTPParser
 
-from savate.helpers import HTTPEventHandler, HTTPResponse
+from savate.helpers import HTTPEventHandler, HTTPResponse, StreamingHTTPEventHandler
+from savate.looping import InstrumentedIOLoop
+from savate.metrics import Histogram
 from savate.sources import StreamSource
 
 if TYPE_CHECKING:
@@ -20,6 +26,11 @@ class BaseStatusClient(ABC):
         self.server_config = server_config
         self.config = config_dict
 
+    def update_server_config(self, server_config: dict[str, Any]) -> None:
+        """Called on reload when this handler's own configuration did not
+        change but the server's did."""
+        self.server_config = server_config
+
     @abstractmethod
     def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
         ...
@@ -39,45 +50,602 @@ class SimpleStatusClient(BaseStatusClient):
 
 
 class JSONStatusClient(BaseStatusClient):
-    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
-        sources_dict: dict[str, dict[str, dict[int, str]]] = {}
-        total_clients_number = 0
+    """JSON status, built from the server's metrics.
 
-        queue_sizes = []
+    The sources listing is generated as the client reads it. The query
+    string can restrict it to some mounts (`mount=/a&mount=/b`), and
+    paginate the listed clients with `offset` and `limit`.
 
-        for path, sources in self.server.sources.items():
-            sources_dict[path] = {}
+    The rest of the document is cached for `cache_ttl` seconds (1 by
+    default) and indented with `indent` (4 by default, null for a compact
+    output); the sources listing is always compact. `list_clients` (true
+    by default) sets whether each client address is listed or only their
+    number for each source. `buffer_queue_sizes` counts the buffer queue
+    sizes in power of two buckets, keyed by their upper bound.
+    """
+
+    # Number of clients serialized at once
+    CLIENTS_CHUNK = 1000
+
+    def __init__(self, server: "TCPServer", server_config: dict[str, Any], **config_dict: Any) -> None:
+        super().__init__(server, server_config, **config_dict)
+        self.cache_ttl = config_dict.get("cache_ttl", 1)
+        self.indent = config_dict.get("indent", 4)
+        self.list_clients = config_dict.get("list_clients", True)
+        self.cached_summary: dict[str, Any] = {}
+        self.cached_at = 0.0
+
+    def build_summary(self) -> dict[str, Any]:
+        queue_sizes = self.server.metrics.queue_sizes()
+        min_queue_size, median_queue_size, max_queue_size = self.server.metrics.queue_size_range()
+        return {
+            "total_clients_number": self.server.clients_connected,
+            "pid": os.getpid(),
+            "max_buffer_queue_size": max_queue_size,
+            "min_buffer_queue_size": min_queue_size,
+            "median_buffer_queue_size": median_queue_size,
+            "average_buffer_queue_size": queue_sizes.average(),
+            "buffer_queue_sizes": queue_sizes.as_dict(),
+            "overload": self.server.overload.status(),
+            "output_memory": self.server.governor.status(),
+            "capacity": self.server.capacity.status(),
+            "client_health": self.server.health_monitor.status(),
+            "mounts": dict(
+                (path, mount_metrics.as_dict()) for path, mount_metrics in self.server.metrics.mounts.items()
+            ),
+        }
+
+    def get_summary(self) -> dict[str, Any]:
+        now = self.server.loop.now()
+        if not self.cached_summary or (now - self.cached_at) >= self.cache_ttl:
+            self.cached_summary = self.build_summary()
+            self.cached_at = now
+        return self.cached_summary
+
+    def iter_status(self, paths: list[str], offset: int, limit: Optional[int]) -> Iterator[bytes]:
+        summary = dict(self.get_summary())
+        summary["mounts"] = dict((path, summary["mounts"][path]) for path in paths if path in summary["mounts"])
+        if offset or limit is not None:
+            summary["offset"] = offset
+            summary["limit"] = limit
+        summary_json = json.dumps(summary, indent=self.indent)
+        # Leave the document open for the sources listing
+        yield bytes(summary_json[: summary_json.rindex("}")].rstrip() + ', "sources": {', "utf-8")
+
+        paginated = bool(offset) or limit is not None
+        # Index of the next client, across all listed sources
+        index = 0
+        path_separator = b""
+        for path in paths:
+            sources = self.server.sources.get(path)
+            if not sources:
+                continue
+            source_separator = b""
+            # The sources and clients may change between two chunks,
+            # iterate on copies
             for source, source_dict in list(sources.items()):
+                if limit is not None and index >= offset + limit:
+                    break
+                clients = list(source_dict["clients"].items())
+                start = min(len(clients), max(0, offset - index))
+                end = len(clients) if limit is None else min(len(clients), max(0, offset + limit - index))
+                index += len(clients)
+                if paginated and start >= end:
+                    continue
+
+                if not source_separator:
+                    yield path_separator + bytes(json.dumps(path), "utf-8") + b": {"
+                    path_separator = b", "
                 source_address = "%s:%s (%s)" % (source.address[0], source.address[1], id(source))
-                sources_dict[path][source_address] = {}
-                for fd, client in list(source_dict["clients"].items()):
-                    sources_dict[path][source_address][fd] = "%s:%s" % client.address
-                    total_clients_number += 1
-                    queue_sizes.append(sum(len(elt) for elt in client.output_buffer.buffer_queue))
-
-        queue_sizes.sort()
-        if not queue_sizes:
-            queue_sizes = [-1]
-        status_dict = {
-            "total_clients_number": total_clients_number,
-            "pid": os.getpid(),
-            "max_buffer_queue_size": queue_sizes[-1],
-            "min_buffer_queue_size": queue_sizes[0],
-            "median_buffer_queue_size": queue_sizes[total_clients_number // 2],
-            "average_buffer_queue_size": sum(queue_sizes) / len(queue_sizes),
-            "sources": sources_dict,
+                yield source_separator + bytes(json.dumps(source_address), "utf-8") + b": "
+                source_separator = b", "
+                if not self.list_clients:
+                    yield b"%d" % (end - start)
+                    continue
+
+                yield b"{"
+                for chunk_start in range(start, end, self.CLIENTS_CHUNK):
+                    yield bytes(
+                        (", " if chunk_start > start else "")
+                        + ", ".join(
+                            '"%d": %s' % (fd, json.dumps("%s:%s" % client.address))
+                            for fd, client in clients[chunk_start : min(end, chunk_start + self.CLIENTS_CHUNK)]
+                        ),
+                        "utf-8",
+                    )
+                yield b"}"
+            if source_separator:
+                yield b"}"
+        yield b"}}\n"
+
+    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
+        query = urllib.parse.parse_qs((request_parser.query_string or b"").decode("ascii", "replace"))
+        paths = query.get("mount", list(self.server.sources))
+        try:
+            offset = max(0, int(query.get("offset", ["0"])[0]))
+            limit: Optional[int] = max(0, int(query["limit"][0])) if "limit" in query else None
+        except ValueError:
+            return HTTPEventHandler(
+                self.server,
+                sock,
+                address,
+                request_parser,
+                HTTPResponse(400, b"Bad Request", {b"Content-Type": b"text/plain"}, b"Invalid offset or limit\n"),
+            )
+
+        return StreamingHTTPEventHandler(
+            self.server,
+            sock,
+            address,
+            request_parser,
+            HTTPResponse(200, b"OK", {b"Content-Type": b"application/json"}),
+            self.iter_status(paths, offset, limit),
+        )
+
+
+class LoopStatusClient(BaseStatusClient):
+    """Event loop statistics, as JSON. They are only collected when the
+    `loop_instrumentation` option is set."""
+
+    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
+        loop = self.server.loop
+        if isinstance(loop, InstrumentedIOLoop):
+            status: dict[str, Any] = loop.stats()
+        else:
+            status = {"error": "loop_instrumentation is not enabled"}
+        return HTTPEventHandler(
+            self.server,
+            sock,
+            address,
+            request_parser,
+            HTTPResponse(200, b"OK", {b"Content-Type": b"application/json"}, json.dumps(status, indent=4).encode()),
+        )
+
+
+class ProfilerStatusClient(BaseStatusClient):
+    """Starts the sampling profiler, for `duration` seconds if given in
+    the query string, and returns the name of the file the profile will
+    be written to. This should be protected by an authorization
+    handler."""
+
+    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
+        query = urllib.parse.parse_qs((request_parser.query_string or b"").decode("ascii", "replace"))
+        try:
+            duration: Optional[float] = float(query["duration"][0]) if "duration" in query else None
+        except ValueError:
+            duration = 0
+        if duration is not None and not 0 < duration <= 3600:
+            response = HTTPResponse(400, b"Bad Request", {b"Content-Type": b"text/plain"}, b"Invalid duration\n")
+        else:
+            filename = self.server.profiler.start(duration)
+            if filename is None:
+                response = HTTPResponse(
+                    409, b"Conflict", {b"Content-Type": b"text/plain"}, b"A profile is already running\n"
+                )
+            else:
+                response = HTTPResponse(
+                    202,
+                    b"Accepted",
+                    {b"Content-Type": b"application/json"},
+                    json.dumps({"filename": filename}).encode(),
+                )
+        return HTTPEventHandler(self.server, sock, address, request_parser, response)
+
+
+class MemoryStatusClient(BaseStatusClient):
+    """Memory usage, as JSON: the process size, the bytes held by each
+    source and queued for its clients, and the `top_clients` (10 by
+    default) largest client queues.
+
+    tracemalloc can be driven from the query string: `tracemalloc=start`
+    starts tracing, `tracemalloc=snapshot` returns the `top_allocations`
+    (20 by default) biggest differences with the previous snapshot, or
+    with the start of tracing, and `tracemalloc=stop` stops tracing.
+    Snapshots block the server while they are taken.
+    """
+
+    TOP_CLIENTS = 10
+    TOP_ALLOCATIONS = 20
+
+    def __init__(self, server: "TCPServer", server_config: dict[str, Any], **config_dict: Any) -> None:
+        super().__init__(server, server_config, **config_dict)
+        self.top_clients = config_dict.get("top_clients", self.TOP_CLIENTS)
+        self.top_allocations = config_dict.get("top_allocations", self.TOP_ALLOCATIONS)
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @staticmethod
+    def process_memory() -> dict[str, int]:
+        try:
+            with open("/proc/self/statm") as statm:
+                size, resident = statm.read().split()[:2]
+        except (IOError, ValueError):
+            return {}
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return {"vms": int(size) * page_size, "rss": int(resident) * page_size}
+
+    def memory_status(self) -> dict[str, Any]:
+        sources_status: dict[str, list[dict[str, Any]]] = {}
+        for path, sources in self.server.sources.items():
+            sources_status[path] = [
+                {
+                    "source": str(source),
+                    "buffered_bytes": source.buffered_bytes(),
+                    "clients": len(source_dict["clients"]) + len(source_dict["pending_clients"]),
+                    "clients_queued_bytes": sum(
+                        client.output_buffer.queued_bytes
+                        for client in itertools.chain(
+                            source_dict["clients"].values(), source_dict["pending_clients"].values()
+                        )
+                    ),
+                }
+                for source, source_dict in sources.items()
+            ]
+        largest_clients = heapq.nlargest(
+            self.top_clients, self.server.all_clients(), key=lambda client: client.output_buffer.queued_bytes
+        )
+        return {
+            "process": self.process_memory(),
+            "sources_buffered_bytes": sum(
+                sum(source_status["buffered_bytes"].values())
+                for path_sources in sources_status.values()
+                for source_status in path_sources
+            ),
+            "clients_queued_bytes": self.server.metrics.queue_sizes().total,
+            "keepalived_clients": dict((path, len(clients)) for path, clients in self.server.keepalived.items()),
+            "sources": sources_status,
+            "largest_clients": [
+                {"client": str(client), "queued_bytes": client.output_buffer.queued_bytes} for client in largest_clients
+            ],
         }
 
+    def tracemalloc_status(self, action: str) -> dict[str, Any]:
+        if action == "start":
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.snapshot = tracemalloc.take_snapshot()
+            return {"tracing": True}
+        elif action == "stop":
+            tracemalloc.stop()
+            self.snapshot = None
+            return {"tracing": False}
+        elif action == "snapshot":
+            if not tracemalloc.is_tracing():
+                return {"tracing": False}
+            snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            if self.snapshot is not None:
+                statistics = snapshot.compare_to(self.snapshot, "lineno")
+            else:
+                statistics = snapshot.statistics("lineno")  # type: ignore[assignment]
+            self.snapshot = snapshot
+            traced, peak = tracemalloc.get_traced_memory()
+            return {
+                "tracing": True,
+                "traced_bytes": traced,
+                "peak_traced_bytes": peak,
+                "allocations": [str(statistic) for statistic in statistics[: self.top_allocations]],
+            }
+        raise ValueError("Unknown tracemalloc action %r" % action)
+
+    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
+        query = urllib.parse.parse_qs((request_parser.query_string or b"").decode("ascii", "replace"))
+        status = self.memory_status()
+        if "tracemalloc" in query:
+            try:
+                status["tracemalloc"] = self.tracemalloc_status(query["tracemalloc"][0])
+            except ValueError as exc:
+                return HTTPEventHandler(
+                    self.server,
+                    sock,
+                    address,
+                    request_parser,
+                    HTTPResponse(400, b"Bad Request", {b"Content-Type": b"text/plain"}, b"%s\n" % str(exc).encode()),
+                )
+        return HTTPEventHandler(
+            self.server,
+            sock,
+            address,
+            request_parser,
+            HTTPResponse(200, b"OK", {b"Content-Type": b"application/json"}, json.dumps(status, indent=4).encode()),
+        )
+
+
+class PrometheusStatusClient(BaseStatusClient):
+    """Server metrics in the Prometheus text exposition format.
+
+    Every metric is labelled with its mount point. Histograms use the
+    power of two buckets of savate.metrics.Histogram, up to
+    `queue_size_buckets` (28 by default, 128 MiB) for queue sizes and
+    `session_length_buckets` (25 by default, about six months) for
+    session lengths; larger values only show in the `+Inf` bucket.
+    """
+
+    QUEUE_SIZE_BUCKETS = 28
+    SESSION_LENGTH_BUCKETS = 25
+
+    def __init__(self, server: "TCPServer", server_config: dict[str, Any], **config_dict: Any) -> None:
+        super().__init__(server, server_config, **config_dict)
+        self.queue_size_buckets = config_dict.get("queue_size_buckets", self.QUEUE_SIZE_BUCKETS)
+        self.session_length_buckets = config_dict.get("session_length_buckets", self.SESSION_LENGTH_BUCKETS)
+
+    @staticmethod
+    def labels(**labels: str) -> str:
+        return ",".join(
+            '%s="%s"' % (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+            for name, value in labels.items()
+        )
+
+    def metric(
+        self, lines: list[str], name: str, metric_type: str, help_text: str, samples: Iterable[tuple[str, Any]]
+    ) -> None:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in samples:
+            if labels:
+                lines.append("%s{%s} %s" % (name, labels, value))
+            else:
+                lines.append("%s %s" % (name, value))
+
+    def histogram(
+        self, lines: list[str], name: str, help_text: str, histograms: Iterable[tuple[str, Histogram]], buckets: int
+    ) -> None:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s histogram" % name)
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bucket in range(buckets):
+                cumulative += histogram.counts[bucket]
+                lines.append('%s_bucket{%s,le="%d"} %d' % (name, labels, Histogram.upper_bound(bucket), cumulative))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+            lines.append("%s_sum{%s} %d" % (name, labels, histogram.total))
+            lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+
+    def build_metrics(self) -> bytes:
+        metrics = self.server.metrics
+        mounts = sorted(
+            (path, self.labels(mount=path), mount_metrics) for path, mount_metrics in metrics.mounts.items()
+        )
+        lines: list[str] = []
+        self.metric(
+            lines,
+            "savate_source_bytes_total",
+            "counter",
+            "Bytes received from sources.",
+            ((labels, metrics.bytes_in(path)) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_client_bytes_total",
+            "counter",
+            "Bytes sent to streaming clients.",
+            ((labels, mount_metrics.bytes_out) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_sources",
+            "gauge",
+            "Connected sources.",
+            ((labels, len(self.server.sources.get(path, ()))) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_clients",
+            "gauge",
+            "Connected streaming clients.",
+            ((labels, mount_metrics.clients) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_client_joins_total",
+            "counter",
+            "Streaming clients that connected.",
+            ((labels, mount_metrics.total_clients) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_client_leaves_total",
+            "counter",
+            "Streaming clients that disconnected, for any reason.",
+            ((labels, mount_metrics.left_clients) for path, labels, mount_metrics in mounts),
+        )
+        self.metric(
+            lines,
+            "savate_client_drops_total",
+            "counter",
+            "Streaming clients disconnected by the server or on errors, by reason.",
+            (
+                (self.labels(mount=path, reason=reason), count)
+                for path, labels, mount_metrics in mounts
+                for reason, count in sorted(mount_metrics.drops.items())
+            ),
+        )
+        self.metric(
+            lines,
+            "savate_relay_restarts_total",
+            "counter",
+            "Relay reconnections.",
+            ((labels, mount_metrics.relay_restarts) for path, labels, mount_metrics in mounts),
+        )
+        self.histogram(
+            lines,
+            "savate_client_queue_size_bytes",
+            "Streaming clients output queue sizes.",
+            ((labels, mount_metrics.queue_sizes) for path, labels, mount_metrics in mounts),
+            self.queue_size_buckets,
+        )
+        self.histogram(
+            lines,
+            "savate_client_session_length_seconds",
+            "Streaming clients session lengths, recorded when they disconnect.",
+            ((labels, mount_metrics.session_lengths) for path, labels, mount_metrics in mounts),
+            self.session_length_buckets,
+        )
+        self.metric(
+            lines,
+            "savate_connections_rejected_total",
+            "counter",
+            "Connections rejected at accept time, by reason.",
+            ((self.labels(reason=reason), count) for reason, count in sorted(self.server.admission.rejected.items())),
+        )
+        overload = self.server.overload
+        self.metric(
+            lines,
+            "savate_overloaded",
+            "gauge",
+            "Whether new connections are held back.",
+            [("", int(overload.overloaded))],
+        )
+        self.metric(
+            lines,
+            "savate_overloads_total",
+            "counter",
+            "Times the server became overloaded.",
+            [("", overload.overloads)],
+        )
+        self.metric(
+            lines,
+            "savate_overload_rejected_total",
+            "counter",
+            "Connections rejected while overloaded.",
+            [("", overload.rejected)],
+        )
+        capacity = self.server.capacity
+        self.metric(
+            lines,
+            "savate_class_clients",
+            "gauge",
+            "Connected streaming clients, by priority class.",
+            (
+                (self.labels(mount=path, **{"class": class_name}), count)
+                for path, counts in sorted(capacity.class_clients.items())
+                for class_name, count in sorted(counts.items())
+            ),
+        )
+        if capacity.has_bandwidth_limits():
+            self.metric(
+                lines,
+                "savate_client_bandwidth_estimate_bytes_per_second",
+                "gauge",
+                "Estimated bandwidth of streaming clients, as checked against bandwidth limits.",
+                ((labels, capacity.usage([path], None, True)) for path, labels, mount_metrics in mounts),
+            )
+        self.metric(
+            lines,
+            "savate_clients_rejected_total",
+            "counter",
+            "Streaming clients rejected by clients or bandwidth limits, by limit.",
+            (
+                (self.labels(mount=path, limit=reason), count)
+                for (path, reason), count in sorted(capacity.rejected.items())
+            ),
+        )
+        self.metric(
+            lines,
+            "savate_clients_shed_total",
+            "counter",
+            "Streaming clients closed to make room for higher priority ones, by priority class.",
+            (
+                (self.labels(mount=path, **{"class": class_name}), count)
+                for (path, class_name), count in sorted(capacity.shed.items())
+            ),
+        )
+        health_monitor = self.server.health_monitor
+        if health_monitor.interval:
+            self.metric(
+                lines,
+                "savate_client_health",
+                "gauge",
+                "Streaming clients by health, as classified from TCP_INFO samples.",
+                (
+                    (self.labels(mount=path, state=state), count)
+                    for path, counts in sorted(health_monitor.health_counts().items())
+                    for state, count in sorted(counts.items())
+                ),
+            )
+        self.metric(
+            lines,
+            "savate_tcp_info_samples_total",
+            "counter",
+            "TCP_INFO samples of streaming clients.",
+            [("", health_monitor.samples)],
+        )
+        self.metric(
+            lines,
+            "savate_dead_clients_evicted_total",
+            "counter",
+            "Streaming clients closed as their TCP_INFO showed them dead.",
+            [("", health_monitor.evicted)],
+        )
+        governor = self.server.governor
+        if governor.budget:
+            self.metric(
+                lines,
+                "savate_output_memory_budget_bytes",
+                "gauge",
+                "Budget of bytes queued for streaming clients.",
+                [("", governor.budget)],
+            )
+        self.metric(
+            lines,
+            "savate_output_memory_trimmed_total",
+            "counter",
+            "Streaming clients whose queue was dropped to stay within the memory budget.",
+            [("", governor.trimmed)],
+        )
+        self.metric(
+            lines,
+            "savate_output_memory_trimmed_bytes_total",
+            "counter",
+            "Bytes dropped from streaming clients queues to stay within the memory budget.",
+            [("", governor.trimmed_bytes)],
+        )
+        self.metric(
+            lines,
+            "savate_output_memory_evicted_total",
+            "counter",
+            "Streaming clients disconnected to stay within the memory budget.",
+            [("", governor.evicted)],
+        )
+        loop = self.server.loop
+        if isinstance(loop, InstrumentedIOLoop):
+            self.metric(
+                lines, "savate_loop_iterations_total", "counter", "Event loop iterations.", [("", loop.iterations)]
+            )
+            self.metric(lines, "savate_loop_events_total", "counter", "Events returned by poll().", [("", loop.events)])
+            self.metric(
+                lines,
+                "savate_loop_poll_seconds_total",
+                "counter",
+                "Time spent waiting in poll().",
+                [("", loop.poll_time)],
+            )
+            self.metric(
+                lines,
+                "savate_loop_dispatch_seconds_total",
+                "counter",
+                "Time spent handling events.",
+                [("", loop.dispatch_time)],
+            )
+            self.metric(
+                lines,
+                "savate_loop_handler_cpu_seconds_total",
+                "counter",
+                "CPU time spent handling events, by handler class.",
+                (
+                    (self.labels(handler=class_name), handler_times[1])
+                    for class_name, handler_times in sorted(loop.handler_times.items())
+                ),
+            )
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+    def get_status(self, sock: socket.socket, address: tuple[str, int], request_parser: HTTPParser) -> HTTPEventHandler:
         return HTTPEventHandler(
             self.server,
             sock,
             address,
             request_parser,
             HTTPResponse(
-                200,
-                b"OK",
-                {b"Content-Type": b"application/json"},
-                bytes(json.dumps(status_dict, indent=4) + "\n", "utf-8"),
+                200, b"OK", {b"Content-Type": b"text/plain; version=0.0.4; charset=utf-8"}, self.build_metrics()
             ),
         )
 
@@ -0,0 +1,175 @@
+import logging
+import math
+import socket
+import struct
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from savate.clients import StreamClient
+    from savate.server import TCPServer
+
+
+# struct tcp_info, as of Linux 4.10; older kernels fill less of it
+TCP_INFO_STRUCT = struct.Struct("=8B24I4Q6IQ")
+# Connection states, from include/net/tcp_states.h, in which nothing
+# more can be sent to the peer. CLOSE_WAIT is not one of them: peers
+# that shut down their writing side may still be reading.
+TCP_FIN_WAIT1 = 4
+TCP_FIN_WAIT2 = 5
+TCP_TIME_WAIT = 6
+TCP_CLOSE = 7
+TCP_LAST_ACK = 9
+TCP_CLOSING = 11
+TCP_CLOSED_STATES = frozenset((TCP_FIN_WAIT1, TCP_FIN_WAIT2, TCP_TIME_WAIT, TCP_CLOSE, TCP_LAST_ACK, TCP_CLOSING))
+
+
+class TCPInfo(NamedTuple):
+    state: int
+    retransmits: int
+    # Microseconds
+    rtt: int
+    snd_cwnd: int
+    unacked: int
+    total_retrans: int
+    # Milliseconds since the last ACK was received
+    last_ack_recv: int
+    notsent_bytes: int
+    # Bytes per second
+    delivery_rate: int
+
+
+def read_tcp_info(sock: socket.socket) -> TCPInfo:
+    data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_STRUCT.size)
+    fields = TCP_INFO_STRUCT.unpack(data.ljust(TCP_INFO_STRUCT.size, b"\0"))
+    return TCPInfo(
+        state=fields[0],
+        retransmits=fields[2],
+        rtt=fields[23],
+        snd_cwnd=fields[26],
+        unacked=fields[12],
+        total_retrans=fields[31],
+        last_ack_recv=fields[20],
+        notsent_bytes=fields[38],
+        delivery_rate=fields[42],
+    )
+
+
+class ClientHealthMonitor:
+    """Classifies streaming clients from their sockets TCP_INFO.
+
+    Every client is sampled every `interval` seconds, a few at a time,
+    and is then:
+
+    - dead if its connection is closed, or if data it was sent has not
+      been acknowledged for `dead_timeout` seconds,
+    - lagging if more than LAGGING_SECONDS of its stream are waiting to
+      be sent to it, in savate or in the kernel, and it is being
+      delivered slower than the stream's bitrate,
+    - healthy otherwise.
+
+    Dead clients are closed if `evict_dead` is true, lagging ones are the
+    first to go when the memory budget is exceeded.
+    """
+
+    HEALTHY = "healthy"
+    LAGGING = "lagging"
+    DEAD = "dead"
+
+    # Interval, in seconds, between two batches of samples
+    TICK = 0.1
+    DEAD_TIMEOUT = 5
+    LAGGING_SECONDS = 2
+
+    def __init__(self, server: "TCPServer") -> None:
+        self.server = server
+        self.interval: Optional[float] = None
+        self.dead_timeout: float = self.DEAD_TIMEOUT
+        self.evict_dead = True
+        # Clients left to sample in this round
+        self.round: list["StreamClient"] = []
+        self.round_size = 0
+        self.last_tick = 0.0
+        self.samples = 0
+        self.evicted = 0
+
+    def configure(self, interval: Optional[float], dead_timeout: float, evict_dead: bool) -> None:
+        self.dead_timeout = dead_timeout
+        self.evict_dead = evict_dead
+        if interval and not self.interval:
+            self.schedule_tick()
+        elif self.interval and not interval:
+            self.server.timeouts.remove_timeout(self)
+            self.round = []
+        self.interval = interval
+
+    def schedule_tick(self) -> None:
+        self.last_tick = self.server.loop.now()
+        self.server.timeouts.reset_timeout(self, self.last_tick + self.TICK, self.tick)
+
+    def tick(self) -> None:
+        if not self.interval:
+            return
+        if not self.round:
+            self.round = list(self.server.all_clients())
+            self.round_size = len(self.round)
+        # Spread the round over the interval, from the time actually
+        # elapsed since the previous batch
+        elapsed = self.server.loop.now() - self.last_tick
+        batch_size = max(1, math.ceil(self.round_size * min(elapsed, self.interval) / self.interval))
+        batch, self.round = self.round[:batch_size], self.round[batch_size:]
+        for client in batch:
+            if not client.closed:
+                self.sample(client)
+        self.schedule_tick()
+
+    def sample(self, client: "StreamClient") -> None:
+        try:
+            tcp_info = read_tcp_info(client.sock)
+        except OSError:
+            return
+        self.samples += 1
+        client.tcp_info = tcp_info
+        client.health = self.classify(client, tcp_info)
+        if client.health == self.DEAD and self.evict_dead:
+            self.evicted += 1
+            self.server.log_aggregator.event(
+                "Dead client",
+                client.path,
+                logging.INFO,
+                "Closing dead client %s for %s: %s",
+                client.address,
+                client.path,
+                tcp_info,
+            )
+            client.close_reason = "dead_peer"
+            client.close()
+
+    def classify(self, client: "StreamClient", tcp_info: TCPInfo) -> str:
+        if tcp_info.state in TCP_CLOSED_STATES:
+            return self.DEAD
+        if tcp_info.unacked and tcp_info.last_ack_recv > self.dead_timeout * 1000:
+            return self.DEAD
+        bitrate = self.server.metrics.ingest_rate(client.path)
+        if (
+            bitrate
+            and client.output_buffer.queued_bytes + tcp_info.notsent_bytes > self.LAGGING_SECONDS * bitrate
+            and tcp_info.delivery_rate < bitrate
+        ):
+            return self.LAGGING
+        return self.HEALTHY
+
+    def health_counts(self) -> dict[str, dict[str, int]]:
+        """Return the number of clients in each state, by mount point."""
+        counts: dict[str, dict[str, int]] = {}
+        for client in self.server.all_clients():
+            mount_counts = counts.setdefault(client.path, {})
+            mount_counts[client.health] = mount_counts.get(client.health, 0) + 1
+        return counts
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "evicted": self.evicted,
+            "clients": self.health_counts() if self.interval else {},
+        }
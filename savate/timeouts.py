@@ -1,8 +1,10 @@
+import logging
 import socket
 from functools import partial
 from typing import TYPE_CHECKING, Any, Callable
 
-from savate.helpers import event_mask_str
+from savate.helpers import HTTPEventHandler, event_mask_str
+from savate.logs import event_path
 from savate.looping import BaseIOEventHandler, POLLIN
 from savate.lllsfd import TimerFD, CLOCK_REALTIME, TFD_TIMER_ABSTIME
 
@@ -101,5 +103,14 @@ class IOTimeout:
         self.timeout_handler.remove_timeout(handler.sock)
 
     def fired_timeout(self, handler: BaseIOEventHandler) -> None:
-        self.server.logger.error("Timeout for %s: %d seconds without I/O" % (handler, self.server.INACTIVITY_TIMEOUT))
+        self.server.log_aggregator.event(
+            "Inactivity timeout",
+            event_path(handler),
+            logging.ERROR,
+            "Timeout for %s: %d seconds without I/O",
+            handler,
+            self.server.INACTIVITY_TIMEOUT,
+        )
+        if isinstance(handler, HTTPEventHandler):
+            handler.close_reason = "timeout"
         handler.close()
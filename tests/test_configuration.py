@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import pytest
+
+from savate.configuration import BadConfig, ConfigDiff, ServerConfiguration, validate_config
+
+
+def make_config(**global_options):
+    config_dict = {"burst_size": "64k", "dns_ttl": 300, "mounts": [{"path": "/a"}, {"path": "/b", "burst_size": "32k"}]}
+    config_dict.update(global_options)
+    return config_dict
+
+
+def test_mount_lookups_are_inherited_options():
+    config = ServerConfiguration(SimpleNamespace(), make_config(client_socket_options={"nodelay": True}))
+    assert config.get_mount_option("/a", "burst_size") == "64k"
+    assert config.get_mount_option("/b", "burst_size") == "32k"
+    assert config.socket_options("/a", "client") == {"nodelay": True}
+    assert config.inherited_options == {"burst_size", "client_socket_options"}
+
+
+def test_inherited_option_change_affects_every_mount():
+    config = ServerConfiguration(SimpleNamespace(), make_config())
+    config.get_mount_option("/a", "burst_size")
+
+    diff = ConfigDiff(make_config(), make_config(burst_size="128k"))
+    assert diff.affected_mounts(config.inherited_options) == {"/a", "/b"}
+
+
+def test_global_only_option_change_affects_no_mount():
+    config = ServerConfiguration(SimpleNamespace(), make_config())
+    config.get_mount_option("/a", "burst_size")
+
+    diff = ConfigDiff(make_config(), make_config(dns_ttl=600))
+    assert diff.changed_globals == {"dns_ttl"}
+    assert diff.affected_mounts(config.inherited_options) == set()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"max_connections_per_ip": "ten"},
+        {"connection_rate_per_ip": -1},
+        {"subnet_prefix_v4": 33},
+        {"admission_exempt": ["10.0.0.1/8"]},
+        {"admission_reject": "drop"},
+    ],
+)
+def test_bad_admission_options_are_rejected(options):
+    validate_config(make_config(max_connections_per_ip="4", admission_exempt=["10.0.0.0/8"]))
+    with pytest.raises(BadConfig):
+        validate_config(make_config(**options))
+
+
+@pytest.mark.parametrize("clients_limit", [0, -5, "many"])
+def test_bad_mount_clients_limit_is_rejected(clients_limit):
+    validate_config({"mounts": [{"path": "/a", "clients_limit": "100"}]})
+    with pytest.raises(BadConfig):
+        validate_config({"mounts": [{"path": "/a", "clients_limit": clients_limit}]})
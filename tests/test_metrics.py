@@ -0,0 +1,30 @@
+import random
+from types import SimpleNamespace
+
+from savate.metrics import ServerMetrics
+
+
+def test_queue_size_range_is_exact():
+    metrics = ServerMetrics(SimpleNamespace())
+    rng = random.Random(42)
+    sizes = {}
+    for client in range(200):
+        path = "/mount%d" % (client % 3)
+        size = rng.randrange(1 << rng.randrange(20))
+        metrics.mount(path).queue_sizes.add(size)
+        sizes[client] = (path, size)
+    for client in rng.sample(sorted(sizes), 100):
+        path, size = sizes[client]
+        new_size = rng.randrange(1 << 20)
+        metrics.mount(path).queue_sizes.move(size, new_size)
+        sizes[client] = (path, new_size)
+    for client in rng.sample(sorted(sizes), 51):
+        path, size = sizes.pop(client)
+        metrics.mount(path).queue_sizes.remove(size)
+
+    values = sorted(size for path, size in sizes.values())
+    assert metrics.queue_size_range() == (values[0], values[len(values) // 2], values[-1])
+
+
+def test_queue_size_range_without_clients():
+    assert ServerMetrics(SimpleNamespace()).queue_size_range() == (-1, -1, -1)
@@ -0,0 +1,49 @@
+import logging
+import socket
+import time
+from types import SimpleNamespace
+
+from savate import looping, relay
+from savate.timeouts import Timeouts
+
+
+def make_server():
+    server = SimpleNamespace(loop=looping.IOLoop(), logger=logging.getLogger("savate-test"))
+    server.timeouts = Timeouts(server)
+    server.relay_scheduler = relay.RelayScheduler(server)
+    server.loop.register(server.timeouts, looping.POLLIN)
+    return server
+
+
+def addr_info(address):
+    return (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, 8000))
+
+
+def test_hedged_connects_are_staggered(monkeypatch):
+    attempts = []
+
+    class Attempt:
+        def __init__(self, group, addr_info):
+            self.addr_info = addr_info
+            attempts.append((addr_info, time.time()))
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(relay, "HedgedHTTPRelay", Attempt)
+    server = make_server()
+    group = relay.HedgedRelayGroup(server, "http://origin:8000/stream", "/stream")
+    group.addr_infos = [addr_info("192.0.2.1"), addr_info("192.0.2.2"), addr_info("192.0.2.3")]
+
+    group.connect()
+    assert len(attempts) == 1
+    deadline = time.time() + 5 * group.CONNECT_DELAY
+    while len(attempts) < 3 and time.time() < deadline:
+        server.loop.once(group.CONNECT_DELAY)
+    group.close()
+
+    assert [attempt[0] for attempt in attempts] == group.addr_infos
+    for (_, previous), (_, started) in zip(attempts, attempts[1:]):
+        # Timers are set from the loop's idea of the current time, which
+        # may lag a little behind
+        assert 0.8 * group.CONNECT_DELAY <= started - previous < 2 * group.CONNECT_DELAY
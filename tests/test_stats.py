@@ -0,0 +1,39 @@
+import json
+import logging
+from types import SimpleNamespace
+
+from savate.stats import BufferedAccessLogger
+
+
+def make_server(now):
+    return SimpleNamespace(loop=SimpleNamespace(now=lambda: now), logger=logging.getLogger("savate-test"))
+
+
+def make_request_parser():
+    return SimpleNamespace(
+        request_method=b"GET",
+        request_path=b"/stream",
+        http_version=b"HTTP/1.1",
+        headers={b"User-Agent": b"test"},
+    )
+
+
+def read_records(server, tmp_path, **kwargs):
+    log_path = tmp_path / "access.log"
+    access_logger = BufferedAccessLogger(server, file=str(log_path), format="json")
+    access_logger.request_out(make_request_parser(), None, ("192.0.2.1", 4242), **kwargs)
+    access_logger.close()
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+
+def test_json_duration_is_time_since_connection(tmp_path):
+    now = 1700000000.0
+    (record,) = read_records(make_server(now), tmp_path, size=1024, connect_time=now - 12.5)
+    assert record["duration"] == 12.5
+    assert record["size"] == 1024
+    assert record["address"] == "192.0.2.1"
+
+
+def test_json_duration_without_connect_time(tmp_path):
+    (record,) = read_records(make_server(1700000000.0), tmp_path)
+    assert record["duration"] is None